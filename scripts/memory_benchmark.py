@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+'''
+Peak Python memory (tracemalloc) of the new-files and excluded-files checks on a generated tree.
+The checks stream paths, so the peak should stay flat however many files the tree holds.
+
+usage: scripts/memory_benchmark.py [--files 2000000] [--excluded-share 0.1] [--max-peak-mb 32] [--keep FOLDER]
+'''
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+import common
+
+FILES_PER_FOLDER = 1000
+
+def generate_tree(root, file_count, excluded_share):
+    '''file_count empty files, FILES_PER_FOLDER to a folder, excluded_share of them under node_modules folders'''
+    folder_count = max(1, file_count // FILES_PER_FOLDER)
+    excluded_folders = int(folder_count * excluded_share)
+    written = 0
+    for folder_index in range(folder_count):
+        if folder_index < excluded_folders:
+            folder = os.path.join(root, f'project{folder_index % 100}', 'node_modules', f'package{folder_index}')
+        else:
+            folder = os.path.join(root, f'project{folder_index % 100}', 'src', f'module{folder_index}')
+        os.makedirs(folder, exist_ok=True)
+        for file_index in range(min(FILES_PER_FOLDER, file_count - written)):
+            os.close(os.open(os.path.join(folder, f'file{file_index}.txt'), os.O_CREAT | os.O_WRONLY, 0o644))
+        written += FILES_PER_FOLDER
+        if folder_index % 100 == 0:
+            print(f'\rgenerating: {min(written, file_count)}/{file_count}', end='', flush=True)
+    print()
+
+def measure(label, fn):
+    tracemalloc.start()
+    start = time.time()
+    result = fn()
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label}: {result} in {elapsed:.1f}s, peak {peak/(1024*1024):.1f} MB')
+    return peak
+
+def main():
+
+    parser = argparse.ArgumentParser(description='tracemalloc benchmark of the streaming path checks')
+    parser.add_argument('--files', type=int, default=2000000)
+    parser.add_argument('--excluded-share', type=float, default=0.1)
+    parser.add_argument('--max-peak-mb', type=float, default=32)
+    parser.add_argument('--keep', help='generate into (and reuse) this folder instead of a temporary one')
+    args = parser.parse_args()
+
+    root = args.keep or tempfile.mkdtemp(prefix='bckt-membench-')
+    cache_folder = tempfile.mkdtemp(prefix='bckt-membench-cache-')
+    common.LOCAL_STATS_CACHE_FILE = os.path.join(cache_folder, 'local-stats-cache')
+
+    try:
+        if not os.path.isdir(os.path.join(root, 'project0')):
+            generate_tree(root, args.files, args.excluded_share)
+
+        since = datetime.now() - timedelta(days=1)
+        excludes = 'node_modules'
+
+        peaks = [
+            measure('new files', lambda: common.get_new_files_since_timestamp('membench', root, since, excludes=excludes, no_cache=True)),
+            measure('excluded files', lambda: common.get_path_excluded_files('membench', root, excludes, no_cache=True))
+        ]
+
+        peak_mb = max(peaks) / (1024*1024)
+        if peak_mb > args.max_peak_mb:
+            print(f'FAIL peak {peak_mb:.1f} MB is over {args.max_peak_mb} MB')
+            return 1
+        print(f'ok peak {peak_mb:.1f} MB (max {args.max_peak_mb} MB)')
+        return 0
+
+    finally:
+        shutil.rmtree(cache_folder, ignore_errors=True)
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#!/bin/bash 
+
+# -- startup budget for commands that read local state only: they should not pay for
+# -- boto3, a database driver they don't use or a target scan
+# -- the budget is for bckt's own time, over and above a bare interpreter starting on the same machine
+# -- usage: scripts/startup_benchmark.sh [command ...]   (BUDGET_MS, RUNS to override)
+
+BUDGET_MS=${BUDGET_MS:=150}
+RUNS=${RUNS:=5}
+COMMANDS=${@:-help info status}
+HEAVY_MODULES="boto3|botocore|mariadb|tarfile|socketserver"
+
+SRC_FOLDER=$(cd $(dirname $0)/../src && pwd)
+IMPORTTIME_LOG=$(mktemp)
+FAILED=0
+
+# -- best of RUNS, wall clock for the whole process 
+function best_ms() {
+  BEST_MS=
+  for RUN in $(seq ${RUNS}); do 
+    START_NS=$(date +%s%N)
+    python3 "$@" > /dev/null 2>&1
+    END_NS=$(date +%s%N)
+    ELAPSED_MS=$(( (END_NS - START_NS) / 1000000 ))
+    if [[ -z "${BEST_MS}" || ${ELAPSED_MS} -lt ${BEST_MS} ]]; then 
+      BEST_MS=${ELAPSED_MS}
+    fi 
+  done 
+  echo ${BEST_MS}
+}
+
+pushd ${SRC_FOLDER} > /dev/null
+
+BASELINE_MS=$(best_ms -c pass)
+echo "bare interpreter: ${BASELINE_MS} ms"
+
+for COMMAND in ${COMMANDS}; do 
+
+  TOTAL_MS=$(best_ms backup.py ${COMMAND})
+  BEST_MS=$(( TOTAL_MS - BASELINE_MS ))
+
+  python3 -X importtime backup.py ${COMMAND} > /dev/null 2> ${IMPORTTIME_LOG}
+  HEAVY=$(grep "import time:" ${IMPORTTIME_LOG} | awk -F'|' '{ print $3 }' | sed 's/^ *//' | grep -E "^(${HEAVY_MODULES})$" | tr '\n' ' ')
+
+  if [[ ${BEST_MS} -gt ${BUDGET_MS} ]]; then 
+    echo "FAIL bckt ${COMMAND}: ${BEST_MS} ms (${TOTAL_MS} ms total, budget ${BUDGET_MS} ms)"
+    echo "  slowest imports (cumulative us):"
+    grep "import time:" ${IMPORTTIME_LOG} | sort -t'|' -k2 -n | tail -n 10 | sed 's/^/    /'
+    FAILED=1
+  else 
+    echo "ok   bckt ${COMMAND}: ${BEST_MS} ms (${TOTAL_MS} ms total, budget ${BUDGET_MS} ms)"
+  fi 
+
+  if [[ -n "${HEAVY}" ]]; then 
+    echo "FAIL bckt ${COMMAND} imported: ${HEAVY}"
+    FAILED=1
+  fi 
+
+done 
+
+popd > /dev/null
+rm -f ${IMPORTTIME_LOG}
+
+exit ${FAILED}
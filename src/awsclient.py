@@ -1,21 +1,67 @@
 import cowpy 
-import boto3
 import os
 import math
 from enum import Enum 
 import json 
 import base64
+import hashlib
 from contextlib import contextmanager
-from datetime import datetime 
-from pytz import timezone 
-from common import get_path_uncompressed_size_kb, human, frequency_to_minutes, time_since
+from datetime import datetime, timezone 
+from common import get_path_uncompressed_size_kb, human, frequency_to_minutes, time_since, target_name_from_archive_filename, volume_archive_filename
 from cache import Cache, CacheType
 
-UTC = timezone('UTC')
+UTC = timezone.utc
 TARGET_CACHE_FILE = f'/tmp/bckt.cache'
 
 REMOTE_STORAGE_COST_GB_PER_MONTH = 0.00099
 
+# -- push_archive uploads anything smaller than the threshold in one part, so its ETag is its md5
+MULTIPART_THRESHOLD = 4*1024*1024*1024
+MULTIPART_CHUNKSIZE = 8*1024*1024
+MULTIPART_MAX_PARTS = 10000
+
+# -- chunk packs and index of dedup targets, never named like an archive so listings pass them over
+CHUNK_STORE_PREFIX = 'bckt-chunks'
+
+def storage_cost_per_month(size_bytes):
+    return REMOTE_STORAGE_COST_GB_PER_MONTH*(size_bytes / (1024 ** 3))
+
+def multipart_chunksize(size_bytes):
+    '''Part size of a push_archive upload, or None if it goes up in one part. The transfer manager doubles the part size until the parts fit S3's limit'''
+    if size_bytes < MULTIPART_THRESHOLD:
+        return None
+    chunksize = MULTIPART_CHUNKSIZE
+    while math.ceil(size_bytes / chunksize) > MULTIPART_MAX_PARTS:
+        chunksize *= 2
+    return chunksize
+
+class MultipartEtag(object):
+    '''The ETag S3 gives a multipart upload (md5 of the part md5s, then the part count), from the file's bytes'''
+
+    chunksize = None
+
+    def __init__(self, chunksize):
+        self.chunksize = chunksize
+        self._parts = []
+        self._part = hashlib.md5()
+        self._part_length = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            take = min(len(view), self.chunksize - self._part_length)
+            self._part.update(view[:take])
+            self._part_length += take
+            view = view[take:]
+            if self._part_length == self.chunksize:
+                self._parts.append(self._part.digest())
+                self._part = hashlib.md5()
+                self._part_length = 0
+
+    def hexdigest(self):
+        parts = self._parts + ([ self._part.digest() ] if self._part_length else [])
+        return f'{hashlib.md5(b"".join(parts)).hexdigest()}-{len(parts)}'
+
 class PushStrategy(Enum):
     BUDGET_PRIORITY = 'budget_priority' # -- cost setting ultimately drives whether an archive is pushed remotely 
     SCHEDULE_PRIORITY = 'schedule_priority'
@@ -49,7 +95,10 @@ class AwsClient:
 
     @contextmanager
     def archivebucket(self, bucket_name):
-        s3 = boto3.resource('s3')
+        # -- boto3 takes longer to import than most commands take to run, so only when S3 is used
+        import boto3
+        # -- a session per use, the default session is not safe to share between run --jobs threads
+        s3 = boto3.session.Session().resource('s3')
         archive_bucket = s3.Bucket(bucket_name)
         self.logger.debug(f'S3 bucket yield out')
         time_out = datetime.now()    
@@ -59,12 +108,13 @@ class AwsClient:
         self.logger.debug(f'S3 bucket calculation time: {"%.1f" % (time_in - time_out).total_seconds()} seconds')
 
     def get_object_storage_cost_per_month(self, size_bytes):
-        return REMOTE_STORAGE_COST_GB_PER_MONTH*(size_bytes / (1024 ** 3))
+        return storage_cost_per_month(size_bytes)
 
-    def is_push_due(self, target, remote_stats=None, last_archive=None, aged_archives=0, print=True):
+    def is_push_due(self, target, remote_stats=None, last_archive=None, aged_archives=0, print=True, archives=None):
         '''According to the target push strategy, budget, and the objects already remotely stored, could an(y) archive be pushed?'''
         
-        archives = self.db.get_archives(target.name)
+        if archives is None:
+            archives = self.db.get_archives(target.name)
 
         push_due = False 
         message = 'No calculation was performed to determine push eligibility. The default is no.'
@@ -74,11 +124,11 @@ class AwsClient:
             remote_stats = self.get_remote_stats([target])
             remote_stats = remote_stats[target.name]
             
-        last_modified = UTC.localize(datetime.strptime(remote_stats['max_last_modified'], '%c')) if remote_stats['max_last_modified'] else None 
+        last_modified = datetime.strptime(remote_stats['max_last_modified'], '%c').replace(tzinfo=UTC) if remote_stats['max_last_modified'] else None 
         current_s3_objects = remote_stats['count']
 
         if last_modified:
-            now = UTC.localize(datetime.utcnow())
+            now = datetime.utcnow().replace(tzinfo=UTC)
             since_last_remote_object = now - last_modified
             minutes_since_last_object = (since_last_remote_object.total_seconds()*1.0) / 60
         else:
@@ -102,14 +152,19 @@ class AwsClient:
                         average_size = get_path_uncompressed_size_kb(target.path, target.excludes) / (1024.0*1024.0)
 
                 lifetime_cost = average_size * REMOTE_STORAGE_COST_GB_PER_MONTH * 6
-                max_s3_objects = math.floor(target.budget_max / lifetime_cost)
-                if max_s3_objects == 0:
-                    push_due = False 
-                    message = f'One archive has a lifetime cost of {lifetime_cost}. At a max budget of {target.budget_max}, no archives can be stored in S3'
+                if lifetime_cost == 0:
+                    # -- a dedup archive that added no new chunks costs nothing to push
+                    push_due = True 
+                    message = f'The archive adds nothing to remote storage'
                 else:
-                    minutes_per_push = (180.0*24*60) / max_s3_objects
-                    push_due = (current_s3_objects - aged_archives) < max_s3_objects and minutes_since_last_object > minutes_per_push
-                    message = f'Given a calculated size of {average_size:.1f} GB and a budget of ${target.budget_max:.2f}, a push can be accepted every {time_since(minutes_per_push)} for max {max_s3_objects} objects. It has been {time_since(minutes_since_last_object)} and there are {current_s3_objects} objects.'
+                    max_s3_objects = math.floor(target.budget_max / lifetime_cost)
+                    if max_s3_objects == 0:
+                        push_due = False 
+                        message = f'One archive has a lifetime cost of {lifetime_cost}. At a max budget of {target.budget_max}, no archives can be stored in S3'
+                    else:
+                        minutes_per_push = (180.0*24*60) / max_s3_objects
+                        push_due = (current_s3_objects - aged_archives) < max_s3_objects and minutes_since_last_object > minutes_per_push
+                        message = f'Given a calculated size of {average_size:.1f} GB and a budget of ${target.budget_max:.2f}, a push can be accepted every {time_since(minutes_per_push)} for max {max_s3_objects} objects. It has been {time_since(minutes_since_last_object)} and there are {current_s3_objects} objects.'
             
             elif target.push_strategy == PushStrategy.SCHEDULE_PRIORITY.value:
                 
@@ -170,7 +225,7 @@ class AwsClient:
 
             if method == 'upload_file':
                 from boto3.s3.transfer import TransferConfig
-                uploadconfig = TransferConfig(multipart_threshold=4*1024*1024*1024)
+                uploadconfig = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE)
                 object = bucket.upload_file(archive_path, key, Config=uploadconfig)
             elif method == 'put_object':
                 # b64_md5 = base64.b64encode(bytes(archive['md5'], 'utf-8')).decode()
@@ -186,6 +241,62 @@ class AwsClient:
 
         return object
 
+    def get_archive(self, target_name, archive_filename, archive_path):
+        '''Downloads a whole remote archive (deep archive objects must be restored first)'''
+        with self.archivebucket(self.bucket_name) as bucket:
+            from boto3.s3.transfer import TransferConfig
+            bucket.download_file(f'{target_name}/{os.path.basename(archive_filename)}', archive_path, Config=TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE))
+
+    def archive_index_key(self, target_name, index_filename):
+        '''Seek index sidecars live under their own prefix so archive listings never see them'''
+        return f'{target_name}/index/{os.path.basename(index_filename)}'
+
+    def push_archive_index(self, target_name, index_path):
+        with self.archivebucket(self.bucket_name) as bucket:
+            bucket.upload_file(index_path, self.archive_index_key(target_name, index_path))
+
+    def get_archive_index(self, target_name, index_filename):
+        '''Sidecar seek index contents, or None if it was never pushed'''
+        with self.archivebucket(self.bucket_name) as bucket:
+            try:
+                return bucket.Object(self.archive_index_key(target_name, index_filename)).get()['Body'].read().decode('ascii')
+            except bucket.meta.client.exceptions.NoSuchKey:
+                return None
+
+    def chunk_pack_key(self, pack_filename):
+        '''Chunk store packs are shared by every dedup target, under a prefix of their own'''
+        return f'{CHUNK_STORE_PREFIX}/packs/{os.path.basename(pack_filename)}'
+
+    def chunk_index_key(self):
+        return f'{CHUNK_STORE_PREFIX}/index.db'
+
+    def push_chunk_pack(self, pack_path):
+        with self.archivebucket(self.bucket_name) as bucket:
+            from boto3.s3.transfer import TransferConfig
+            bucket.upload_file(pack_path, self.chunk_pack_key(pack_path), Config=TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE))
+
+    def get_chunk_pack(self, pack_filename, pack_path):
+        with self.archivebucket(self.bucket_name) as bucket:
+            bucket.download_file(self.chunk_pack_key(pack_filename), pack_path)
+
+    def delete_chunk_packs(self, pack_filenames):
+        # -- delete_objects takes up to 1000 keys
+        keys = [ self.chunk_pack_key(f) for f in pack_filenames ]
+        for i in range(0, len(keys), 1000):
+            self._delete_objects(keys[i:i + 1000])
+
+    def push_chunk_index(self, index_path):
+        with self.archivebucket(self.bucket_name) as bucket:
+            bucket.upload_file(index_path, self.chunk_index_key())
+
+    def get_archive_range(self, target_name, archive_filename, start, end=None):
+        '''Streaming body of bytes [start, end) of a remote archive in one ranged GET (deep archive objects must be restored first)'''
+        key = f'{target_name}/{os.path.basename(archive_filename)}'
+        byte_range = f'bytes={start}-{end - 1}' if end is not None else f'bytes={start}-'
+        self.logger.debug(f'ranged read of {key}: {byte_range}')
+        with self.archivebucket(self.bucket_name) as bucket:
+            return bucket.Object(key).get(Range=byte_range)['Body']
+
     def _delete_objects(self, keys):
         if len(keys) > 0:
             with self.archivebucket(self.bucket_name) as bucket:
@@ -213,23 +324,28 @@ class AwsClient:
         
         last_object = None 
 
-        if len(s3_objects) > 0:
+        if len(object_by_last_modified) > 0:
             last_object = object_by_last_modified[max(object_by_last_modified.keys())]
 
-        now = UTC.localize(datetime.utcnow())
+        now = datetime.utcnow().replace(tzinfo=UTC)
         
         # -- s3 objects modified before (aged) or after (current) the six month window
         aged = [ 
             object_name_by_last_modified[last_modified] 
             for last_modified in object_name_by_last_modified 
-            if ((now - UTC.localize(last_modified)).total_seconds() / (60*60*24)) >= 180 
+            if ((now - last_modified.replace(tzinfo=UTC)).total_seconds() / (60*60*24)) >= 180 
         ]
         current = [ 
             object_name_by_last_modified[last_modified]
             for last_modified in object_name_by_last_modified 
-            if ((now - UTC.localize(last_modified)).total_seconds() / (60*60*24)) < 180 
+            if ((now - last_modified.replace(tzinfo=UTC)).total_seconds() / (60*60*24)) < 180 
         ]
         
+        aged_volumes = { 
+            obj['key']: [ volume['key'] for volume in obj['volumes'].values() ] 
+            for obj in object_by_last_modified.values() if obj['key'] in aged and obj.get('volumes') 
+        }
+
         return { 
             'max_last_modified': datetime.strftime(max(object_name_by_last_modified.keys()), "%c") if len(object_name_by_last_modified.keys()) > 0 else None, 
             'last_size': human(last_object['size'], 'b') if last_object else None,
@@ -237,12 +353,33 @@ class AwsClient:
             'current': current,
             'count': len(current),
             'aged': aged,
+            'aged_volumes': aged_volumes,
         }
 
-    def get_remote_stats(self, targets, no_cache=False):
+    def _object_target_name(self, obj):
+        '''Archives are keyed <target name>/<archive filename>, or sit in the bucket root'''
+        key = obj['key']
+        if key.find('/') > 0:
+            return key.split('/')[0]
+        return target_name_from_archive_filename(key)
+
+    def get_remote_inventory(self, no_cache=False):
+        '''Every remote archive from a single bucket listing, grouped by target name'''
+
+        inventory = {}
+        for obj in self.get_remote_archives(no_cache=no_cache):
+            inventory.setdefault(self._object_target_name(obj), []).append(obj)
+        return inventory 
+
+    def get_remote_stats(self, targets, no_cache=False, inventory=None):
         
         remote_stats = {}
 
+        if inventory is not None:
+            for target in targets:
+                remote_stats[target.name] = self._get_remote_stats_for_target(target, inventory.get(target.name, []))
+            return remote_stats 
+
         for target in targets:
             cache_id = self.target_cache.get_cache_id(CacheType.RemoteStats, target.name)
             target_stats = self.target_cache.cache_fetch(cache_id)
@@ -286,21 +423,47 @@ class AwsClient:
                     objects = bucket.objects.all()
                     self.logger.debug(f'skipping target name filter for {len(list(objects))} S3 objects')                
             
+            # -- only archives, not sidecars (e.g. seek indexes)
             objects = [ { 
                 'last_modified': datetime.strftime(obj.last_modified, "%c"), 
                 'size': obj.size, 
-                'key': obj.key 
-            } for obj in objects ]
+                'key': obj.key,
+                'etag': obj.e_tag.strip('"')
+            } for obj in objects if obj.key.endswith('.tar.gz') ]
+            objects = self._fold_volumes(objects)
 
             self.target_cache.cache_store(cache_id, objects)
 
         return objects 
 
+    def _fold_volumes(self, objects):
+        '''A split archive's volumes listed as one object under the archive's key, sizes summed and the volume objects kept by filename'''
+
+        folded = {}
+        archives = []
+        for obj in objects:
+            archive_filename = volume_archive_filename(obj['key'])
+            if not archive_filename:
+                archives.append(obj)
+                continue 
+            key = f'{os.path.dirname(obj["key"])}/{archive_filename}' if obj['key'].find('/') > 0 else archive_filename
+            if key not in folded:
+                folded[key] = { 'last_modified': obj['last_modified'], 'size': 0, 'key': key, 'etag': None, 'volumes': {} }
+                archives.append(folded[key])
+            archive = folded[key]
+            archive['size'] += obj['size']
+            archive['volumes'][os.path.basename(obj['key'])] = obj
+            if datetime.strptime(obj['last_modified'], "%c") > datetime.strptime(archive['last_modified'], "%c"):
+                archive['last_modified'] = obj['last_modified']
+        return archives 
+
     def cleanup_remote_archives(self, target_name, remote_stats, dry_run=True):
         if remote_stats['count'] > 0:
             self.logger.warning(f'Deleting remote archives aged out: {",".join([ key for key in remote_stats["aged"] ])}')
             if dry_run:
                 self.logger.error(f'DRY RUN -- skipping remote deletion')
             else:
-                self._delete_objects(remote_stats["aged"])
+                # -- an aged split archive goes as all of its volumes
+                aged_volumes = remote_stats.get('aged_volumes', {})
+                self._delete_objects([ volume_key for key in remote_stats["aged"] for volume_key in aged_volumes.get(key, [key]) ])
                 self.target_cache.cache_invalidate(target_name)
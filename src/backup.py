@@ -9,18 +9,29 @@ import shutil
 import sys
 import traceback 
 import math
-# import hashlib
+import re
+import hashlib
 import subprocess 
 import inspect 
 import time 
-from common import smart_precision, get_folder_free_space, calculate_archive_digest, get_path_excluded_files, target_name_from_archive_filename, pre_marker_timestamp_from_archive_filename, generate_archive_target_filename, archive_filename_match, get_new_files_since_timestamp, get_path_uncompressed_size_kb, human, stob, time_since, frequency_to_minutes, Frequency, Color
+import tempfile 
+import threading 
+import errno
+from common import ThreadContextLogger, invalidate_local_stats, smart_precision, get_folder_free_space, SpaceMonitor, DISK_RESERVE_MB, ArchiveDigest, DIGEST_BLOCK_SIZE, digest_files, target_name_from_archive_filename, pre_marker_timestamp_from_archive_filename, generate_archive_target_filename, archive_index_filename, get_new_files_since_timestamp, get_path_uncompressed_size_kb, human, stob, time_since, frequency_to_minutes, get_filesystem_coverage, COVERAGE_TOP, volume_filename, volume_archive_filename, VolumeSplit, Frequency, ArchiveFormat, Color
 from config import Config 
-from awsclient import AwsClient 
-from frank.columnizer import Columnizer
-from bcktdb import BcktDb
-
-# -- for DOCDEFER
-from frank.database.database import Database
+from manifest import Manifest, manifest_from_tar_index
+from localindex import LocalArchiveIndex
+from cleanup import plan_local_cleanup, narrow_cleanup_plan, TIER_DESCRIPTIONS
+from scheduler import Claim, ResourceScheduler, Serialized, BackgroundQueue, Throttle, path_device
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from scanner import scan_path
+from locks import LockManager, LockHeld
+from status import StatusFile, STATUS_FILENAME, summarize, status_line
+from chunkstore import is_dedup_archive_filename
+
+# -- awsclient (boto3), bcktdb (database drivers), frank.columnizer, seekable (tarfile, gzip) and daemon (socketserver)
+# -- are imported where first used, so that commands not needing them start fast
 
 MARKER_PLACEHOLDER_TEXT = f'this is a backup timestamp marker. its existence is under the control of {os.path.realpath(__file__)}'
 
@@ -30,6 +41,8 @@ class Reason(Enum):
     NOTHING_NEW = 'nothing_new'
     NOT_ACTIVE = 'not_active'
     NOT_SCHEDULED = 'not_scheduled'
+    LOCKED = 'locked'
+    FAILURE = 'failure'
     OK = 'ok'
 
 class Location(Enum):
@@ -42,6 +55,7 @@ class Location(Enum):
     REMOTE_ONLY_ORPHAN = 'remote_only_orphan'
     LOCAL_AND_REMOTE_ORPHAN = 'local_and_remote_orphan'
     LOCAL_ONLY_ORPHAN_REMOTE_UNKNOWN = 'local_only_orphan_remote_unknown'
+    CHUNK_STORE = 'chunk_store'
 
 #######################
 #
@@ -58,6 +72,7 @@ class Results(object):
             'archive_created': [],
             'not_active': [],
             'not_scheduled': [],
+            'locked': [],
             'other_failure': []
         }
     
@@ -66,6 +81,9 @@ class Results(object):
             self._results[reason] = []
         self._results[reason].append(target_name)
 
+    def reasons_for(self, target_name):
+        return [ reason for reason, target_names in self._results.items() if target_name in target_names ]
+
     def print(self):
         print('\n\nResults:')
         print(json.dumps(self._results, indent=4))
@@ -75,12 +93,21 @@ class Backup(object):
     logger = None 
     user_logger = None
     
-    db = None 
-    awsclient = None 
-    columnizer = None 
+    _db = None 
+    _awsclient = None 
+    _columnizer = None 
+    _columnizer_kwargs = None 
+    local_archive_index = None 
+    _local_index_lock = threading.Lock()
+    scheduler = None 
+    remote_inventory = None 
+    lock_manager = None 
+    chunk_store = None 
 
     verbose = False 
     sort_targets = False     
+    json_output = False 
+    create_targets = False 
 
     command = None 
     command_context = None 
@@ -111,18 +138,93 @@ class Backup(object):
         
         self.solicit()
 
-        self.db = BcktDb(config=self.config, user_logger=self.user_logger)
-        self.awsclient = AwsClient(bucket_name=self.config.s3_bucket, db=self.db, cache_filename=self.config.cache_filename)
-        self.columnizer = Columnizer(**kwargs)
+        self._columnizer_kwargs = kwargs 
         
         self.command = []
         self.command_context = self.command_index() 
     
+    @property
+    def db(self):
+        '''Connected on first use'''
+        if self._db is None:
+            from bcktdb import BcktDb
+            self._db = BcktDb(config=self.config, user_logger=self.user_logger)
+        return self._db 
+
+    @db.setter
+    def db(self, db):
+        self._db = db 
+        if self._awsclient is not None:
+            self._awsclient.db = db 
+
+    @property
+    def awsclient(self):
+        '''Created on first use'''
+        if self._awsclient is None:
+            from awsclient import AwsClient
+            self._awsclient = AwsClient(bucket_name=self.config.s3_bucket, db=self.db, cache_filename=self.config.cache_filename)
+        return self._awsclient 
+
+    @property
+    def columnizer(self):
+        if self._columnizer is None:
+            from frank.columnizer import Columnizer
+            self._columnizer = Columnizer(**self._columnizer_kwargs)
+        return self._columnizer 
+
+    def _claim(self, **kwargs):
+        '''Holds scheduler resources for the duration of a step when running concurrently, otherwise a no-op'''
+        if self.scheduler:
+            return self.scheduler.claimed(Claim(**kwargs))
+        return nullcontext()
+
+    def _local_index(self):
+        '''The working folder archive index, scanned once per command'''
+        with self._local_index_lock:
+            if not self.local_archive_index:
+                self.local_archive_index = LocalArchiveIndex(self.config.working_folder)
+            return self.local_archive_index
+
+    def _chunk_store(self):
+        '''The dedup chunk store, shared by every dedup target'''
+        if not self.chunk_store:
+            from chunkstore import ChunkStore
+            self.chunk_store = ChunkStore(self.config.chunk_store_folder or os.path.join(self.config.working_folder, 'chunks'))
+        return self.chunk_store
+
+    def _locks(self):
+        if not self.lock_manager:
+            self.lock_manager = LockManager(self.config.lock_folder or self.config.working_folder)
+        return self.lock_manager
+
+    @contextmanager
+    def _maintenance_lock(self):
+        '''Exclusive global lock, failing right away while any run holds it shared'''
+        try:
+            lock = self._locks().global_lock(exclusive=True).acquire()
+        except LockHeld as lh:
+            raise Exception(f'A backup run is in progress ({lh}), try again when it finishes')
+        try:
+            yield lock 
+        finally:
+            lock.release()
+
+    def _run_lock(self):
+        '''Shared global lock, held by every run so maintenance waits them out'''
+        try:
+            return self._locks().global_lock().acquire()
+        except LockHeld as lh:
+            self.user_logger.warning(f'Maintenance is in progress ({lh}), not running')
+            return None 
+
+    def _status_file(self):
+        return StatusFile(self.config.status_file or os.path.join(self.config.working_folder, STATUS_FILENAME))
+
     def _set_log_level(self, log_level=None):     
         if log_level is None:
             log_level = self.log_level           
-        self.logger = cowpy.getLogger(name='bckt')
-        self.user_logger = cowpy.getLogger(name='user', level=log_level)
+        self.logger = ThreadContextLogger(cowpy.getLogger(name='bckt'))
+        self.user_logger = ThreadContextLogger(cowpy.getLogger(name='user', level=log_level))
 
     def solicit(self):
         if self.config.is_no_solicit:
@@ -155,7 +257,7 @@ class Backup(object):
                 '_help': 'Database activities',
                 'init': self.initialize_database,
                 'repair': self.db_repair,
-                'writeout': self.db.dump
+                'writeout': self.dump_database
             },
             'info': self.print_header,
             'target': {
@@ -163,6 +265,7 @@ class Backup(object):
                 'add': self.create_target,
                 'edit': self.edit_target,
                 'info': self.target_info,
+                'analyze': self.analyze_target,
                 'pause': self.pause_target,
                 'unpause': self.unpause_target,
                 'list': self.print_targets,
@@ -170,6 +273,13 @@ class Backup(object):
                 'push': self.push_target_latest
             },
             'run': self.run,
+            'status': self.print_status,
+            'daemon': {
+                '_help': 'Scheduler daemon',
+                'start': self.run_daemon,
+                'status': self.daemon_status,
+                'wake': self.wake_daemon
+            },
             'archive': {
                 '_help': 'Archive activities',
                 'list': self.print_archives,
@@ -177,8 +287,17 @@ class Backup(object):
                 'prune': self.prune_archives,
                 'aggressive': self.prune_archives_aggressively,
                 'restore': self.restore_archive,
-                'fixarchives': self.db.fix_archive_filenames
+                'find': self.find_archive_files,
+                'verify': self.verify_archives,
+                'scrub': self.scrub_archives,
+                'gc': self.collect_chunks,
+                'fixarchives': self.fix_archive_filenames
             },            
+            'analyze': {
+                '_help': 'Analysis across targets',
+                'dupes': self.analyze_dupes
+            },
+            'coverage': self.analyze_coverage,
             'help': self.print_help
         }
 
@@ -210,6 +329,9 @@ class Backup(object):
                         # -- something like 
                         # q'''DOCDEFER:Database.init_db'''
                         while doc.find('DOCDEFER') == 0:
+                            # -- names the deferred docs can refer to, imported only for help
+                            from bcktdb import BcktDb
+                            from frank.database.database import Database
                             doc_location = doc.split(':')[1]
                             doc = eval(doc_location).__doc__
                     
@@ -268,8 +390,8 @@ class Backup(object):
             # -- any arguments left over after matching the command are compiled here 
             args = positional_parameters[position:] if len(positional_parameters) > position else []
             
-            # -- the 'info' command already (and only) prints the header
-            if self.command_context != self.print_header:
+            # -- the 'info' command already (and only) prints the header, and 'status' output is for machines
+            if self.command_context not in (self.print_header, self.print_status):
                 self.print_header()
 #                 self.user_logger.info(f'\n\
 # *********begin output***********\n')
@@ -329,7 +451,7 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
              targets = self.db.get_targets()
          
          self.logger.debug(f'fetching remote stats on {len(targets)} targets')
-         remote_stats = self.awsclient.get_remote_stats(targets)
+         remote_stats = self.awsclient.get_remote_stats(targets, inventory=self.remote_inventory)
          self.logger.debug(f'stats fetched')
          
          for target in targets:
@@ -341,19 +463,111 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         '''DOCDEFER:BcktDb.init'''
         self.db.init()
 
-    def create_target(self, path, target_name=None, frequency=Frequency.DAILY.value, budget=0.01, excludes=''):
+    def dump_database(self):
+        '''DOCDEFER:BcktDb.dump'''
+        self.db.dump()
+
+    def fix_archive_filenames(self):
+        '''DOCDEFER:BcktDb.fix_archive_filenames'''
+        self.db.fix_archive_filenames()
+
+    def _validate_archive_format(self, archive_format):
+        format_choices = [ f.value for f in ArchiveFormat ]
+        if archive_format not in format_choices:
+            raise Exception(f'"{archive_format}" is not a valid archive format (choose: {",".join(format_choices)})')
+
+    def _validate_full_every(self, full_every, archive_format=None):
+        if full_every is None:
+            return None 
+        if not str(full_every).isdigit():
+            raise Exception(f'"{full_every}" is not a valid number of incrementals between full archives (0 for always full)')
+        if int(full_every) > 0 and archive_format in (ArchiveFormat.SEEKABLE.value, ArchiveFormat.DEDUP.value):
+            self.user_logger.warning(f'{archive_format.capitalize()} archives are always full, --full-every applies to the tar format only')
+        return int(full_every)
+
+    def _validate_delta_min_mb(self, delta_min_mb, archive_format=None, full_every=None):
+        if delta_min_mb is None:
+            return None 
+        try:
+            delta_min_mb = float(delta_min_mb)
+        except ValueError:
+            raise Exception(f'"{delta_min_mb}" is not a valid size in MB of the smallest file to delta encode (0 for never)')
+        if delta_min_mb > 0 and archive_format not in (None, ArchiveFormat.TAR.value):
+            self.user_logger.warning(f'--delta-min-mb applies to the tar format only')
+        if delta_min_mb > 0 and full_every:
+            self.user_logger.warning(f'Incremental archives already skip unchanged files, --delta-min-mb applies to full archives only')
+        return delta_min_mb
+
+    def _validate_volumes(self, volume_split, volume_mb, archive_format=None, full_every=None, delta_min_mb=None):
+        '''Volumes are plain full tar archives, so splitting rules out the seekable and dedup formats, incrementals and deltas'''
+        if volume_split is not None:
+            split_choices = [ v.value for v in VolumeSplit ]
+            if volume_split not in split_choices:
+                raise Exception(f'"{volume_split}" is not a valid way to split archives into volumes (choose: {",".join(split_choices)})')
+            if volume_split != VolumeSplit.NONE.value:
+                if archive_format not in (None, ArchiveFormat.TAR.value):
+                    raise Exception(f'--volumes applies to the tar format only')
+                if full_every:
+                    raise Exception(f'Volume archives are always full, set --full-every 0 to split archives into volumes')
+                if delta_min_mb:
+                    raise Exception(f'Volume archives hold no deltas, set --delta-min-mb 0 to split archives into volumes')
+        if volume_mb is not None:
+            try:
+                volume_mb = float(volume_mb)
+            except ValueError:
+                raise Exception(f'"{volume_mb}" is not a valid volume size in MB')
+            if volume_mb <= 0:
+                raise Exception(f'The volume size must be more than 0 MB')
+        return volume_split, volume_mb
+
+    def create_target(self, path, target_name=None, frequency=Frequency.DAILY.value, budget=0.01, excludes='', archive_format=ArchiveFormat.TAR.value, full_every=None, delta_min_mb=None, volume_split=None, volume_mb=None):
         
         if not target_name:
             target_name = path
 
         target_name = target_name.replace('/', '-').lstrip('-').rstrip('-')
 
+        self._validate_archive_format(archive_format)
+        full_every = self._validate_full_every(full_every, archive_format)
+        delta_min_mb = self._validate_delta_min_mb(delta_min_mb, archive_format, full_every)
+        (volume_split, volume_mb,) = self._validate_volumes(volume_split, volume_mb, archive_format, full_every, delta_min_mb)
+
         if self.confirm(f'Create a new target "{target_name}" at {path}?'):
             self.user_logger.info(f'Creating {target_name}..')
-            self.db.create_target(path, target_name, frequency, budget=budget, excludes=excludes)
+            self.db.create_target(path, target_name, frequency, budget=budget, excludes=excludes, archive_format=archive_format, full_every=full_every, delta_min_mb=delta_min_mb, volume_split=volume_split, volume_mb=volume_mb)
         else:
             self.user_logger.info(f'Not creating {target_name}..')
 
+    def analyze_target(self, path, parts=2, excludes=''):
+        '''Proposes splitting PATH into --parts N targets balanced by size and recent change, each a subtree with the subtrees carved out below it as excludes. With --create, creates them.'''
+
+        from splitter import collect_subtrees, propose_split, CHANGE_WINDOW_DAYS
+
+        path = os.path.abspath(path)
+        root = collect_subtrees(path, excludes or None, one_file_system=self.one_file_system)
+        self.user_logger.info(f'{path}: {root.total["files"]} files, {human(root.total["bytes"], "b")}, {human(root.total["changed_bytes"], "b")} changed in the last {CHANGE_WINDOW_DAYS} days')
+
+        proposal = propose_split(root, int(parts))
+        base_name = path.replace('/', '-').lstrip('-').rstrip('-')
+
+        for part in proposal:
+            part['path'] = os.path.join(path, part['relpath']) if part['relpath'] else path
+            part['name'] = f'{base_name}-{part["relpath"].replace("/", "-")}' if part['relpath'] else base_name
+            part['excludes'] = [ e for e in (excludes or '').split(':') if e ] + part['excludes']
+            stats = part['stats']
+            self.user_logger.info(f'{part["name"]}: {part["path"]} ({100*part["weight"]:.0f}%) {stats["files"]} files, {human(stats["bytes"], "b")}, {human(stats["changed_bytes"], "b")} changed')
+            if part['excludes']:
+                self.user_logger.info(f'    excludes: {":".join(part["excludes"])}')
+            for exclude in part['ambiguous']:
+                self.user_logger.warning(f'    "{exclude}" would also exclude other folders of that name under {part["path"]}')
+
+        if len(proposal) < int(parts):
+            self.user_logger.warning(f'Only {len(proposal)} balanced parts could be found, the tree is too uneven (or shallow) for {parts}')
+
+        if self.create_targets:
+            for part in proposal:
+                self.create_target(part['path'], target_name=part['name'], excludes=':'.join(part['excludes']))
+
     def target_info(self, target_name):
         target = self.db.get_target(name=target_name)
         self.logger.debug(target)        
@@ -371,7 +585,7 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         local_stats['local_stats']['uncompressed_size'] = human(get_path_uncompressed_size_kb(target_name, target['path'], excludes=target['excludes'], no_cache=self.no_cache), 'kb', )
         self.user_logger.info(json.dumps(local_stats, indent=4))
 
-    def edit_target(self, target_name, frequency=None, budget=None, path=None, excludes=None):
+    def edit_target(self, target_name, frequency=None, budget=None, path=None, excludes=None, archive_format=None, full_every=None, delta_min_mb=None, volume_split=None, volume_mb=None):
         '''Sets target parameters'''
 
         if frequency is not None:
@@ -379,9 +593,31 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             if frequency not in frequency_choices:
                 raise Exception(f'"{frequency}" is not a valid frequency (choose: {",".join(frequency_choices)})')
 
+        if archive_format is not None:
+            self._validate_archive_format(archive_format)
+
         # excludes = ":".join([ kwargs[k] for k in kwargs if k == "excludes" and kwargs[k][0] == "+" ]) or None 
                 
-        self.db.update_target(target_name, frequency=frequency, budget_max=budget, excludes=excludes, path=path)
+        target = self.db.get_target(name=target_name)
+
+        full_every = self._validate_full_every(full_every, archive_format or (target['archive_format'] if target else None))
+        delta_min_mb = self._validate_delta_min_mb(delta_min_mb, archive_format or (target['archive_format'] if target else None), full_every if full_every is not None else (target['full_every'] if target else None))
+
+        # -- checked against the settings the target will have once edited, as volumes rule out incrementals and deltas set earlier
+        (volume_split, volume_mb,) = self._validate_volumes(
+            volume_split if volume_split is not None else (target['volume_split'] if target else None), 
+            volume_mb, 
+            archive_format or (target['archive_format'] if target else None), 
+            full_every if full_every is not None else (target['full_every'] if target else None), 
+            delta_min_mb if delta_min_mb is not None else (target['delta_min_mb'] if target else None))
+
+        self.db.update_target(target_name, frequency=frequency, budget_max=budget, excludes=excludes, path=path, archive_format=archive_format, full_every=full_every, delta_min_mb=delta_min_mb, volume_split=volume_split, volume_mb=volume_mb)
+
+        # -- new files, excluded files and excluded size were all computed against the old path/excludes
+        if target and ((path is not None and path != target['path']) or (excludes is not None and excludes != target['excludes'])):
+            self.logger.debug(f'{target_name} path or excludes changed, invalidating cached local stats')
+            invalidate_local_stats(target_name)
+
         self.target_info(target_name)
 
     def pause_target(self, target_name):
@@ -457,32 +693,15 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
                     has_new_files = True 
                 else:
 
-                    new_file_output = get_new_files_since_timestamp(target['name'], target['path'], pre_marker_date, no_cache=self.no_cache)
-                    if log:
-                        # self.user_logger.debug(f'new files: {json.dumps(new_file_output, indent=4)}')
-                        self.user_logger.debug(f'new files: {len(new_file_output)}')
-                    all_changed_file_count = len(new_file_output)
+                    new_files = get_new_files_since_timestamp(target['name'], target['path'], pre_marker_date, excludes=target['excludes'], no_cache=self.no_cache)
 
-                    excluded_files = get_path_excluded_files(target['name'], target['path'], target['excludes'], no_cache=self.no_cache)
-                    if log:
-                        # self.user_logger.debug(f'excluded files: {json.dumps(excluded_files, indent=4)}')
-                        self.user_logger.debug(f'excluded files: {len(excluded_files)}')
-                    
-                    if log:
-                        self.user_logger.debug(f'filtering {all_changed_file_count} new files with {len(excluded_files)} excluded files')
-
-                    included_new_files = [ f for f in new_file_output if f not in excluded_files ]
-                    excluded_new_files = [ f for f in new_file_output if f in excluded_files ]
-
-                    new_file_count = len(included_new_files)
+                    new_file_count = new_files['included']
 
                     has_new_files = new_file_count > 0
 
                     if log:                        
-                        pre_marker_stamp = datetime.strftime(pre_marker_date, "%c")
-                        self.user_logger.info(f'{new_file_count} new, unexcluded, files found since {pre_marker_stamp} ({all_changed_file_count} total changed files)')
-                        self.user_logger.debug(f'included new files: {json.dumps(included_new_files, indent=4)}')
-                        self.user_logger.debug(f'excluded new files: {json.dumps(excluded_new_files, indent=4)}')
+                        self.user_logger.info(f'{new_file_count} new, unexcluded, files found since {pre_marker_stamp} ({new_files["total"]} total changed files)')
+                        self.user_logger.debug(f'new file set digest: {new_files["digest"]}')
             else:
                 has_new_files = True 
                 if log:
@@ -493,6 +712,30 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         
         return has_new_files
 
+    def plan_local_cleanup(self, needed_kb=None, target=None, aggressive=True):
+        '''One archive listing (database, remote, working folder) ranked into a deletion plan, see cleanup.plan_local_cleanup'''
+
+        archives = self.get_archives(target['name'] if target else None)
+        return plan_local_cleanup(archives, self._is_archive_local, self._is_archive_remote, needed_kb=needed_kb, aggressive=aggressive, delta_bases=self.db.get_delta_bases())
+
+    def execute_cleanup_plan(self, plan, dry_run=True):
+        '''Deletes the local archives selected by the plan, or only prints them on a dry run'''
+
+        if len(plan) == 0:
+            self.user_logger.info(f'Nothing to clean up locally')
+            return 
+
+        self.user_logger.warning(f'Cleanup plan: {len(plan)} of {len(plan.candidates)} candidate local archives, freeing {human(plan.freed_kb(), "kb")}{" of " + human(plan.needed_kb, "kb") + " needed" if plan.needed_kb is not None else ""}')
+
+        for candidate in plan.selected:
+            archive = candidate['archive']
+            message = f'Deleting local {archive["target_name"]}/{archive["filename"]} ({human(archive["size_kb"], "kb")}, {TIER_DESCRIPTIONS[candidate["tier"]]})'
+            if dry_run:
+                self.user_logger.warning(f'[ DRY RUN ] {message}')
+            else:
+                self.user_logger.warning(message)
+                self._local_index().unlink(archive["filename"])
+
     def cleanup_local_archives(self, target=None, aggressive=False, dry_run=True):
         '''
         baseline: keep a minimum number of recent versions, delete anything over and/or older than a margin
@@ -503,78 +746,12 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             delete anything local that has a copy remote 
         '''
 
-        targets = []
-        if target:
-            targets = [target]
-        else:
-            targets = self.db.get_targets()
-        
-        archives = self.get_archives()
+        plan = self.plan_local_cleanup(target=target, aggressive=aggressive)
+        self.execute_cleanup_plan(plan, dry_run=dry_run)
 
-        if dry_run and not target:
-            self.user_logger.warning(f'Examining {len(targets)} targets to determine possible space made available by cleanup ({ "not " if not aggressive else "" }aggressive).')
-        
-        self.logger.debug(f'creating cleanup-by-target tracking dict from {len(targets)} targets')
+        cleaned_up_by_target = plan.freed_by_target()
         
-        cleaned_up_by_target = { t["name"]: 0 for t in targets }
-
-        for t in targets:        
-
-            target_archives = [ a for a in archives if a['target_id'] == t['id'] ]        
-            
-            archives_newest_first = sorted(target_archives, key=lambda a: a['pre_marker_timestamp'])
-            archives_newest_first.reverse()     
-            minimum_to_keep = 1 if aggressive else 3
-            found = 0
-
-            if dry_run and target:
-                self.user_logger.warning(f'Examining {len(archives_newest_first)} ({target["name"]}) archives to determine possible space made available by cleanup ({ "not " if not aggressive else "" }aggressive).')
-        
-            for archive in archives_newest_first:
-
-                cleaned_up_aggressively = False 
-                
-                # -- two places aggressive comes into play 
-                # -- 1. only aggressive will remove _all_ local archives for a target 
-                # -- as long as there is also a remote copy (non-aggressive will only 
-                # -- clean up to within "minimum to keep", allowing local copies even 
-                # -- if a remote copy exists)
-                # -- 2. aggressive will lower the "minimum to keep" from 3 to 1
-                # -- so non-aggressive will allow up to 3 local archives for each target 
-                # -- aggressive will potentially remove every local archive, as long 
-                # -- as at least one archive exists remotely 
-                # -- TODO: check that aggressive will in fact remove all local archives 
-                # -- it may be keeping one 
-                
-                if aggressive:
-                    if archive['location'] == Location.LOCAL_AND_REMOTE:
-                        cleaned_up_by_target[t['name']] += archive['size_kb']
-                        cleaned_up_aggressively = True 
-                        message = f'Archive {archive["name"]}/{archive["filename"]} is both remote and local. Deleting local copy.'
-                        if dry_run:
-                            self.user_logger.warning(f'[ DRY RUN ] {message}')
-                        else:
-                            self.user_logger.warning(message)
-                            os.unlink(os.path.join(self.config.working_folder, archive["filename"]))            
-
-                if not cleaned_up_aggressively and os.path.exists(os.path.join(self.config.working_folder, archive["filename"])):                
-                    if found < minimum_to_keep:
-                        message = f'Keeping newer file {archive["filename"]}'
-                        if dry_run:
-                            self.user_logger.info(f'[ DRY RUN ] {message}')
-                        else:
-                            self.user_logger.info(message)
-                        found += 1
-                    else:
-                        cleaned_up_by_target[t['name']] += archive['size_kb']
-                        message = f'Deleting file {os.path.join(self.config.working_folder, archive["filename"])}'
-                        if dry_run:
-                            self.user_logger.error(f'[ DRY RUN ] {message}')
-                        else:
-                            self.user_logger.error(message)
-                            os.unlink(os.path.join(self.config.working_folder, archive["filename"]))
-        
-        return cleaned_up_by_target[target['name']] if target else cleaned_up_by_target
+        return cleaned_up_by_target.get(target['name'], 0) if target else cleaned_up_by_target
     
     def _create_working_folder(self):
         if not os.path.isdir(self.config.working_folder):
@@ -587,12 +764,36 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             precursors (frequency, active status), however does account for delta-on-disk and 
             honors budget constraints for remote storage
         '''
-        
-        target = self.db.get_target(name=target_name)
-        
+
         if not results:
             results = Results()
 
+        run_lock = self._run_lock()
+        if not run_lock:
+            results.log(target_name, 'locked')
+            return 
+
+        try:
+            # -- another process already on this target: skip now rather than duplicate the work
+            try:
+                target_lock = self._locks().target_lock(target_name).acquire()
+            except LockHeld as lh:
+                self.user_logger.warning(f'{target_name} is locked ({lh}), skipping')
+                results.log(target_name, 'locked')
+                self.db.set_target_last_reason(target_name, Reason.LOCKED)
+                return 
+
+            try:
+                self._add_archive(target_name, results)
+            finally:
+                target_lock.release()
+        finally:
+            run_lock.release()
+
+    def _add_archive(self, target_name, results):
+        
+        target = self.db.get_target(name=target_name)
+
         if not self.target_has_new_files(target):
             self.user_logger.warning(f'No new files for {target_name}. Skipping archive creation.')
             results.log(target_name, 'no_new_files')
@@ -642,30 +843,56 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
 
             self.user_logger.error(f'This target is {human(additional_space_needed, "kb")} bigger than what is available on the filesystem.')
 
-            space_freed_by_cleanup = self.cleanup_local_archives(aggressive=False, dry_run=True)
-            space_sum = sum([ space_freed_by_cleanup[t] for t in space_freed_by_cleanup.keys() ])
-
-            if space_sum < additional_space_needed:
+            # -- one plan across all targets: most redundant archives first, only as many as needed
+            plan = self.plan_local_cleanup(needed_kb=additional_space_needed)
 
-                self.user_logger.error(f'Even after cleaning up local archives, an additional {human(additional_space_needed - space_sum, "kb")} is still needed. Please free up space and reschedule this target as soon as possible.')
+            if not plan.is_satisfied():
+                self.user_logger.error(f'Even after aggressively cleaning up local archives, an additional {human(additional_space_needed - plan.freed_kb(), "kb")} is still needed. Please free up space and reschedule this target as soon as possible.')
+                results.log(target_name, 'insufficient_space')
+                self.db.set_target_last_reason(target_name, Reason.DISK_FULL)
+                return 
 
-                space_freed_by_cleanup = self.cleanup_local_archives(aggressive=True, dry_run=True)
-                space_sum = sum([ space_freed_by_cleanup[t] for t in space_freed_by_cleanup.keys() ])
-                
-                if space_sum < additional_space_needed:
-                    self.user_logger.error(f'Even after aggressively cleaning up local archives, an additional {human(additional_space_needed - space_sum, "kb")} is still needed. Please free up space and reschedule this target as soon as possible.')
-                    results.log(target_name, 'insufficient_space')
-                    self.db.set_target_last_reason(target_name, Reason.DISK_FULL)
-                    return 
-                else:
-                    self.user_logger.warning(f'Cleaning up old local archives aggressively will free {human(space_sum, "kb")}. Proceeding with cleanup.')
-                    space_freed_by_cleanup = self.cleanup_local_archives(aggressive=True, dry_run=self.dry_run)
+            self.user_logger.warning(f'Cleaning up {len(plan)} old local archives will free {human(plan.freed_kb(), "kb")}. Proceeding with cleanup.')
+            self.execute_cleanup_plan(plan, dry_run=self.dry_run)
+        
+        # -- compressing takes a CPU, reading takes the source disk, and the expected size is reserved in the working folder
+        with self._claim(cpu=1, read_device=path_device(target['path']), space_kb=expected_archive_size):
+            if target['archive_format'] == ArchiveFormat.DEDUP.value:
+                self._create_dedup_archive(target, results, current_uncompressed_size)
+            elif target['volume_split'] in (VolumeSplit.SIZE.value, VolumeSplit.SUBTREE.value):
+                self._create_volume_archive(target, results, current_uncompressed_size)
             else:
+                self._create_archive(target, results, current_uncompressed_size)
+
+    def _tar_command(self, target):
+        '''tar and the options every tar archive of the target is written with'''
+
+        excludes = ""
+        if target["excludes"] and len(target["excludes"]) > 0:
+            excludes = f'--exclude {" --exclude ".join(target["excludes"].split(":"))}'
+        
+        archive_command = f'tar {excludes} '
 
-                self.user_logger.warning(f'Cleaning up old local archives will free {human(space_sum, "kb")}. Proceeding with cleanup.')
-                self.cleanup_local_archives(aggressive=False, dry_run=self.dry_run)
+        if self.exclude_vcs_ignores:
+            archive_command += f'--exclude-vcs-ignores '
         
+        #TODO: keep 'du' commands honest in common.py - we default to one file system, du includes 'x' -- need to make dynamic if we implement a flag
+        if self.one_file_system:
+            archive_command += f'--one-file-system '
+
+        return archive_command
+
+    def _create_archive(self, target, results, current_uncompressed_size):
+        '''Writes the archive file and its records, removing both on any failure'''
+
+        from verify import StreamVerifier
+
+        target_name = target['name']
         new_archive_id = None 
+        index_file = None 
+        snapshot_folder = None 
+        delta_folder = None 
+        target_file = None 
 
         try:
             
@@ -675,26 +902,57 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
 
             self.user_logger.info(f'Creating archive for {target["name"]}: {target_file}')
 
-            excludes = ""
-            if target["excludes"] and len(target["excludes"]) > 0:
-                excludes = f'--exclude {" --exclude ".join(target["excludes"].split(":"))}'
-            
-            archive_command = f'tar {excludes} '
+            archive_command = self._tar_command(target)
 
-            if self.exclude_vcs_ignores:
-                archive_command += f'--exclude-vcs-ignores '
-            
-            #TODO: keep 'du' commands honest in common.py - we default to one file system, du includes 'x' -- need to make dynamic if we implement a flag
-            if self.one_file_system:
-                archive_command += f'--one-file-system '
+            is_seekable = target['archive_format'] == ArchiveFormat.SEEKABLE.value
 
-            archive_command += f'-czf {target_file} {target["path"]}'
+            # -- the seekable writer has no listed-incremental equivalent, so those targets are always full
+            (parent_archive, level,) = self._next_chain_link(target) if not is_seekable else (None, None)
+
+            if level is not None:
+                snapshot_folder = tempfile.mkdtemp(prefix=f'bckt-{target["name"]}-snapshot-')
+                snapshot_file = os.path.join(snapshot_folder, 'snapshot')
+                if parent_archive:
+                    # -- tar updates the snapshot in place, so it works on a copy of the parent's
+                    with open(snapshot_file, 'wb') as f:
+                        f.write(self.db.get_snapshot(parent_archive['id']))
+                    self.user_logger.info(f'Writing a level {level} incremental on archive {parent_archive["id"]}')
+                else:
+                    self.user_logger.info(f'Writing a full (level 0) archive, starting a new chain')
+                archive_command += f'--listed-incremental={snapshot_file} '
+
+            # -- large files go in as deltas against the version in an earlier archive, full archives only
+            deltas = []
+            rebase_paths = []
+            if not is_seekable and level is None and float(target['delta_min_mb'] or 0) > 0 and not self.dry_run:
+                delta_folder = tempfile.mkdtemp(prefix=f'bckt-{target["name"]}-delta-')
+                (deltas, rebase_paths,) = self._encode_deltas(target, delta_folder)
+                if deltas:
+                    archive_command += f'--exclude-from={os.path.join(delta_folder, "excludes")} '
+
+            if not is_seekable:
+                # -- tar's own verbose listing of what it wrote becomes the archive manifest
+                index_fd, index_file = tempfile.mkstemp(prefix=f'bckt-{target["name"]}-', suffix='.index')
+                os.close(index_fd)
+                archive_command += f'-vv --full-time --quoting-style=escape --index-file={index_file} '
+
+            # -- tar writes to stdout so the digest is taken as the archive is written, not by reading it back
+            archive_command += f'-cz -f - {target["path"]}'
+
+            if deltas:
+                from delta import DELTA_FOLDER
+                archive_command += f' -C {delta_folder} {DELTA_FOLDER}'
 
             # -- strip off microseconds as this is lost when creating the marker file and will prevent the assocation with the archive record
             pre_timestamp_fmt = datetime.strptime(datetime.strftime(pre_timestamp, "%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
 
+            digest = ArchiveDigest(self.config.checksum_algorithm)
+            verifier = StreamVerifier()
+
             if self.dry_run:
-                self.logger.info(f'[ DRY RUN ] Running archive command: {archive_command}')
+                if is_seekable:
+                    archive_command = f'seekable archive of {target["path"]} (excludes: {target["excludes"]})'
+                self.logger.info(f'[ DRY RUN ] Running archive command: {archive_command} > {target_file}')
                 # self.update_markers(target, pre_timestamp)
                 results.log(target_name, 'archive_created')
                 # self.db.set_target_last_reason(target_name, Reason.OK)
@@ -702,53 +960,85 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
                 self.user_logger.success(f'[ DRY RUN ] Archive record {new_archive_id if new_archive_id else "[n/a]"} created for {target_file}')            
                 self.user_logger.success(f'[ DRY RUN ] Created {target["name"]} archive: {target_file}')
                 
+            elif is_seekable:
+                self.logger.info(f'Writing seekable archive {target_file} (frames of {human(self._seekable_frame_size(), "b")})')
+
+                with self._digest_and_verify(digest, verifier) as on_block:
+                    seek_index, manifest, archive_errors = self._write_seekable_archive(target, target_file, on_block)
+                returncode = 0
+                disk_full = False 
+
+                post_timestamp_fmt = datetime.strptime(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+
             else:
-                self.logger.info(f'Running archive command: {archive_command}')
-                cp = subprocess.run(archive_command.split(' '), capture_output=True)
+                self.logger.info(f'Running archive command: {archive_command} > {target_file}')
+                # -- what cleanup could free is listed once, not while tar is running
+                room_plan = self.plan_local_cleanup()
+                # -- an incremental reads only what changed, an unknown share of the target's size
+                monitor = self._space_monitor(current_uncompressed_size*1024 if not level else None, lambda: (verifier.file_bytes, verifier.compressed_bytes), room_plan)
+                with self._digest_and_verify(digest, verifier) as on_block:
+                    returncode, archive_errors, disk_full = self._write_tar_archive(archive_command, target_file, on_block, monitor=monitor)
 
                 # -- to monitor the archive as it grows and display progress:
                 # sudo find {self.working_folder} -name "{target_name}_[0-9]*.tar.gz" | sort -n | tail -n 1 | xargs stat | grep Size | awk '{ print $2 }'
 
                 post_timestamp_fmt = datetime.strptime(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
 
-                self.logger.warning(cp.args)            
-                self.logger.warning(f'Archive returncode: {cp.returncode}')
-                if cp.stdout:
-                    self.logger.warning(cp.stdout)
-                if cp.stderr:
-                    self.logger.error(cp.stderr)
-                archive_errors = str(cp.stderr)
-
-                cp = subprocess.run(f'tar --test-label -f {target_file}'.split(' '), capture_output=True)
-                self.logger.warning(cp.args)
-                self.logger.warning(f'Archive test returncode: {cp.returncode}')
-                if cp.stderr:
-                    self.logger.error(cp.stderr)
-                
-                cp.check_returncode()
+                self.logger.warning(f'Archive returncode: {returncode}')
+                if archive_errors:
+                    self.logger.error(archive_errors)
+
+                manifest = None 
+                try:
+                    manifest = manifest_from_tar_index(index_file)
+                except:
+                    self.logger.error(f'Failed to read the tar index {index_file}, verifying without a manifest')
+                    self.logger.exception()
 
-                if archive_errors.find("No space left on device") >= 0:
+            if not self.dry_run:
+
+                if disk_full:
                     results.log(target_name, 'insufficient_space')
                     self.db.update_target(target_name, last_reason=Reason.DISK_FULL.value)
                     # self.db.set_target_last_reason(target_name, Reason.DISK_FULL)
                     raise Exception("Insufficient space while archiving. Archive target file (assumed partial) will be deleted. Please clean up the disk and reschedule this target as soon as possible.")
+
+                if not verifier.finish(manifest):
+                    raise Exception(f'Archive {target_file} failed verification and will be deleted: {"; ".join(verifier.errors)}')
+                self.user_logger.info(f'Verified {verifier.summary()}')
+                for warning in verifier.warnings:
+                    self.user_logger.warning(f'Verification: {warning}')
                 
                 target_file_stat = shutil.os.stat(target_file)
+                self._local_index().added(target_file)
                 
-                digest = calculate_archive_digest(target_file)
+                self.logger.debug(f'Archive digest: {digest.md5} {digest.checksum or ""}')
 
                 new_archive_id = self.db.create_archive(
                     target_id=target['id'], 
                     size_kb=target_file_stat.st_size/1024.0, 
                     filename=target_file, 
-                    returncode=cp.returncode, 
+                    returncode=returncode, 
                     errors=archive_errors, 
                     pre_marker_timestamp=pre_timestamp_fmt,
-                    digest=digest,
-                    uncompressed_size_kb=current_uncompressed_size)
+                    digest=digest.md5,
+                    checksum=digest.checksum,
+                    uncompressed_size_kb=current_uncompressed_size,
+                    verified_at=datetime.now(),
+                    level=level,
+                    parent_id=parent_archive['id'] if parent_archive else None)
                 
                 if new_archive_id is None:
                     self.logger.warning(f'No new record ID was retrieved from the archive creation but the insert itself did not fail')
+                elif is_seekable:
+                    self._record_seek_index(new_archive_id, target_file, seek_index)
+                    self._record_manifest(new_archive_id, manifest=manifest)
+                else:
+                    self._record_manifest(new_archive_id, index_file, manifest=manifest)
+                    if level is not None:
+                        with open(snapshot_file, 'rb') as f:
+                            self.db.create_snapshot(new_archive_id, f.read())
+                    self._record_deltas(target, new_archive_id, target_file, deltas, rebase_paths)
 
                 self.db.update_target(target_name, pre_marker_at=pre_timestamp_fmt, post_marker_at=post_timestamp_fmt, last_reason=Reason.OK.value)
 
@@ -782,7 +1072,448 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             if target_file and os.path.exists(target_file):
                 self.logger.error(f'Removing archive file {target_file}')
                 os.unlink(target_file)
+                self._local_index().removed(target_file)
+        finally:
+            if index_file and os.path.exists(index_file):
+                os.unlink(index_file)
+            if snapshot_folder:
+                shutil.rmtree(snapshot_folder, ignore_errors=True)
+            if delta_folder:
+                shutil.rmtree(delta_folder, ignore_errors=True)
+
+    def _create_dedup_archive(self, target, results, current_uncompressed_size):
+        '''Chunks the target into the chunk store and records the archive, its recipe standing in for the file'''
+
+        from chunkstore import dedup_archive_filename
+
+        target_name = target['name']
+        new_archive_id = None 
+        errors = []
+
+        def on_error(path, error):
+            self.logger.warning(f'Skipping {path}: {error}')
+            errors.append(f'{path}: {error}')
+
+        pre_timestamp = datetime.now() 
+        pre_timestamp_fmt = datetime.strptime(datetime.strftime(pre_timestamp, "%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+        archive_filename = dedup_archive_filename(generate_archive_target_filename(target, pre_timestamp))
+
+        self.user_logger.info(f'Creating dedup archive for {target_name}: {archive_filename}')
+
+        if self.dry_run:
+            self.logger.info(f'[ DRY RUN ] Chunking {target["path"]} (excludes: {target["excludes"]}) into {self._chunk_store().folder}')
+            results.log(target_name, 'archive_created')
+            return 
+
+        if self.exclude_vcs_ignores:
+            self.user_logger.warning(f'VCS ignore files are not honored by the dedup format')
+
+        try:
+            store = self._chunk_store()
+            with store.writing():
+                entries = scan_path(target['path'], target['excludes'], one_file_system=self.one_file_system, on_error=on_error)
+                manifest, stats = store.write_archive(archive_filename, entries, on_error=on_error)
+
+                post_timestamp_fmt = datetime.strptime(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+
+                # -- the archive costs only the chunks it added, which is what size_kb (and so the budget) sees
+                new_archive_id = self.db.create_archive(
+                    target_id=target['id'], 
+                    size_kb=stats['new_bytes']/1024.0, 
+                    filename=archive_filename, 
+                    returncode=0, 
+                    errors="\n".join(errors), 
+                    pre_marker_timestamp=pre_timestamp_fmt,
+                    uncompressed_size_kb=current_uncompressed_size)
+
+            self.user_logger.info(f'Chunked {stats["files"]} files ({human(stats["bytes"], "b")}): {stats["new_chunks"]} of {stats["chunks"]} chunks new, {human(stats["new_bytes"], "b")} stored')
+
+            if new_archive_id is not None:
+                self._record_manifest(new_archive_id, manifest=manifest)
+
+            self.db.update_target(target_name, pre_marker_at=pre_timestamp_fmt, post_marker_at=post_timestamp_fmt, last_reason=Reason.OK.value)
+            results.log(target_name, 'archive_created')
+            self.user_logger.success(f'Created {target_name} dedup archive {new_archive_id}: {archive_filename}')
+
+        except:
+            self.logger.exception()
+            # -- chunks written before the failure stay, unreferenced until gc
+            if new_archive_id:
+                self.logger.error(f'Removing archive record {new_archive_id}')
+                self.db.delete_archive(new_archive_id)
+
+    def _create_volume_archive(self, target, results, current_uncompressed_size):
+        '''
+        Writes the archive as volumes, each an independent tar.gz of its share of the target with its
+        own digest and verification, then one archive record with a child row per volume. Volumes are
+        written one after another, within the one CPU the archive claimed.
+        '''
+
+        from verify import StreamVerifier
+        from volumes import plan_volumes, VOLUME_MB
+
+        target_name = target['name']
+        new_archive_id = None 
+        list_folder = None 
+        volume_files = []
+        errors = []
+
+        def on_error(path, error):
+            self.logger.warning(f'Skipping {path}: {error}')
+            errors.append(f'{path}: {error}')
+
+        try:
+            pre_timestamp = datetime.now() 
+            pre_timestamp_fmt = datetime.strptime(datetime.strftime(pre_timestamp, "%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+            target_file = os.path.join(self.config.working_folder, generate_archive_target_filename(target, pre_timestamp))
+
+            volume_mb = float(target['volume_mb'] or VOLUME_MB)
+            list_folder = tempfile.mkdtemp(prefix=f'bckt-{target_name}-volumes-')
+            entries = scan_path(target['path'], target['excludes'], one_file_system=self.one_file_system, on_error=on_error)
+            volumes = plan_volumes(entries, list_folder, volume_mb*1024*1024, by_subtree=target['volume_split'] == VolumeSplit.SUBTREE.value)
+
+            self.user_logger.info(f'Creating archive for {target_name} in {len(volumes)} volumes of up to {human(volume_mb, "mb")} read ({target["volume_split"]}): {target_file}')
+
+            if self.dry_run:
+                for volume in volumes:
+                    self.logger.info(f'[ DRY RUN ] Volume {volume["number"]}: {volume["files"]} files, {human(volume["bytes"], "b")}{" (" + ", ".join(volume["subtrees"]) + ")" if volume["subtrees"] else ""}')
+                results.log(target_name, 'archive_created')
+                self.user_logger.success(f'[ DRY RUN ] Created {target_name} archive: {target_file}')
+                return 
+
+            manifest = Manifest()
+            returncode = 0
+            total_bytes = sum([ v['bytes'] for v in volumes ])
+            read_bytes = 0
+            written_bytes = 0
+            # -- what cleanup could free is listed once, not while tar is running
+            room_plan = self.plan_local_cleanup()
+
+            for volume in volumes:
+                volume_file = os.path.join(self.config.working_folder, volume_filename(target_file, volume['number']))
+                index_file = os.path.join(list_folder, f'{volume["number"]:04d}.index')
+                # -- the scan already pruned excludes and other filesystems, tar only takes the listed names and does not recurse
+                archive_command = f'{self._tar_command(target)}-vv --full-time --quoting-style=escape --index-file={index_file} --no-recursion --null -T {volume["list_filename"]} -cz -f -'
+
+                digest = ArchiveDigest(self.config.checksum_algorithm)
+                verifier = StreamVerifier()
+
+                self.logger.info(f'Running archive command: {archive_command} > {volume_file}')
+                volume_files.append(volume_file)
+                # -- projected over the whole archive: what this volume has read and written on top of the volumes before it
+                monitor = self._space_monitor(total_bytes, lambda: (read_bytes + verifier.file_bytes, written_bytes + verifier.compressed_bytes), room_plan)
+                with self._digest_and_verify(digest, verifier) as on_block:
+                    volume_returncode, volume_errors, disk_full = self._write_tar_archive(archive_command, volume_file, on_block, monitor=monitor)
+                read_bytes += verifier.file_bytes
+                written_bytes += verifier.compressed_bytes
+
+                if volume_errors:
+                    self.logger.error(volume_errors)
+                    errors.append(volume_errors)
+
+                if disk_full:
+                    results.log(target_name, 'insufficient_space')
+                    self.db.update_target(target_name, last_reason=Reason.DISK_FULL.value)
+                    raise Exception("Insufficient space while archiving. Archive volumes written so far will be deleted. Please clean up the disk and reschedule this target as soon as possible.")
+
+                volume_manifest = manifest_from_tar_index(index_file)
+                if not verifier.finish(volume_manifest):
+                    raise Exception(f'Volume {volume_file} failed verification and the archive will be deleted: {"; ".join(verifier.errors)}')
+                for warning in verifier.warnings:
+                    self.user_logger.warning(f'Verification of volume {volume["number"]}: {warning}')
+
+                for path, size, mtime in volume_manifest.entries():
+                    manifest.add(path, size, mtime)
+
+                returncode = max(returncode, volume_returncode)
+                volume['filename'] = volume_file
+                volume['size_kb'] = os.stat(volume_file).st_size/1024.0
+                volume['digest'] = digest
+                self._local_index().added(volume_file)
+
+                self.user_logger.info(f'Volume {volume["number"]} of {len(volumes)}: {human(volume["size_kb"], "kb")}, verified {verifier.summary()}')
+
+            post_timestamp_fmt = datetime.strptime(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+
+            # -- the archive's own md5 stays empty, each volume carries its digest
+            new_archive_id = self.db.create_archive(
+                target_id=target['id'], 
+                size_kb=sum([ v['size_kb'] for v in volumes ]), 
+                filename=target_file, 
+                returncode=returncode, 
+                errors="\n".join(errors), 
+                pre_marker_timestamp=pre_timestamp_fmt,
+                uncompressed_size_kb=current_uncompressed_size,
+                verified_at=datetime.now())
+
+            if new_archive_id is None:
+                raise Exception(f'No new record ID was retrieved for archive {target_file}, its volumes cannot be recorded')
+
+            for volume in volumes:
+                self.db.create_volume(
+                    new_archive_id, 
+                    volume['number'], 
+                    volume['filename'], 
+                    ":".join(volume['subtrees']) or None, 
+                    volume['size_kb'], 
+                    volume['bytes']/1024.0, 
+                    volume['files'], 
+                    volume['digest'].md5, 
+                    volume['digest'].checksum)
+
+            self._record_manifest(new_archive_id, manifest=manifest)
+
+            self.db.update_target(target_name, pre_marker_at=pre_timestamp_fmt, post_marker_at=post_timestamp_fmt, last_reason=Reason.OK.value)
+            results.log(target_name, 'archive_created')
+            self.user_logger.success(f'Created {target_name} archive {new_archive_id} in {len(volumes)} volumes: {target_file}')
+
+        except:
+            self.logger.exception()
+            if new_archive_id:
+                self.logger.error(f'Removing archive record {new_archive_id}')
+                self.db.delete_archive(new_archive_id)
+            for volume_file in volume_files:
+                if os.path.exists(volume_file):
+                    self.logger.error(f'Removing volume file {volume_file}')
+                    os.unlink(volume_file)
+            if volume_files:
+                self._local_index().removed(volume_archive_filename(volume_files[0]))
+        finally:
+            if list_folder:
+                shutil.rmtree(list_folder, ignore_errors=True)
+
+    def _signature_filename(self, target, path):
+        '''Where the rsync signature of a large file's base version is kept, one folder per target'''
+        return os.path.join(self.config.working_folder, 'signatures', target['name'], f'{hashlib.sha1(path.encode("utf-8", "surrogateescape")).hexdigest()}.sig')
+
+    def _encode_deltas(self, target, delta_folder):
+        '''
+        Writes a delta for each file of at least delta_min_mb whose base version is in an archive
+        still on hand, plus the tar exclude list for them. Returns (delta headers, paths to store 
+        whole as new bases): those with no usable base or whose delta came out too big
+        '''
+
+        from delta import DELTA_FOLDER, DELTA_REBASE_RATIO, read_signature_header, write_delta
+
+        min_size = float(target['delta_min_mb'])*1024*1024
+        os.makedirs(os.path.join(delta_folder, DELTA_FOLDER))
+        deltas = []
+        rebase_paths = []
+
+        for entry in scan_path(target['path'], target['excludes'], one_file_system=self.one_file_system):
+            if not entry.is_file() or entry.size < min_size:
+                continue
+
+            signature_filename = self._signature_filename(target, entry.path)
+            base_archive = None 
+            if os.path.exists(signature_filename):
+                base = read_signature_header(signature_filename)
+                base_archive = self.db.get_archive(base['archive_id'])
+                if base_archive and not self._local_index().exists(base_archive['filename']) and not base_archive['is_remote']:
+                    base_archive = None 
+
+            if not base_archive:
+                rebase_paths.append(entry.path)
+                continue
+
+            delta_filename = os.path.join(delta_folder, DELTA_FOLDER, f'{os.path.basename(signature_filename)[:-4]}.delta')
+            header = write_delta(entry.path, signature_filename, delta_filename, entry.path.lstrip('/'), max_literal_bytes=entry.size*DELTA_REBASE_RATIO)
+            if header:
+                self.user_logger.info(f'{entry.path}: {human(header["literal_bytes"], "b")} new of {human(entry.size, "b")}, delta on archive {header["base_archive_id"]}')
+                deltas.append(header)
+            else:
+                self.user_logger.info(f'{entry.path}: changed too much for a delta, storing it whole as the new base')
+                os.unlink(delta_filename)
+                rebase_paths.append(entry.path)
+
+        if deltas:
+            # -- tar exclude patterns are wildcards, so each path is escaped to match only itself
+            with open(os.path.join(delta_folder, 'excludes'), 'w', encoding='utf-8', errors='surrogateescape') as f:
+                for header in deltas:
+                    f.write(re.sub(r'([\\*?\[])', r'\\\1', header['path']) + '\n')
+
+        return deltas, rebase_paths
+
+    def _record_deltas(self, target, archive_id, target_file, deltas, rebase_paths):
+        '''Records which archives this one's deltas need, and signs the files it stored whole as the bases for the next'''
+
+        from delta import write_signature
+
+        for header in deltas:
+            self.db.create_delta(archive_id, header['base_archive_id'], header['path'], header['size'], header['literal_bytes'])
+
+        for path in rebase_paths:
+            try:
+                write_signature(path, self._signature_filename(target, path), { 'archive_id': archive_id, 'archive_filename': os.path.basename(target_file), 'member': path.lstrip('/') })
+            except OSError as ose:
+                self.logger.warning(f'Could not sign {path}, it will be stored whole again: {ose}')
+
+    def _next_chain_link(self, target):
+        '''
+        (parent archive, level) of the target's next archive. With full_every set, each archive is
+        incremental on the last one until the chain has full_every incrementals, then a new full
+        (None, 0) starts the next chain. Without, (None, None): a plain full archive, no snapshot.
+        '''
+
+        full_every = int(target['full_every'] or 0)
+        if full_every <= 0:
+            return None, None 
+
+        last_archive = self.db.get_last_archive(target['id'])
+        if not last_archive or last_archive['level'] is None or int(last_archive['level']) >= full_every:
+            return None, 0
+
+        if not self._local_index().exists(last_archive['filename']) and not last_archive['is_remote']:
+            self.user_logger.warning(f'The last archive {last_archive["id"]} is gone, starting a new chain')
+            return None, 0
+
+        if not self.db.get_snapshot(last_archive['id']):
+            self.user_logger.warning(f'The last archive {last_archive["id"]} has no snapshot recorded, starting a new chain')
+            return None, 0
+
+        return last_archive, int(last_archive['level']) + 1
+
+    def _archive_chain(self, archive):
+        '''The archive and every archive it is incremental on, the full (level 0) first'''
+
+        chain = [ archive ]
+        while chain[0]['parent_id']:
+            parent = self.db.get_archive(chain[0]['parent_id'])
+            if not parent:
+                raise Exception(f'Archive {chain[0]["id"]} is incremental on archive {chain[0]["parent_id"]}, which no longer exists')
+            chain.insert(0, parent)
+        return chain
     
+    def _seekable_frame_size(self):
+        from seekable import DEFAULT_FRAME_SIZE
+        if self.config.seekable_frame_mb:
+            return int(float(self.config.seekable_frame_mb)*1024*1024)
+        return DEFAULT_FRAME_SIZE
+
+    @contextmanager
+    def _digest_and_verify(self, digest, verifier):
+        '''Yields the callback for archive bytes as they are written: digested inline, verified on a background thread'''
+
+        verify_queue = BackgroundQueue(verifier.update, maxsize=8, name='bckt-verify').start()
+
+        def on_block(block):
+            digest.update(block)
+            verify_queue.put(block)
+
+        try:
+            yield on_block
+        finally:
+            verify_queue.close()
+
+    def _space_monitor(self, expected_input_bytes, progress, room_plan):
+        '''Watches the working folder while an archive is written, making room from room_plan, a cleanup plan listed before tar started'''
+        reserve_mb = float(self.config.disk_reserve_mb) if self.config.disk_reserve_mb is not None else DISK_RESERVE_MB
+        return SpaceMonitor(self.config.working_folder, expected_input_bytes, progress, make_room=lambda needed_bytes: self._make_room(room_plan, needed_bytes), reserve_bytes=reserve_mb*1024*1024)
+
+    def _make_room(self, room_plan, needed_bytes):
+        '''Frees needed_bytes of room_plan's candidates if they can, dropping those deleted from it, returns whether it did'''
+
+        plan = narrow_cleanup_plan(room_plan, needed_kb=needed_bytes/1024.0)
+        if not plan.is_satisfied():
+            self.user_logger.error(f'Cleaning up every local archive allowed would still leave {human(needed_bytes/1024.0 - plan.freed_kb(), "kb")} short')
+            return False 
+
+        self.user_logger.warning(f'Cleaning up {len(plan)} old local archives will free {human(plan.freed_kb(), "kb")}. Proceeding with cleanup while archiving.')
+        self.execute_cleanup_plan(plan, dry_run=self.dry_run)
+        if self.dry_run:
+            return False 
+        room_plan.candidates = [ c for c in room_plan.candidates if c not in plan.selected ]
+        return True 
+
+    def _write_tar_archive(self, archive_command, target_file, on_block, monitor=None):
+        '''
+        Runs tar (writing to stdout) into target_file, passing each block to on_block on the way. Returns (returncode, errors, disk_full).
+        With a SpaceMonitor, tar is stopped as soon as the rest of the archive is projected not to fit.
+        '''
+
+        write_error = None
+        disk_full = False 
+
+        with tempfile.TemporaryFile() as stderr, open(target_file, 'wb') as f:
+            proc = subprocess.Popen(archive_command.split(' '), stdout=subprocess.PIPE, stderr=stderr)
+            try:
+                while True:
+                    block = proc.stdout.read(DIGEST_BLOCK_SIZE)
+                    if not block:
+                        break
+                    f.write(block)
+                    on_block(block)
+                    shortfall = monitor.check() if monitor else None
+                    if shortfall:
+                        self.user_logger.error(f'Stopping tar early. {shortfall}')
+                        write_error = shortfall
+                        disk_full = True 
+                        proc.kill()
+                        break
+                f.flush()
+            except OSError as ose:
+                # -- a full disk now shows up here rather than in tar's stderr
+                write_error = ose
+                disk_full = ose.errno == errno.ENOSPC
+                proc.kill()
+            finally:
+                proc.stdout.close()
+                returncode = proc.wait()
+            stderr.seek(0)
+            errors = stderr.read().decode('utf-8', errors='replace')
+
+        # -- tar still writes its index file itself
+        if returncode != 0 and errors.find(os.strerror(errno.ENOSPC)) >= 0:
+            disk_full = True 
+
+        if write_error:
+            errors = f'{errors}\n{write_error}'.strip()
+
+        return returncode, errors, disk_full
+
+    def _write_seekable_archive(self, target, target_file, on_block=None):
+        '''Scans the target and writes it as independently compressed frames, returns (seek index, manifest, errors)'''
+
+        from seekable import write_seekable_archive
+
+        errors = []
+
+        def on_error(path, error):
+            self.logger.warning(f'Skipping {path}: {error}')
+            errors.append(f'{path}: {error}')
+
+        if self.exclude_vcs_ignores:
+            self.user_logger.warning(f'VCS ignore files are not honored by the seekable format')
+
+        entries = scan_path(target['path'], target['excludes'], one_file_system=self.one_file_system, on_error=on_error)
+        seek_index, manifest = write_seekable_archive(target_file, entries, frame_size=self._seekable_frame_size(), on_compressed=on_block, on_error=on_error)
+
+        self.user_logger.info(f'Wrote {len(seek_index.members)} members in {len(seek_index.frames)} frames')
+
+        return seek_index, manifest, "\n".join(errors)
+
+    def _record_seek_index(self, archive_id, target_file, seek_index):
+        '''The index goes to the database and to a sidecar file next to the archive, which is pushed along with it'''
+        try:
+            encoded = seek_index.encode()
+            self.db.create_seek_index(archive_id, seek_index, encoded)
+            with open(os.path.join(self.config.working_folder, archive_index_filename(target_file)), 'w') as f:
+                f.write(encoded)
+        except:
+            self.logger.error(f'Failed to record a seek index for archive {archive_id}')
+            self.logger.exception()
+
+    def _record_manifest(self, archive_id, index_file=None, manifest=None):
+        '''A missing manifest only costs "archive find" coverage, so failures here do not fail the archive'''
+        try:
+            if manifest is None:
+                manifest = manifest_from_tar_index(index_file)
+            self.db.create_manifest(archive_id, manifest)
+            self.user_logger.info(f'Recorded manifest of {len(manifest)} files ({human(manifest.total_size(), "b")}) for archive {archive_id}')
+        except:
+            self.logger.error(f'Failed to record a manifest for archive {archive_id}')
+            self.logger.exception()
+
     def push_target_latest(self, target_name=None):
         '''Pushes latest target archive remotely, if not already remote. Honors budget/time constraints by default, so usually used with -p (force push latest). If target name not provided, acts on all targets.'''
         
@@ -799,16 +1530,34 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
                 if self.force_push_latest or self.awsclient.is_push_due(target, remote_stats=remote_stats, last_archive=last_archive, aged_archives=aged_archives):
                     try:
                         if target['is_active']:
-                            archive_full_path = os.path.join(self.config.working_folder, last_archive["filename"])
-                            self.logger.success(f'Pushing {archive_full_path} ({human(last_archive["size_kb"], "kb")})')
-                            if not self.dry_run:
-                                self.awsclient.push_archive(target["name"], last_archive["filename"], archive_full_path)
+                            # -- an incremental is only restorable remotely with everything it is incremental on, or takes delta bases from
+                            chain = self._archive_chain(last_archive)
+                            chain += [ base for base in self._delta_base_archives(last_archive) if base['id'] not in [ a['id'] for a in chain ] ]
+                            for archive in [ a for a in chain if not a['is_remote'] ]:
+                                if is_dedup_archive_filename(archive['filename']):
+                                    self._push_dedup_archive(archive)
+                                    continue 
+                                volumes = self.db.get_volumes(archive['id'])
+                                if volumes:
+                                    self._push_volume_archive(target, archive, volumes)
+                                    continue 
+                                archive_full_path = os.path.join(self.config.working_folder, archive["filename"])
+                                self.logger.success(f'Pushing {archive_full_path} ({human(archive["size_kb"], "kb")})')
+                                if not self.dry_run:
+                                    with self._claim(upload=True):
+                                        self.awsclient.push_archive(target["name"], archive["filename"], archive_full_path)
+                                    index_path = os.path.join(self.config.working_folder, archive_index_filename(archive["filename"]))
+                                    if os.path.exists(index_path):
+                                        self.awsclient.push_archive_index(target["name"], index_path)
+                                    self.db.set_archive_remote(archive)
+                                    # -- a warm inventory no longer reflects the bucket
+                                    self.remote_inventory = None 
                             self.logger.success(f'Last archive has been pushed remotely')                        
-                            if not self.dry_run:
-                                self.db.set_archive_remote(last_archive)
                             
-                            # -- only if pushing do we clean up
+                            # -- only if pushing do we clean up, never aging out the chain the last archive needs
                             if target['is_active']:                                
+                                chain_filenames = [ os.path.basename(a['filename']) for a in chain ]
+                                remote_stats = dict(remote_stats, aged=[ key for key in remote_stats['aged'] if os.path.basename(key) not in chain_filenames ])
                                 self.awsclient.cleanup_remote_archives(target["name"], remote_stats, dry_run=False)
                             else:
                                 self.logger.warning(f'Not cleaning remote archives (is_active={target["is_active"]})')
@@ -824,28 +1573,303 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             elif last_archive['is_remote']:
                 self.logger.info(f'The last archive is already pushed remotely')
     
-    def restore_archive(self, archive_id):
-        '''Unpacks the archive identified by the ID provided into self.config.working_folder/restore/<target name>/<archive filename base>'''
+    def _volumes_by_archive(self):
+        '''Every volume row, grouped by archive id in volume order'''
+        volumes_by_archive = {}
+        for volume in self.db.get_volumes():
+            volumes_by_archive.setdefault(volume['archive_id'], []).append(volume)
+        return volumes_by_archive
+
+    def _volume_workers(self, count):
+        from volumes import VOLUME_WORKERS
+        return max(1, min(count, int(self.config.volume_workers or VOLUME_WORKERS)))
+
+    def _push_volume_archive(self, target, archive, volumes):
+        '''Pushes the volumes not yet remote, several at once, each recorded as it lands so a failed push resumes where it stopped. The archive is remote once all are.'''
+
+        pending = [ v for v in volumes if not v['is_remote'] ]
+        self.logger.success(f'Pushing {archive["filename"]}: {len(pending)} of {len(volumes)} volumes ({human(sum([ v["size_kb"] for v in pending ]), "kb")})')
+        if self.dry_run:
+            return 
+
+        def push(volume):
+            with self._claim(upload=True):
+                self.awsclient.push_archive(target["name"], volume["filename"], os.path.join(self.config.working_folder, volume["filename"]))
+            self.db.set_volume_remote(volume)
+            self.logger.info(f'Pushed volume {volume["number"]} of {len(volumes)}')
+
+        if pending:
+            with self._serialized_db(), ThreadPoolExecutor(max_workers=self._volume_workers(len(pending)), thread_name_prefix='bckt-push-volume') as executor:
+                for future in [ executor.submit(push, volume) for volume in pending ]:
+                    future.result()
+
+        self.db.set_archive_remote(archive)
+        # -- a warm inventory no longer reflects the bucket
+        self.remote_inventory = None 
+
+    def _push_dedup_archive(self, archive):
+        '''Pushes every chunk pack not yet remote (whichever target wrote it), then the store index that maps chunks to packs'''
+
+        store = self._chunk_store()
+        packs = store.unpushed_packs()
+        self.logger.success(f'Pushing {archive["filename"]}: {len(packs)} new chunk packs')
+        if self.dry_run:
+            return 
+        for pack_filename in packs:
+            with self._claim(upload=True):
+                self.awsclient.push_chunk_pack(store.pack_path(pack_filename))
+            store.set_pack_remote(pack_filename)
+        self._push_chunk_index(store)
+        self.db.set_archive_remote(archive)
+
+    def _push_chunk_index(self, store):
+        '''A copy of the index (chunks, packs and every recipe) is what a remote-only restore starts from'''
+        index_fd, index_path = tempfile.mkstemp(prefix='bckt-chunk-index-', suffix='.db')
+        os.close(index_fd)
+        try:
+            store.export_index(index_path)
+            with self._claim(upload=True):
+                self.awsclient.push_chunk_index(index_path)
+        finally:
+            os.unlink(index_path)
+
+    def _get_seek_index(self, archive_record):
+        '''From the database, else the local sidecar, else the remote sidecar'''
+
+        encoded = self.db.get_seek_index(archive_record['id'])
+        if not encoded:
+            index_filename = archive_index_filename(archive_record['filename'])
+            index_path = os.path.join(self.config.working_folder, index_filename)
+            if os.path.exists(index_path):
+                with open(index_path, 'r') as f:
+                    encoded = f.read()
+            else:
+                encoded = self.awsclient.get_archive_index(archive_record['name'], index_filename)
+        from seekable import SeekIndex
+        return SeekIndex.decode(encoded) if encoded else None
+
+    def restore_archive_file(self, archive_record, restore_path):
+        '''Extracts a single file from a seekable archive with one ranged read, local or remote'''
+
+        from seekable import RangeReader, extract_member
+
+        seek_index = self._get_seek_index(archive_record)
+        if not seek_index:
+            self.user_logger.error(f'Archive {archive_record["id"]} has no seek index, restore the whole archive instead')
+            return 
+
+        byte_range = seek_index.byte_range(restore_path)
+        if not byte_range:
+            self.user_logger.error(f'{restore_path} is not a member of archive {archive_record["id"]}')
+            return 
+
+        (start, end, skip,) = byte_range
+        filenamebase = archive_record["filename"].split('.')[0]
+        unarchive_folder = f'{self.config.working_folder}/restore/{archive_record["name"]}/{filenamebase}'
+        os.makedirs(unarchive_folder, exist_ok=True)
+
+        archive_path = os.path.join(self.config.working_folder, archive_record["filename"])
+        if self._local_index().exists(archive_record["filename"]):
+            self.logger.info(f'Reading {human(end - start, "b")} of local {archive_record["filename"]} at {start}')
+            stream = RangeReader(archive_path, start, end)
+        else:
+            self.logger.info(f'Reading {human(end - start, "b")} of remote {archive_record["filename"]} at {start}')
+            stream = self.awsclient.get_archive_range(archive_record['name'], archive_record['filename'], start, end)
+
+        try:
+            restored = extract_member(stream, skip, unarchive_folder)
+        finally:
+            stream.close()
+
+        self.user_logger.success(f'Restored {restored}')
+
+    def restore_archive(self, archive_id, restore_path=None):
+        '''Unpacks the archive identified by the ID provided into self.config.working_folder/restore/<target name>/<archive filename base>. An incremental is restored by replaying its chain from the full archive, and files held as deltas are rebuilt from their bases. With --file, extracts only that file from a seekable archive.'''
         
         archive_record = self.db.get_archive(archive_id)
         if not archive_record:
             self.logger.warning(f'Archive {archive_id} was not found')
             return 
 
-        location = self.get_archive_location(archive_record['filename'])
-        if location in [Location.LOCAL_AND_REMOTE, Location.LOCAL_ONLY, Location.LOCAL_REMOTE_UNKNOWN]:
-            self.logger.info(f'Archive {archive_record["filename"]} is local, proceeding to unarchive.')
-            filenamebase = archive_record["filename"].split('.')[0]
-            archive_path = f'{self.config.working_folder}/{archive_record["filename"]}'
-            unarchive_folder = f'{self.config.working_folder}/restore/{archive_record["name"]}/{filenamebase}'
-            self.logger.info(f'Unarchiving into {unarchive_folder}')
-            os.makedirs(unarchive_folder)
+        if restore_path:
+            self.restore_archive_file(archive_record, restore_path)
+            return 
+
+        if is_dedup_archive_filename(archive_record['filename']):
+            self._restore_dedup_archive(archive_record)
+            return 
+
+        volumes = self.db.get_volumes(archive_record['id'])
+        if volumes:
+            self._restore_volume_archive(archive_record, volumes)
+            return 
+
+        chain = self._archive_chain(archive_record)
+        if len(chain) > 1:
+            self.user_logger.info(f'Archive {archive_id} is a level {archive_record["level"]} incremental, restoring {len(chain)} archives from {chain[0]["filename"]}')
+
+        delta_bases = self._delta_base_archives(archive_record)
+        if delta_bases:
+            self.user_logger.info(f'Archive {archive_id} holds deltas on {", ".join([ str(a["id"]) for a in delta_bases ])}')
+
+        not_local = [ a for a in chain + delta_bases if self.get_archive_location(a['filename']) not in [Location.LOCAL_AND_REMOTE, Location.LOCAL_ONLY, Location.LOCAL_REMOTE_UNKNOWN] ]
+        if not_local:
+            self.user_logger.error(f'Not restoring, these archives are not local: {", ".join([ a["filename"] for a in not_local ])}')
+            return 
+
+        filenamebase = archive_record["filename"].split('.')[0]
+        unarchive_folder = f'{self.config.working_folder}/restore/{archive_record["name"]}/{filenamebase}'
+        self.logger.info(f'Unarchiving into {unarchive_folder}')
+        os.makedirs(unarchive_folder)
+
+        for archive in chain:
+            self.logger.info(f'Archive {archive["filename"]} is local, proceeding to unarchive.')
+            archive_path = f'{self.config.working_folder}/{archive["filename"]}'
             unarchive_command = f'tar -xzf {archive_path} -C {unarchive_folder}'
+            if archive['level'] is not None:
+                # -- replays the incremental: files deleted since the previous archive are deleted here too
+                unarchive_command += ' --listed-incremental=/dev/null'
             cp = subprocess.run(unarchive_command.split(' '), capture_output=True)
             self.logger.warning(cp.args)
             self.logger.warning(f'Archive returncode: {cp.returncode}')
             self.logger.warning(cp.stdout)
             self.logger.error(cp.stderr)
+            cp.check_returncode()
+
+        self._apply_deltas(unarchive_folder)
+
+    def _delta_base_archives(self, archive_record):
+        bases = []
+        for base_archive_id in self.db.get_delta_bases(archive_record['id']).get(archive_record['id'], []):
+            base = self.db.get_archive(base_archive_id)
+            if not base:
+                raise Exception(f'Archive {archive_record["id"]} holds deltas on archive {base_archive_id}, which no longer exists')
+            bases.append(base)
+        return bases
+
+    def _apply_deltas(self, unarchive_folder):
+        '''Rebuilds each file restored as a delta from its base, extracted alone from the archive holding it'''
+
+        from delta import DELTA_FOLDER, read_delta_header, apply_delta
+
+        delta_dir = os.path.join(unarchive_folder, DELTA_FOLDER)
+        if not os.path.isdir(delta_dir):
+            return 
+
+        for delta_filename in sorted(os.listdir(delta_dir)):
+            delta_path = os.path.join(delta_dir, delta_filename)
+            header = read_delta_header(delta_path)
+            base_folder = tempfile.mkdtemp(prefix='bckt-delta-base-', dir=self.config.working_folder)
+            try:
+                base_path = os.path.join(self.config.working_folder, header['base_archive_filename'])
+                cp = subprocess.run(['tar', '-xzf', base_path, '-C', base_folder, header['base_member']], capture_output=True)
+                if cp.returncode != 0:
+                    raise Exception(f'Could not extract {header["base_member"]} from {header["base_archive_filename"]}: {cp.stderr.decode("utf-8", errors="replace")}')
+                output_path = os.path.join(unarchive_folder, header['member'])
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                apply_delta(delta_path, os.path.join(base_folder, header['base_member']), output_path)
+                self.user_logger.success(f'Rebuilt {header["member"]} from {header["base_archive_filename"]} and a {human(header["literal_bytes"], "b")} delta')
+            finally:
+                shutil.rmtree(base_folder, ignore_errors=True)
+
+        shutil.rmtree(delta_dir)
+
+    def _restore_volume_archive(self, archive_record, volumes):
+        '''Extracts every volume into the one restore folder, several at once, first downloading any volume that is only remote'''
+
+        unarchive_folder = f'{self.config.working_folder}/restore/{archive_record["name"]}/{archive_record["filename"].split(".")[0]}'
+        self.logger.info(f'Unarchiving {len(volumes)} volumes into {unarchive_folder}')
+        os.makedirs(unarchive_folder)
+
+        local_volumes = (self._local_index().get(archive_record['filename']) or {}).get('volumes') or []
+        missing = [ v for v in volumes if v['filename'] not in local_volumes and not v['is_remote'] ]
+        if missing:
+            self.user_logger.error(f'Not restoring, these volumes are neither local nor remote: {", ".join([ v["filename"] for v in missing ])}')
+            return 
+
+        def restore(volume):
+            volume_path = os.path.join(self.config.working_folder, volume['filename'])
+            if volume['filename'] not in local_volumes:
+                self.user_logger.info(f'Downloading volume {volume["number"]} of {len(volumes)} ({human(volume["size_kb"], "kb")})')
+                self.awsclient.get_archive(archive_record['name'], volume['filename'], volume_path)
+            cp = subprocess.run(['tar', '-xzf', volume_path, '-C', unarchive_folder], capture_output=True)
+            if cp.returncode != 0:
+                raise Exception(f'Could not extract volume {volume["filename"]}: {cp.stderr.decode("utf-8", errors="replace")}')
+            self.logger.info(f'Extracted volume {volume["number"]} of {len(volumes)}')
+
+        with ThreadPoolExecutor(max_workers=self._volume_workers(len(volumes)), thread_name_prefix='bckt-restore-volume') as executor:
+            for future in [ executor.submit(restore, volume) for volume in volumes ]:
+                future.result()
+
+        # -- downloaded volumes are local now
+        self._local_index().invalidate()
+        self.user_logger.success(f'Restored {len(volumes)} volumes into {unarchive_folder}')
+
+    def _restore_dedup_archive(self, archive_record):
+        '''Rebuilds a dedup archive's files from the chunk store, downloading any pack that is only remote'''
+
+        store = self._chunk_store()
+        unarchive_folder = f'{self.config.working_folder}/restore/{archive_record["name"]}/{archive_record["filename"].split(".")[0]}'
+        self.logger.info(f'Restoring {archive_record["filename"]} from the chunk store into {unarchive_folder}')
+        os.makedirs(unarchive_folder)
+
+        def fetch_pack(pack_filename, pack_path):
+            self.user_logger.info(f'Downloading chunk pack {pack_filename}')
+            self.awsclient.get_chunk_pack(pack_filename, pack_path)
+
+        restored = store.restore_archive(archive_record['filename'], unarchive_folder, fetch_pack=fetch_pack)
+        self.user_logger.success(f'Restored {restored} files into {unarchive_folder}')
+
+    def collect_chunks(self):
+        '''
+        Applies dedup retention and garbage collects the chunk store: dedup archives older than 
+        DEDUP_RETENTION_DAYS (the newest of each target always kept) are deleted, then every 
+        chunk no remaining archive references, locally and remotely
+        '''
+
+        with self._maintenance_lock():
+            self._collect_chunks()
+
+    def _collect_chunks(self):
+
+        from chunkstore import DEDUP_RETENTION_DAYS
+
+        retention_days = int(self.config.dedup_retention_days or DEDUP_RETENTION_DAYS)
+        store = self._chunk_store()
+
+        retained = []
+        expired = []
+        for target in self.db.get_targets():
+            dedup_archives = sorted([ a for a in self.db.get_archives(target.name) if is_dedup_archive_filename(a['filename']) ], key=lambda a: a['id'])
+            for archive in dedup_archives:
+                age_days = (datetime.now() - datetime.fromisoformat(str(archive['created_at']))).total_seconds() / (60*60*24)
+                if age_days >= retention_days and archive is not dedup_archives[-1]:
+                    expired.append(archive)
+                else:
+                    retained.append(archive['filename'])
+
+        self.user_logger.info(f'{len(retained)} dedup archives retained, {len(expired)} past {retention_days} days')
+
+        if self.dry_run:
+            for archive in expired:
+                self.user_logger.warning(f'[ DRY RUN ] Would delete dedup archive {archive["id"]} {archive["filename"]}')
+            return 
+
+        for archive in expired:
+            self.user_logger.warning(f'Deleting dedup archive {archive["id"]} {archive["filename"]}')
+            self.db.delete_archive(archive['id'])
+
+        stats, remote_deleted = store.gc(retained)
+        self.user_logger.success(f'Collected {stats["chunks"]} chunks from {stats["recipes"]} recipes: {stats["packs_deleted"]} packs deleted, {stats["packs_rewritten"]} rewritten, {human(stats["bytes_freed"], "b")} freed')
+
+        if remote_deleted:
+            # -- live chunks moved out of a deleted remote pack must be remote before it goes
+            for pack_filename in store.unpushed_packs():
+                with self._claim(upload=True):
+                    self.awsclient.push_chunk_pack(store.pack_path(pack_filename))
+                store.set_pack_remote(pack_filename)
+            self._push_chunk_index(store)
+            self.awsclient.delete_chunk_packs(remote_deleted)
 
     ### other operations 
 
@@ -857,6 +1881,11 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             For any orphaned local or remote archives,
                 1) works backwards from remote object and reconstructs correct database archive record
         '''
+
+        with self._maintenance_lock():
+            self._db_repair()
+
+    def _db_repair(self):
         
         all_archives = self.get_archives()
 
@@ -866,11 +1895,15 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         local_archives = self._get_local_archives()
         local_archives_by_filename = { l["filename"]: l for l in local_archives }
 
+        volumes_by_archive = self._volumes_by_archive()
+
         for archive in all_archives:
             
             basename = os.path.basename(archive['filename'])
 
-            location = self.get_archive_location(archive['filename'], local_archives=local_archives_by_filename, remote_file_map=s3_objects_by_filename)
+            location = self.get_archive_location(archive['filename'], local_archives=local_archives_by_filename, remote_file_map=s3_objects_by_filename, volumes=volumes_by_archive.get(archive['id']))
+            if location == Location.CHUNK_STORE:
+                continue 
             is_remote = self._is_archive_remote(location)
 
             if archive['is_remote'] != is_remote:
@@ -890,6 +1923,21 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
 
         # -- at this point, s3_objects_by_filename has been cleaned of everything with a DB representation
         # -- only orphans left 
+
+        # -- volumes have no record of their own to rebuild, so those of an unknown archive are only reported
+        for remote_archive_filename in [ f for f in s3_objects_by_filename if s3_objects_by_filename[f].get('volumes') ]:
+            del s3_objects_by_filename[remote_archive_filename]
+            self.user_logger.warn(f'Remote volumes of {remote_archive_filename} belong to no archive record')
+        for local_archive_filename in [ f for f in local_archives_by_filename if local_archives_by_filename[f].get('volumes') ]:
+            del local_archives_by_filename[local_archive_filename]
+            self.user_logger.warn(f'Local volumes of {local_archive_filename} belong to no archive record')
+
+        # -- every local orphan gets a record with a digest, so hash them all up front and in parallel
+        orphan_digests = digest_files(
+            [ os.path.join(self.config.working_folder, f) for f in local_archives_by_filename ],
+            workers=int(self.config.digest_workers or 4),
+            checksum_algorithm=self.config.checksum_algorithm)
+
         for orphaned_s3_object_filename in s3_objects_by_filename:
 
             obj = s3_objects_by_filename[orphaned_s3_object_filename]
@@ -909,14 +1957,15 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
                     digest = None 
                     
                     if self._is_archive_local(location):
-                        digest = calculate_archive_digest(os.path.join(self.config.working_folder, orphaned_s3_object_filename))
+                        digest = orphan_digests.get(os.path.join(self.config.working_folder, orphaned_s3_object_filename))
 
                     new_archive_id = self.db.create_archive(
                         target_id=target['id'], 
                         size_kb="%.1f" % (obj['size']/(1024.0)), 
                         filename=orphaned_s3_object_filename, 
                         pre_marker_timestamp=pre_marker_timestamp_from_archive_filename(orphaned_s3_object_filename),
-                        digest=digest)
+                        digest=digest.md5 if digest else None,
+                        checksum=digest.checksum if digest else None)
 
                     self.user_logger.info(f'Created new archive record {new_archive_id} to represent S3 object {orphaned_s3_object_filename}')
                     self.user_logger.info(f'Updating archive {new_archive_id} is_remote -> {is_remote}')
@@ -948,14 +1997,15 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
                     digest = None 
                     
                     if self._is_archive_local(location):
-                        digest = calculate_archive_digest(os.path.join(self.config.working_folder, local_archive_filename))
+                        digest = orphan_digests.get(os.path.join(self.config.working_folder, local_archive_filename))
 
                     new_archive_id = self.db.create_archive(
                         target_id=target['id'], 
                         size_kb="%.1f" % (local_file['size']/(1024.0)), 
                         filename=local_archive_filename, 
                         pre_marker_timestamp=pre_marker_timestamp_from_archive_filename(local_archive_filename),
-                        digest=digest)
+                        digest=digest.md5 if digest else None,
+                        checksum=digest.checksum if digest else None)
 
                     self.user_logger.info(f'Created new archive record {new_archive_id} to represent local file {local_archive_filename}')
                     self.user_logger.info(f'Updating archive {new_archive_id} is_remote -> {is_remote}')
@@ -981,7 +2031,13 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         
         self.logger.debug(f'Have {len(db_records)} database records and {len(list(s3_objects))} S3 objects')
 
+        return self._decorate_archives(db_records, targets_by_id, s3_objects_by_filename)
+
+    def _decorate_archives(self, db_records, targets_by_id, s3_objects_by_filename, local_archives=None):
+        '''Adds target name, location and cost to archive records, from already fetched remote (and optionally local) listings'''
+
         all_archives = []
+        volumes_by_archive = self._volumes_by_archive()
 
         for db_record in db_records:
 
@@ -994,7 +2050,7 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             db_record.update({
                 'target_name': targets_by_id[db_record['target_id']]['name'],
                 'size_mb': "%.1f" % (db_record['size_kb'] / 1024.0), 
-                'location': self.get_archive_location(db_record['filename'], remote_file_map=s3_objects_by_filename), 
+                'location': self.get_archive_location(db_record['filename'], local_archives=local_archives, remote_file_map=s3_objects_by_filename, volumes=volumes_by_archive.get(db_record['id'])), 
                 's3_cost_per_month': s3_cost_per_month,
                 'created_at': datetime.strftime(db_record["created_at"], "%Y-%m-%d %H:%M:%S"),
                 'remote_push_at': datetime.strftime(db_record["remote_push_at"], "%Y-%m-%d %H:%M:%S") if db_record["remote_push_at"] else None
@@ -1044,6 +2100,39 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
     def _is_archive_remote(self, archive_location):
         return archive_location in [ Location.LOCAL_AND_REMOTE, Location.REMOTE_ONLY, Location.REMOTE_ONLY_ORPHAN, Location.LOCAL_AND_REMOTE_ORPHAN ]
 
+    def _target_list_snapshot(self, target_name=None):
+        '''
+        Everything the target list needs from one targets query, one archives query, one 
+        remote listing and one working folder scan, indexed by target
+        '''
+
+        time_out = datetime.now()
+
+        all_targets = self.db.get_targets()
+        targets_by_id = { t.id: t for t in all_targets }
+        targets = [ t for t in all_targets if not target_name or t.name == target_name ]
+
+        inventory = self.awsclient.get_remote_inventory(no_cache=self.no_cache)
+        s3_objects_by_filename = { os.path.basename(obj['key']): obj for objs in inventory.values() for obj in objs }
+        local_archives = self._local_index().by_filename()
+
+        archives = self._decorate_archives(self.db.get_archives(), targets_by_id, s3_objects_by_filename, local_archives=local_archives)
+        archives_by_target_id = { t.id: [] for t in targets }
+        for archive in archives:
+            if archive['target_id'] in archives_by_target_id:
+                archives_by_target_id[archive['target_id']].append(archive)
+
+        snapshot = {
+            'targets': targets,
+            'remote_stats': self.awsclient.get_remote_stats(targets, inventory=inventory),
+            'archives_by_target_id': archives_by_target_id
+        }
+
+        time_in = datetime.now()
+        self.logger.debug(f'target list snapshot time: {"%.1f" % (time_in - time_out).total_seconds()} seconds ({len(targets)} targets, {len(archives)} archives)')
+
+        return snapshot 
+
     def print_targets(self, target_name=None):
 
         '''for each target:
@@ -1058,13 +2147,17 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         archives_by_target_and_location = {}
         total_last_archive_size_kb = 0
 
-        for target_print_item, remote_stats in self.targets(target_name):
+        snapshot = self._target_list_snapshot(target_name)
+
+        disk_stats = self._target_disk_stats(snapshot['targets'])
+
+        for target_print_item in snapshot['targets']:
             
+            self.logger.set_context(target_print_item.name)
+
             # -- target name, path, budget max, frequency, total archive count, % archives remote, last archive date/days, next archive date/days
-            time_out = datetime.now()
-            archives = self.get_archives(target_print_item.name)
-            time_in = datetime.now()
-            self.logger.debug(f'archive fetch time: {"%.1f" % (time_in - time_out).total_seconds()} seconds')
+            remote_stats = snapshot['remote_stats'][target_print_item.name]
+            archives = snapshot['archives_by_target_id'][target_print_item.id]
 
             if target_print_item.id not in archives_by_target_and_location:
                 archives_by_target_and_location[target_print_item.id] = {'local': [], 'remote': [] }
@@ -1082,10 +2175,9 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
 
             self.logger.debug(f'analyzing {target_print_item.name}')
             
-            target_print_item.has_new_files = '-'
+            target_disk_stats = disk_stats.get(target_print_item.name, {})
 
-            if self.show_has_new_files and target_print_item.is_active:
-                target_print_item.has_new_files = self.target_has_new_files(target_print_item, log=True)
+            target_print_item.has_new_files = target_disk_stats.get('has_new_files', '-')
 
             target_archives_by_created_at = { a['pre_marker_timestamp']: a for a in archives if a['target_id'] == target_print_item.id }
             
@@ -1120,10 +2212,10 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             
             
             if self.show_would_push and target_print_item.is_active:
-                push_due = self.awsclient.is_push_due(target_print_item, remote_stats=remote_stats, print=False)
+                push_due = self.awsclient.is_push_due(target_print_item, remote_stats=remote_stats, print=False, archives=archives)
                 target_print_item.would_push = push_due and (not target_print_item.last_archive_pushed or target_print_item.has_new_files)
             if self.show_size_on_disk and target_print_item.is_active:
-                target_print_item.uncompressed_kb = get_path_uncompressed_size_kb(target_print_item.name, target_print_item.path, target_print_item.excludes, no_cache=self.no_cache)
+                target_print_item.uncompressed_kb = target_disk_stats.get('uncompressed_kb', '-')
 
             target_print_item.local_archive_count = len(archives_by_target_and_location[target_print_item.id]['local'])
             target_print_item.remote_archive_count = len(archives_by_target_and_location[target_print_item.id]['remote'])
@@ -1132,6 +2224,8 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
             target_print_item.monthly_cost = smart_precision(target_storage_cost_sum)
 
             target_print_items.append(target_print_item)
+
+            self.logger.clear_context()
                 
         # self.logger.debug(json.dumps(target_print_items, indent=4))
         
@@ -1272,17 +2366,75 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         self.columnizer.print(table, header, highlight_template=highlight_template, data=True)
         print(f'Total current backup size: {(total_last_archive_size_kb/(1024*1024)):.2f} GB')
 
-    def get_archive_location(self, archive_filename, db_record_present=True, local_archives=None, remote_file_map=None):
+    def _target_disk_stats(self, targets):
+        '''
+        has_new_files (-n) and uncompressed_kb (--show-size) of active targets, computed concurrently.
+        Targets on the same device are walked one after another so a disk isn't thrashed, with up to
+        list_workers devices at once. Each target is reported as it finishes.
+        '''
+
+        if not (self.show_has_new_files or self.show_size_on_disk):
+            return {}
+
+        active_targets = [ t for t in targets if t.is_active ]
+
+        targets_by_device = {}
+        for target in active_targets:
+            targets_by_device.setdefault(path_device(target.path), []).append(target)
+
+        stats = {}
+        stats_lock = threading.Lock()
+
+        def device_worker(device_targets):
+            for target in device_targets:
+                target_stats = {}
+                self.logger.set_context(target.name)
+                try:
+                    if self.show_has_new_files:
+                        target_stats['has_new_files'] = self.target_has_new_files(target, log=False)
+                    if self.show_size_on_disk:
+                        target_stats['uncompressed_kb'] = get_path_uncompressed_size_kb(target.name, target.path, target.excludes, no_cache=self.no_cache)
+                except:
+                    self.logger.exception()
+                finally:
+                    self.logger.clear_context()
+                
+                with stats_lock:
+                    stats[target.name] = target_stats
+                    progress = [ f'new files: {target_stats.get("has_new_files", "?")}' ] if self.show_has_new_files else []
+                    progress += [ f'on disk: {human(target_stats["uncompressed_kb"], "kb") if "uncompressed_kb" in target_stats else "?"}' ] if self.show_size_on_disk else []
+                    self.user_logger.info(f'[{len(stats)}/{len(active_targets)}] {target.name}: {", ".join(progress)}')
+
+        if len(targets_by_device) == 0:
+            return stats 
+
+        workers = min(len(targets_by_device), int(self.config.list_workers or 4))
+
+        with self._serialized_db(), ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bckt-stats') as executor:
+            for future in [ executor.submit(device_worker, device_targets) for device_targets in targets_by_device.values() ]:
+                future.result()
+
+        return stats 
+
+    def get_archive_location(self, archive_filename, db_record_present=True, local_archives=None, remote_file_map=None, volumes=None):
 
         basename = os.path.basename(archive_filename)
+
+        # -- a dedup archive is a recipe in the chunk store, there is no file to find
+        if is_dedup_archive_filename(basename):
+            return Location.CHUNK_STORE
         
         local_file_exists = False 
         if local_archives is not None:
             local_file_exists = archive_filename in local_archives.keys()
         else:
-            local_file_exists = os.path.exists(os.path.join(self.config.working_folder, archive_filename))
+            local_file_exists = self._local_index().exists(archive_filename)
         
-        remote_file_exists = remote_file_map is not None and basename in remote_file_map
+        remote_object = remote_file_map.get(basename) if remote_file_map is not None else None 
+        remote_file_exists = remote_object is not None 
+        # -- a split archive is remote only once every volume its record lists is (an orphan has no record to hold it to)
+        if remote_object is not None and remote_object.get('volumes') and db_record_present:
+            remote_file_exists = bool(volumes) and all([ volume['filename'] in remote_object['volumes'] for volume in volumes ])
         location = Location.DOES_NOT_EXIST
 
         if db_record_present:
@@ -1309,20 +2461,8 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
 
     def _get_local_archives(self, target_name=None):
 
-        find_archives_cmd = f'find {self.config.working_folder} -type f '
-        if target_name is not None:
-            find_archives_cmd += f'-regex {archive_filename_match(target_name)}'
-        cp = subprocess.run(find_archives_cmd.strip().split(' '), check=True, capture_output=True)
-        local_archives_output = cp.stdout.splitlines()
-
-        self.logger.debug(f'found local files: {json.dumps([ l.decode("utf-8") for l in local_archives_output ], indent=4)}')
-        local_archives = [ 
-            { 
-                'filename': os.path.basename(l.decode('utf-8')), 
-                'size': int(os.stat(l).st_size), 
-                'last_modified': datetime.strftime(datetime.fromtimestamp(math.floor(os.stat(l).st_mtime)), "%Y-%m-%d %H:%M:%S.%f")
-            } for l in local_archives_output 
-        ]
+        local_archives = self._local_index().archives(target_name)
+        self.logger.debug(f'found local files: {json.dumps([ l["filename"] for l in local_archives ], indent=4)}')
 
         return local_archives
 
@@ -1463,13 +2603,280 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         # TODO.. this trashes the default config from __init__
         self.columnizer.print(table, header, data=True, **{'cell_padding': 5, 'header_color': 'white', 'row_color': 'orange'})
 
+    def find_archive_files(self, glob, target_name=None):
+        '''Lists archived files matching GLOB from the recorded archive manifests, without touching any archive. A GLOB without a slash matches file names only.'''
+
+        table = []
+
+        for record in self.db.get_manifests(target_name):
+            manifest = Manifest.decode(record['manifest'])
+            for path, size, mtime in manifest.find(glob):
+                table.append([ 
+                    record['archive_id'], 
+                    record['name'], 
+                    record['filename'], 
+                    path, 
+                    human(size, 'b'), 
+                    datetime.strftime(datetime.fromtimestamp(mtime), "%Y-%m-%d %H:%M:%S") 
+                ])
+
+        if len(table) == 0:
+            self.user_logger.warning(f'No archived files match {glob}')
+            return 
+
+        header = ['id', 'target_name', 'filename', 'path', 'size', 'modified']
+        self.columnizer.print(table, header, data=True)
+
+    def verify_archives(self, target_name=None, jobs=None):
+        '''Verifies local archives not verified yet, filtered by target name if provided: each is decompressed once and its tar headers and file sizes checked against its manifest. --jobs N verifies N at once.'''
+
+        from verify import verify_archive_file
+
+        archives = [ a for a in self.db.get_archives(target_name) if not a['verified_at'] and self._local_index().exists(a['filename']) ]
+        if len(archives) == 0:
+            self.user_logger.info(f'No unverified local archives')
+            return 
+
+        failed = []
+        progress_lock = threading.Lock()
+
+        volumes_by_archive = self._volumes_by_archive()
+
+        def verify(archive):
+            if archive['id'] in volumes_by_archive:
+                verifier = self._verify_volumes(archive, volumes_by_archive[archive['id']])
+            else:
+                encoded = self.db.get_manifest(archive['id'])
+                manifest = Manifest.decode(encoded) if encoded else None 
+                verifier = verify_archive_file(os.path.join(self.config.working_folder, archive['filename']), manifest)
+            with progress_lock:
+                if verifier.ok:
+                    if not self.dry_run:
+                        self.db.update_archive(archive['id'], verified_at=datetime.now())
+                    self.user_logger.success(f'{archive["filename"]}: {verifier.summary()}')
+                else:
+                    failed.append(archive)
+                    self.user_logger.error(f'{archive["filename"]}: {verifier.summary()}')
+                for warning in verifier.warnings:
+                    self.user_logger.warning(f'{archive["filename"]}: {warning}')
+
+        workers = min(len(archives), int(jobs or self.config.verify_workers or 2))
+
+        with self._serialized_db(), ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bckt-verify') as executor:
+            for future in [ executor.submit(verify, archive) for archive in archives ]:
+                future.result()
+
+        if failed:
+            self.user_logger.error(f'{len(failed)} of {len(archives)} archives failed verification: {", ".join([ str(a["id"]) for a in failed ])}')
+        else:
+            self.user_logger.success(f'Verified {len(archives)} archives')
+
+    def _verify_volumes(self, archive, volumes):
+        '''Verifies an archive's volumes, several at once, then their files together against the archive's manifest'''
+
+        from verify import verify_archive_file, combine_verifiers
+
+        with ThreadPoolExecutor(max_workers=self._volume_workers(len(volumes)), thread_name_prefix='bckt-verify-volume') as executor:
+            verifiers = list(executor.map(lambda volume: verify_archive_file(os.path.join(self.config.working_folder, volume['filename'])), volumes))
+
+        encoded = self.db.get_manifest(archive['id'])
+        return combine_verifiers(verifiers, Manifest.decode(encoded) if encoded else None)
+
+    def scrub_archives(self, target_name=None, jobs=None):
+        '''Re-checks archive copies for rot, filtered by target name if provided: local archives are re-hashed against their recorded md5, remote objects checked by size and ETag from one bucket listing. Each run takes a share so every copy is checked every SCRUB_DAYS days, oldest first (--ignore-schedule: every copy due). --jobs N checks N at once.'''
+
+        lock = self._run_lock()
+        if not lock:
+            return 
+        try:
+            self._scrub_archives(target_name, jobs)
+        finally:
+            lock.release()
+
+    def _scrub_archives(self, target_name, jobs):
+
+        from scrub import plan_scrub, ScrubLocation, DEFAULT_SCRUB_DAYS
+
+        # -- dedup archives have no file of their own, every chunk read back is checked against its digest instead
+        archives = [ a for a in self.db.get_archives(target_name) if not is_dedup_archive_filename(a['filename']) ]
+        remote_by_filename = {}
+        for obj in self.awsclient.get_remote_archives(target_name, no_cache=True):
+            remote_by_filename[os.path.basename(obj['key'])] = obj
+            # -- volumes are scrubbed object by object
+            remote_by_filename.update(obj.get('volumes', {}))
+        last_scrubs = { (s['archive_id'], s['location']): s for s in self.db.get_last_scrubs() }
+
+        def locations(archive):
+            archive_locations = []
+            if self._local_index().exists(archive['filename']):
+                archive_locations.append(ScrubLocation.LOCAL)
+            if archive['is_remote']:
+                archive_locations.append(ScrubLocation.REMOTE)
+            return archive_locations
+
+        plan = plan_scrub(
+            archives, 
+            locations, 
+            { key: s['last_scrubbed_at'] for key, s in last_scrubs.items() }, 
+            scrub_days=int(self.config.scrub_days or DEFAULT_SCRUB_DAYS), 
+            all_due=self.ignore_schedule)
+
+        if len(plan) == 0:
+            self.user_logger.info(f'No archive copies are due a scrub')
+            return 
+
+        # -- an archive's local copy is hashed before its remote one is checked, so a multipart ETag can be compared with it
+        plan_by_archive = {}
+        for archive, location in plan:
+            plan_by_archive.setdefault(archive['id'], (archive, []))[1].append(location)
+
+        read_mb_per_second = self.config.scrub_read_mb_per_second
+        throttle = Throttle(float(read_mb_per_second)*1024*1024 if read_mb_per_second else None)
+
+        failed = []
+        progress_lock = threading.Lock()
+
+        # -- a split archive's copies are checked volume by volume, each against its own digest and object
+        volumes_by_archive = self._volumes_by_archive()
+
+        def scrub(archive, archive_locations):
+            if archive['id'] in volumes_by_archive:
+                outcomes = self._scrub_volumes(volumes_by_archive[archive['id']], archive_locations, remote_by_filename, throttle)
+            else:
+                last_remote = last_scrubs.get((archive['id'], ScrubLocation.REMOTE.value))
+                outcomes = self._scrub_copies(archive, archive_locations, remote_by_filename, throttle, last_etag=last_remote['etag'] if last_remote else None)
+
+            with progress_lock:
+                for location, is_ok, detail, etag in outcomes:
+                    if not self.dry_run:
+                        self.db.create_scrub(archive['id'], location.value, is_ok, detail, etag)
+                    if is_ok:
+                        self.user_logger.success(f'{archive["filename"]} ({location.value}): {detail}')
+                    else:
+                        failed.append(f'{archive["id"]} ({location.value})')
+                        self.user_logger.error(f'{archive["filename"]} ({location.value}): {detail}')
+
+        workers = min(len(plan_by_archive), int(jobs or self.config.scrub_workers or 2))
+
+        with self._serialized_db(), ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bckt-scrub') as executor:
+            for future in [ executor.submit(scrub, archive, archive_locations) for archive, archive_locations in plan_by_archive.values() ]:
+                future.result()
+
+        if failed:
+            self.user_logger.error(f'{len(failed)} of {len(plan)} archive copies failed their scrub: {", ".join(failed)}')
+        else:
+            self.user_logger.success(f'Scrubbed {len(plan)} archive copies')
+
+    def _scrub_copies(self, record, record_locations, remote_by_filename, throttle, last_etag=None):
+        '''Checks the local and remote copies of one file (an archive, or a volume of one). Returns [ (location, ok, detail, etag) ]'''
+
+        from scrub import scrub_local, scrub_remote, ScrubLocation
+        from awsclient import multipart_chunksize
+
+        record_path = os.path.join(self.config.working_folder, record['filename'])
+        obj = remote_by_filename.get(os.path.basename(record['filename']))
+        etag_chunksize = multipart_chunksize(obj['size']) if obj else None 
+        
+        outcomes = []
+        local_etag = None 
+
+        if ScrubLocation.LOCAL in record_locations:
+            try:
+                is_ok, detail, local_etag = scrub_local(record_path, record, throttle=throttle, etag_chunksize=etag_chunksize)
+            except OSError as ose:
+                is_ok, detail = False, f'unreadable: {ose}'
+            outcomes.append((ScrubLocation.LOCAL, is_ok, detail, None))
+
+        if ScrubLocation.REMOTE in record_locations:
+            is_ok, detail, etag = scrub_remote(record, obj, etag_chunksize=etag_chunksize, local_etag=local_etag, last_etag=last_etag)
+            outcomes.append((ScrubLocation.REMOTE, is_ok, detail, etag))
+
+        return outcomes 
+
+    def _scrub_volumes(self, volumes, archive_locations, remote_by_filename, throttle):
+        '''Checks every volume's copies, several at once, and sums them up as one outcome per location of the archive'''
+
+        with ThreadPoolExecutor(max_workers=self._volume_workers(len(volumes)), thread_name_prefix='bckt-scrub-volume') as executor:
+            volume_outcomes = list(zip(volumes, executor.map(lambda volume: self._scrub_copies(volume, archive_locations, remote_by_filename, throttle), volumes)))
+
+        outcomes = []
+        for location in archive_locations:
+            failures = [ f'volume {volume["number"]} {detail}' for volume, checked in volume_outcomes for (l, is_ok, detail, etag) in checked if l == location and not is_ok ]
+            if failures:
+                outcomes.append((location, False, f'{len(failures)} of {len(volumes)} volumes failed: {"; ".join(failures)}', None))
+            else:
+                outcomes.append((location, True, f'all {len(volumes)} volumes match', None))
+        return outcomes 
+
+    def analyze_dupes(self):
+        '''Scans every target path for duplicate files (same size, then partial hash, then full hash) and reports duplicate bytes by target pair, and the overlap of nested targets. The index is kept in the working folder as dupes.db for further queries.'''
+
+        from dupes import DupeIndex
+
+        self._create_working_folder()
+        index = DupeIndex(os.path.join(self.config.working_folder, 'dupes.db'))
+
+        try:
+            for target in self.db.get_targets():
+                if not os.path.exists(target.path):
+                    self.user_logger.warning(f'{target.name}: {target.path} does not exist, skipping')
+                    continue
+                entries = scan_path(target.path, target.excludes, one_file_system=self.one_file_system)
+                (files, total,) = index.add_target(target.name, target.path, entries)
+                self.user_logger.info(f'{target.name}: {files} files, {human(total, "b")}')
+
+            (partial_count, full_count,) = index.group(workers=int(self.config.digest_workers or 4))
+            self.user_logger.info(f'Partially hashed {partial_count} files of shared sizes, fully hashed {full_count}')
+
+            (group_count, file_count, dupe_bytes,) = index.totals()
+            self.user_logger.success(f'{human(dupe_bytes, "b")} duplicated: {file_count} files in {group_count} groups of identical content')
+
+            for target_a, target_b, pair_bytes, copies in index.pair_report():
+                if target_a == target_b:
+                    self.user_logger.info(f'  within {target_a}: {human(pair_bytes, "b")} in {copies} extra copies')
+                else:
+                    self.user_logger.info(f'  {target_a} / {target_b}: {human(pair_bytes, "b")} held by both')
+
+            for target_a, target_b, overlap_files, overlap_bytes, nested in index.overlap_report():
+                self.user_logger.warning(f'  {target_a} / {target_b} archive the same {overlap_files} files ({human(overlap_bytes, "b")}){f", {nested}" if nested else ""}')
+
+            for size, copies, wasted, path in index.top_groups():
+                self.user_logger.info(f'  {copies} x {human(size, "b")} ({human(wasted, "b")} extra): {path}')
+
+        finally:
+            index.close()
+
+    def analyze_coverage(self, mount_point, excludes='', top=COVERAGE_TOP):
+        '''Walks MOUNT_POINT once, skipping target paths and --excludes globs, and reports the largest folders no target covers and any targets inside another target'''
+
+        coverage = get_filesystem_coverage(mount_point, self.db.get_targets(), excludes=excludes or None, one_file_system=self.one_file_system)
+
+        if coverage['covered_by']:
+            self.user_logger.success(f'{coverage["mount_point"]} is covered by {", ".join([ t["name"] for t in coverage["covered_by"] ])}')
+        else:
+            self.user_logger.info(f'{coverage["mount_point"]}: {len(coverage["targets"])} targets, {human(coverage["uncovered_bytes"], "b")} in {coverage["uncovered_files"]} files not covered by any')
+            for path, files, size in [ u for u in coverage['uncovered'] if u[2] > 0 ][:int(top)]:
+                self.user_logger.info(f'  {human(size, "b")} in {files} files: {path}')
+
+        for outer, inner in coverage['overlaps']:
+            if outer['path'] == inner['path']:
+                self.user_logger.warning(f'{outer["name"]} and {inner["name"]} both archive {inner["path"]}')
+            else:
+                self.user_logger.warning(f'{inner["name"]} ({inner["path"]}) is also archived by {outer["name"]} ({outer["path"]}), exclude it there or remove {inner["name"]}')
+
+        for path, error in coverage['errors']:
+            self.logger.warning(f'coverage skipped {path}: {error}')
+        if coverage['errors']:
+            self.user_logger.warning(f'{len(coverage["errors"])} paths could not be read, their bytes are not counted')
+
     def prune_archives(self, target_name=None):
 
         target = None 
         if target_name:
             target = self.db.get_target(name=target_name)
 
-        self.cleanup_local_archives(target=target, aggressive=False, dry_run=self.dry_run)
+        with self._maintenance_lock():
+            self.cleanup_local_archives(target=target, aggressive=False, dry_run=self.dry_run)
     
     def prune_archives_aggressively(self, target_name=None):
 
@@ -1477,12 +2884,114 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
         if target_name:
             target = self.db.get_target(name=target_name)
 
-        self.cleanup_local_archives(target=target, aggressive=True, dry_run=self.dry_run)
+        with self._maintenance_lock():
+            self.cleanup_local_archives(target=target, aggressive=True, dry_run=self.dry_run)
+
+    def _archive_stage(self, target, results):
+        '''Schedule check and archive creation for one target'''
+
+        self.user_logger.info(f'**************************')
+        self.user_logger.info(f'***')
+        self.user_logger.info(f'***\t\t{target["name"]}')
+        self.user_logger.info(f'***')
 
-    def run(self, target_name=None):
+        try:
+            
+            is_scheduled = self.target_is_scheduled(target)
+            if target['is_active'] and (is_scheduled or self.ignore_schedule):
+                self.user_logger.info(f'{target["name"]}: target is active and scheduled, proceeding to create an archive')
+                self.add_archive(target["name"], results)
+            else:
+                self.user_logger.warning(f'{target["name"]}: not running target (scheduled={is_scheduled}, active={target["is_active"]})')
+                if not target["is_active"]:
+                    results.log(target["name"], 'not_active')
+                    self.user_logger.warning(f'{target["name"]}: target is not active')
+                    self.db.set_target_last_reason(target["name"], Reason.NOT_ACTIVE)
+                elif not is_scheduled:
+                    results.log(target["name"], 'not_scheduled')
+                    self.user_logger.warning(f'{target["name"]}: target is active but not scheduled')
+                    self.db.set_target_last_reason(target["name"], Reason.NOT_SCHEDULED)
+        except:
+            self.logger.exception()
+            results.log(target["name"], 'failure')
+            self.db.set_target_last_reason(target["name"], Reason.FAILURE)
+
+        if not self.dry_run:
+            self._status_file().record(target["name"], results.reasons_for(target["name"]))
+
+    def _push_stage(self, target):
+        '''Remote push of the latest archive for one target'''
+        try:
+            '''
+            push frequency is
+                - by the budget (budget priority)
+                    - allow some margin on the budget depending on how soon age-outs will occur
+                - by the calendar (schedule priority)
+                    - may still set a max budget with either a "do not exceed" or "warn if exceeded" flag
+                - by any new content (content priority)
+                    - i.e. any new archive is get pushed 
+                    - allow some threshold required number of new files to consider a new archive for pushing
+            in the case of budget or schedule priority, if no new archive at the time of calculated push time, the next new archive is pushed regardless and the next period is based from there
+            
+            '''
+            with self._locks().global_lock(), self._locks().target_lock(target['name']):
+                self.push_target_latest(target['name'])
+        except LockHeld as lh:
+            self.user_logger.warning(f'{target["name"]} is locked ({lh}), not pushing')
+        except:
+            self.logger.exception()
+        
+        # -- check S3 status (regardless of schedule)
+        # -- check target budget (calculate )
+        # -- clean up S3 / push latest archive if not pushed 
+        # -- update archive push status/time
+
+    def _in_target_context(self, target, fn, *args):
+        '''Calls fn with this thread's log context set to the target'''
+        self.logger.set_context(target.name)
+        self.user_logger.set_context(target.name)
+        try:
+            return fn(*args)
+        finally:
+            self.logger.clear_context()
+            self.user_logger.clear_context()
+
+    @contextmanager
+    def _concurrent(self, jobs):
+        '''Scheduler and thread-safe database for the duration of a pipelined or parallel run'''
+
+        self.scheduler = ResourceScheduler(
+            cpu_slots=jobs, 
+            upload_slots=int(self.config.upload_slots or 1), 
+            free_space_kb=lambda: get_folder_free_space(self.config.working_folder))
+        
+        try:
+            with self._serialized_db():
+                yield self.scheduler 
+        finally:
+            self.scheduler = None 
+
+    @contextmanager
+    def _serialized_db(self):
+        '''The database client is not shared safely across threads, so calls are serialized while threads run'''
+        
+        db = self.db 
+        if isinstance(db, Serialized):
+            yield db 
+            return 
+        
+        self.db = Serialized(db)
+        try:
+            yield self.db 
+        finally:
+            self.db = db 
+
+    def run(self, target_name=None, jobs=1):
         '''
         Executes the full backup workflow for all targets.
         If TARGET_NAME provided, executes the full backup workflow only for that target.
+        Pushes run in the background, overlapping with the next target's archive.
+        With --jobs N, up to N targets archive at once where they don't contend for CPU, source disk or working folder space.
         1. pull all targets
         2. for each:
             a. check schedule against last run time and proceed 
@@ -1497,55 +3006,42 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
 
         results = Results()
 
-        for target, remote_stats in self.targets(target_name):
-            
-            self.user_logger.info(f'**************************')
-            self.user_logger.info(f'***')
-            self.user_logger.info(f'***\t\t{target["name"]}')
-            self.user_logger.info(f'***')
+        run_lock = self._run_lock()
+        if not run_lock:
+            return 
 
-            try:
-                
-                is_scheduled = self.target_is_scheduled(target)
-                if target['is_active'] and (is_scheduled or self.ignore_schedule):
-                    self.user_logger.info(f'{target["name"]}: target is active and scheduled, proceeding to create an archive')
-                    self.add_archive(target["name"], results)
-                else:
-                    self.user_logger.warning(f'{target["name"]}: not running target (scheduled={is_scheduled}, active={target["is_active"]})')
-                    if not target["is_active"]:
-                        results.log(target["name"], 'not_active')
-                        self.user_logger.warning(f'{target["name"]}: target is not active')
-                        self.db.set_target_last_reason(target["name"], Reason.NOT_ACTIVE)
-                    elif not is_scheduled:
-                        results.log(target["name"], 'not_scheduled')
-                        self.user_logger.warning(f'{target["name"]}: target is active but not scheduled')
-                        self.db.set_target_last_reason(target["name"], Reason.NOT_SCHEDULED)
-            except:
-                self.logger.exception()
-                results.log(target["name"], 'failure')
+        jobs = int(jobs or 1)
+        targets = [ target for target, remote_stats in self.targets(target_name) ]
+
+        with run_lock, self._concurrent(jobs):
+
+            # -- bounded, so archives can't pile up unpushed in the working folder
+            push_queue = BackgroundQueue(
+                lambda target: self._in_target_context(target, self._push_stage, target), 
+                maxsize=int(self.config.push_queue_size or 2), 
+                name='bckt-push').start()
+
+            def archive_then_queue_push(target):
+                self._in_target_context(target, self._archive_stage, target, results)
+                push_queue.put(target)
 
             try:
-                '''
-                push frequency is
-                    - by the budget (budget priority)
-                        - allow some margin on the budget depending on how soon age-outs will occur
-                    - by the calendar (schedule priority)
-                        - may still set a max budget with either a "do not exceed" or "warn if exceeded" flag
-                    - by any new content (content priority)
-                        - i.e. any new archive is get pushed 
-                        - allow some threshold required number of new files to consider a new archive for pushing
-                in the case of budget or schedule priority, if no new archive at the time of calculated push time, the next new archive is pushed regardless and the next period is based from there
-                
-                '''
-                self.push_target_latest(target['name'])
-            except:
-                self.logger.exception()
-            
-            # -- check S3 status (regardless of schedule)
-            # -- check target budget (calculate )
-            # -- clean up S3 / push latest archive if not pushed 
-            # -- update archive push status/time
-            
+                if jobs > 1 and len(targets) > 1:
+                    self.user_logger.info(f'Running {len(targets)} targets with up to {jobs} jobs')
+                    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='bckt') as executor:
+                        futures = { executor.submit(archive_then_queue_push, target): target.name for target in targets }
+                        for future in as_completed(futures):
+                            try:
+                                future.result()
+                            except:
+                                self.logger.error(f'{futures[future]}: run failed')
+                                self.logger.exception()
+                else:
+                    for target in targets:
+                        archive_then_queue_push(target)
+            finally:
+                self.user_logger.info(f'Waiting on remaining pushes')
+                push_queue.close()
         
         end = datetime.now()
 
@@ -1553,6 +3049,94 @@ Free space: \t{get_folder_free_space(self.config.working_folder)/(1024*1024):.0f
 
         self.user_logger.info(f'\n\nBackup run completed: {datetime.strftime(end, "%c")}\n')
 
+    def run_daemon(self):
+        '''
+        Stays running in place of a "bckt run" cron entry, archiving and pushing each target as it comes due.
+        The database connection, S3 session and remote inventory are kept between runs.
+        '''
+
+        from daemon import Daemon
+
+        daemon = Daemon(self, socket_filename=self.config.daemon_socket, refresh_minutes=self.config.daemon_refresh_minutes)
+
+        with self._concurrent(1):
+
+            push_queue = BackgroundQueue(
+                lambda target: self._in_target_context(target, self._push_stage, target), 
+                maxsize=int(self.config.push_queue_size or 2), 
+                name='bckt-push').start()
+
+            def run_target(target):
+                results = Results()
+                # -- held per target rather than for the life of the daemon, so maintenance can get in between
+                run_lock = self._run_lock()
+                if not run_lock:
+                    results.log(target['name'], 'locked')
+                    return results 
+                with run_lock:
+                    if self.remote_inventory is None:
+                        self.remote_inventory = self.awsclient.get_remote_inventory()
+                    # -- each wake is a fresh look at the working folder
+                    self.local_archive_index = None 
+                    self._in_target_context(target, self._archive_stage, target, results)
+                push_queue.put(target)
+                return results 
+
+            try:
+                daemon.serve(run_target)
+            finally:
+                push_queue.close()
+
+    def print_status(self):
+        '''
+        One line status (stalest target, most recent failure, highest cost) from state recorded by earlier runs.
+        Doesn't touch S3 or target paths. With --json, the full per-target status.
+        '''
+
+        from awsclient import storage_cost_per_month
+
+        summary = summarize(
+            self.db.get_status_aggregates(), 
+            self._status_file().read(), 
+            storage_cost_per_month)
+        
+        if self.json_output:
+            print(json.dumps(summary, default=str))
+        else:
+            print(status_line(summary))
+
+    def _daemon_socket(self):
+        from daemon import default_socket_filename
+        return self.config.daemon_socket or default_socket_filename(self.config.working_folder)
+
+    def daemon_status(self):
+        '''Shows what a running daemon is doing and when each target is next due'''
+
+        from daemon import query_daemon
+
+        try:
+            status = query_daemon(self._daemon_socket())
+        except (FileNotFoundError, ConnectionRefusedError):
+            self.user_logger.warning(f'No daemon is listening on {self._daemon_socket()}')
+            return 
+
+        self.user_logger.info(f'Daemon pid {status["pid"]} started {status["started_at"]}, running: {status["running"] or "-"}')
+        for item in status['queue']:
+            last = status['last_results'].get(item['target'])
+            last_text = f'{",".join(last["results"])} at {last["at"]}' if last else '-'
+            self.user_logger.info(f'\t{item["target"]}\tdue {item["due_at"]}\tlast: {last_text}')
+
+    def wake_daemon(self):
+        '''Asks a running daemon to re-read targets now, e.g. after target add/edit'''
+
+        from daemon import query_daemon
+
+        try:
+            query_daemon(self._daemon_socket(), command='wake')
+            self.user_logger.success(f'Daemon woken')
+        except (FileNotFoundError, ConnectionRefusedError):
+            self.user_logger.warning(f'No daemon is listening on {self._daemon_socket()}')
+
 def main():
 
     config = Config()
@@ -2,9 +2,9 @@
 import cowpy
 # from enum import Enum 
 import os
+import zlib
+import base64
 from datetime import datetime 
-import sqlite3 
-import mariadb
 from contextlib import contextmanager
 import subprocess
 from frank.database.database import Database
@@ -27,7 +27,11 @@ DBCONFIG = {
             { 'name': 'errors', 'type': str }, 
             { 'name': 'pre_marker_timestamp', 'type': datetime.date }, 
             { 'name': 'md5', 'type': str, 'size': 32 },
-            { 'name': 'uncompressed_size_kb', 'type': int }
+            { 'name': 'uncompressed_size_kb', 'type': int },
+            { 'name': 'checksum', 'type': str, 'size': 140, 'null': True },
+            { 'name': 'verified_at', 'type': datetime.date, 'null': True },
+            { 'name': 'level', 'type': int, 'null': True },
+            { 'name': 'parent_id', 'type': int, 'null': True }
         ],
         'targets': [
             { 'name': 'path', 'type': str }, 
@@ -41,17 +45,84 @@ DBCONFIG = {
             { 'name': 'pre_marker_at', 'type': datetime.date, 'null': True }, 
             { 'name': 'post_marker_at', 'type': datetime.date, 'null': True }, 
             { 'name': 'last_reason', 'type': str },
-            { 'name': 'created_at', 'type': datetime.date }
+            { 'name': 'created_at', 'type': datetime.date },
+            { 'name': 'archive_format', 'type': str, 'size': 32, 'null': True },
+            { 'name': 'full_every', 'type': int, 'null': True },
+            { 'name': 'delta_min_mb', 'type': float, 'null': True },
+            { 'name': 'volume_split', 'type': str, 'size': 32, 'null': True },
+            { 'name': 'volume_mb', 'type': float, 'null': True }
         ],
         'runs': [
             { 'name': 'start_at', 'type': datetime.date }, 
             { 'name': 'end_at', 'type': datetime.date }, 
             { 'name': 'run_stats_json', 'type': str }
+        ],
+        'manifests': [
+            { 'name': 'archive_id', 'type': int }, 
+            { 'name': 'file_count', 'type': int }, 
+            { 'name': 'total_size', 'type': int }, 
+            { 'name': 'manifest', 'type': str }
+        ],
+        'seek_indexes': [
+            { 'name': 'archive_id', 'type': int }, 
+            { 'name': 'frame_count', 'type': int }, 
+            { 'name': 'member_count', 'type': int }, 
+            { 'name': 'seek_index', 'type': str }
+        ],
+        'snapshots': [
+            { 'name': 'archive_id', 'type': int }, 
+            { 'name': 'snapshot', 'type': str }
+        ],
+        'scrubs': [
+            { 'name': 'archive_id', 'type': int }, 
+            { 'name': 'scrubbed_at', 'type': datetime.date }, 
+            { 'name': 'location', 'type': str, 'size': 16 }, 
+            { 'name': 'is_ok', 'type': bool }, 
+            { 'name': 'detail', 'type': str }, 
+            { 'name': 'etag', 'type': str, 'size': 64, 'null': True }
+        ],
+        'deltas': [
+            { 'name': 'archive_id', 'type': int }, 
+            { 'name': 'base_archive_id', 'type': int }, 
+            { 'name': 'path', 'type': str }, 
+            { 'name': 'size', 'type': int }, 
+            { 'name': 'literal_bytes', 'type': int }
+        ],
+        'volumes': [
+            { 'name': 'archive_id', 'type': int }, 
+            { 'name': 'number', 'type': int }, 
+            { 'name': 'filename', 'type': str, 'size': 255 },
+            { 'name': 'subtrees', 'type': str, 'null': True }, 
+            { 'name': 'size_kb', 'type': float }, 
+            { 'name': 'uncompressed_size_kb', 'type': float }, 
+            { 'name': 'file_count', 'type': int }, 
+            { 'name': 'md5', 'type': str, 'size': 32 },
+            { 'name': 'checksum', 'type': str, 'size': 140, 'null': True },
+            { 'name': 'is_remote', 'type': bool }, 
+            { 'name': 'remote_push_at', 'type': datetime.date, 'null': True }
         ]
     },
     'foreign_keys': {
         'archives': {
             'targets': 'id'
+        },
+        'manifests': {
+            'archives': 'id'
+        },
+        'seek_indexes': {
+            'archives': 'id'
+        },
+        'snapshots': {
+            'archives': 'id'
+        },
+        'scrubs': {
+            'archives': 'id'
+        },
+        'deltas': {
+            'archives': 'id'
+        },
+        'volumes': {
+            'archives': 'id'
         }
     }
 }
@@ -88,7 +159,7 @@ from awsclient import PushStrategy
 #     'runs': lambda config: f'(id integer primary key {get_db_dialect(config.database_type)[Dialect.AUTO_INCREMENT]}, start_at datetime, end_at datetime, run_stats_json text)'
 # }
 
-ARCHIVE_TARGET_JOIN_SELECT = 'a.id, a.target_id, a.created_at, a.size_kb, a.is_remote, a.remote_push_at, a.filename, a.returncode, a.errors, a.pre_marker_timestamp, a.md5, t.name, t.path, t.is_active'
+ARCHIVE_TARGET_JOIN_SELECT = 'a.id, a.target_id, a.created_at, a.size_kb, a.is_remote, a.remote_push_at, a.filename, a.returncode, a.errors, a.pre_marker_timestamp, a.md5, a.checksum, a.verified_at, a.level, a.parent_id, t.name, t.path, t.is_active'
 ARCHIVE_TARGET_JOIN = 'from archives a inner join targets t on t.id = a.target_id'
 TARGETS_SELECT = 't.id, t.path, t.name, t.excludes, t.budget_max, t.frequency, t.push_strategy, t.push_period, t.is_active, t.pre_marker_at, t.post_marker_at'
 
@@ -133,6 +204,54 @@ class Archive(BaseModel):
     pre_marker_timestamp = DateTimeColumn()
     md5 = StringColumn()
     uncompressed_size_kb = IntColumn()
+    checksum = StringColumn()
+    verified_at = DateTimeColumn()
+    level = IntColumn()
+    parent_id = IntColumn()
+
+class ArchiveManifest(BaseModel):
+    archive_id = IntColumn()
+    file_count = IntColumn()
+    total_size = IntColumn()
+    manifest = StringColumn()
+
+class SeekIndexRecord(BaseModel):
+    archive_id = IntColumn()
+    frame_count = IntColumn()
+    member_count = IntColumn()
+    seek_index = StringColumn()
+
+class Snapshot(BaseModel):
+    archive_id = IntColumn()
+    snapshot = StringColumn()
+
+class DeltaRecord(BaseModel):
+    archive_id = IntColumn()
+    base_archive_id = IntColumn()
+    path = StringColumn()
+    size = IntColumn()
+    literal_bytes = IntColumn()
+
+class Volume(BaseModel):
+    archive_id = IntColumn()
+    number = IntColumn()
+    filename = StringColumn()
+    subtrees = StringColumn()
+    size_kb = FloatColumn()
+    uncompressed_size_kb = FloatColumn()
+    file_count = IntColumn()
+    md5 = StringColumn()
+    checksum = StringColumn()
+    is_remote = BoolColumn()
+    remote_push_at = DateTimeColumn()
+
+class ScrubResult(BaseModel):
+    archive_id = IntColumn()
+    scrubbed_at = DateTimeColumn()
+    location = StringColumn()
+    is_ok = BoolColumn()
+    detail = StringColumn()
+    etag = StringColumn()
 
 class Target(BaseModel):
     path = StringColumn()
@@ -146,6 +265,11 @@ class Target(BaseModel):
     pre_marker_at = DateTimeColumn()
     post_marker_at = DateTimeColumn()
     last_reason = StringColumn()
+    archive_format = StringColumn()
+    full_every = IntColumn()
+    delta_min_mb = FloatColumn()
+    volume_split = StringColumn()
+    volume_mb = FloatColumn()
     
 class BcktDb(object):
 
@@ -364,17 +488,18 @@ class BcktDb(object):
     
     def delete_archive(self, archive_id):
 
+        self.sqliteDb.raw(f'delete from manifests where archive_id = ?', (archive_id,))
+        self.sqliteDb.raw(f'delete from seek_indexes where archive_id = ?', (archive_id,))
+        self.sqliteDb.raw(f'delete from scrubs where archive_id = ?', (archive_id,))
+        self.sqliteDb.raw(f'delete from snapshots where archive_id = ?', (archive_id,))
+        self.sqliteDb.raw(f'delete from deltas where archive_id = ?', (archive_id,))
+        self.sqliteDb.raw(f'delete from volumes where archive_id = ?', (archive_id,))
         self.sqliteDb._delete('archives', archive_id)
         self.logger.success(f'Archive {archive_id} deleted')           
 
-    def create_archive(self, target_id, size_kb, filename, pre_marker_timestamp, digest=None, returncode=0, errors="", uncompressed_size_kb=None):
-
-        # why no hashlib? ^^^
-        # with open(filename, 'rb') as f:
-        #     contents = f.read()
-        #     digest = hashlib.md5(contents).hexdigest()
+    def create_archive(self, target_id, size_kb, filename, pre_marker_timestamp, digest=None, returncode=0, errors="", uncompressed_size_kb=None, checksum=None, verified_at=None, level=None, parent_id=None):
 
-        params = (target_id, datetime.now(), size_kb, False, None, os.path.basename(filename), returncode, errors, pre_marker_timestamp, digest, uncompressed_size_kb)
+        params = (target_id, datetime.now(), size_kb, False, None, os.path.basename(filename), returncode, errors, pre_marker_timestamp, digest, uncompressed_size_kb, checksum, verified_at, level, parent_id)
         resp = self.sqliteDb._insert('archives', *params)
         self.logger.debug(f'insert to archives ({params}) response: {resp}')
 
@@ -388,6 +513,107 @@ class BcktDb(object):
 
         return insert_id
 
+    def create_manifest(self, archive_id, manifest):
+        '''Stores the encoded file manifest of an archive'''
+
+        params = (archive_id, len(manifest), manifest.total_size(), manifest.encode())
+        resp = self.sqliteDb._insert('manifests', *params)
+        self.logger.debug(f'insert to manifests for archive {archive_id} ({len(manifest)} files)')
+        return resp
+
+    def get_manifest(self, archive_id):
+        '''Encoded manifest of one archive, if one was recorded'''
+
+        records = self.sqliteDb.raw(f'select manifest from manifests where archive_id = ?', (archive_id,))
+        return records[0]['manifest'] if len(records) > 0 else None
+
+    def get_manifests(self, target_name=None):
+        '''Encoded manifests with their archive filename and target name, newest archive first'''
+
+        select = 'select m.archive_id, m.file_count, m.total_size, m.manifest, a.filename, t.name from manifests m inner join archives a on a.id = m.archive_id inner join targets t on t.id = a.target_id'
+        if target_name:
+            return self.sqliteDb.raw(f'{select} where t.name = ? order by a.created_at desc', (target_name,))
+        return self.sqliteDb.raw(f'{select} order by a.created_at desc', ())
+
+    def get_status_aggregates(self):
+        '''Per-target last reason, newest archive and remote footprint, from one grouped query'''
+
+        return self.sqliteDb.raw(
+            'select t.name, t.is_active, t.frequency, t.last_reason, max(a.pre_marker_timestamp) as last_archive_at, count(a.id) as archive_count, '
+            'sum(case when a.is_remote then a.size_kb else 0 end) as remote_kb '
+            'from targets t left join archives a on a.target_id = t.id group by t.id, t.name, t.is_active, t.frequency, t.last_reason order by t.name', ())
+
+    def create_seek_index(self, archive_id, seek_index, encoded):
+        '''Stores the frame/member offset index of a seekable archive'''
+
+        params = (archive_id, len(seek_index.frames), len(seek_index.members), encoded)
+        return self.sqliteDb._insert('seek_indexes', *params)
+
+    def get_seek_index(self, archive_id):
+        '''Encoded seek index of an archive, if it was written seekable'''
+
+        records = self.sqliteDb.raw(f'select seek_index from seek_indexes where archive_id = ?', (archive_id,))
+        return records[0]['seek_index'] if len(records) > 0 else None
+
+    def create_snapshot(self, archive_id, snapshot):
+        '''Stores the tar --listed-incremental snapshot taken as an archive was written, the base for the next incremental'''
+
+        encoded = base64.b64encode(zlib.compress(snapshot, 9)).decode('ascii')
+        return self.sqliteDb._insert('snapshots', archive_id, encoded)
+
+    def get_snapshot(self, archive_id):
+        '''Snapshot file contents recorded with an archive, if it was written with one'''
+
+        records = self.sqliteDb.raw(f'select snapshot from snapshots where archive_id = ?', (archive_id,))
+        return zlib.decompress(base64.b64decode(records[0]['snapshot'])) if len(records) > 0 else None
+
+    def create_scrub(self, archive_id, location, is_ok, detail, etag=None):
+        '''Records one integrity check of an archive's local or remote copy'''
+
+        params = (archive_id, datetime.now(), location, is_ok, detail, etag)
+        return self.sqliteDb._insert('scrubs', *params)
+
+    def get_last_scrubs(self):
+        '''Per archive and location: when it was last scrubbed, and the ETag its remote copy last had'''
+
+        return self.sqliteDb.raw(
+            'select s.archive_id, s.location, s.scrubbed_at as last_scrubbed_at, s.is_ok, s.etag from scrubs s '
+            'inner join (select archive_id, location, max(id) as id from scrubs group by archive_id, location) l on l.id = s.id', ())
+
+    def create_delta(self, archive_id, base_archive_id, path, size, literal_bytes):
+        '''Records a file an archive holds as a delta, and the archive holding the base it applies to'''
+
+        return self.sqliteDb._insert('deltas', archive_id, base_archive_id, path, size, literal_bytes)
+
+    def get_delta_bases(self, archive_id=None):
+        '''{ archive id: [ base archive ids ] } for every archive holding deltas, or just the one given'''
+
+        if archive_id is not None:
+            records = self.sqliteDb.raw('select distinct archive_id, base_archive_id from deltas where archive_id = ?', (archive_id,))
+        else:
+            records = self.sqliteDb.raw('select distinct archive_id, base_archive_id from deltas', ())
+        bases = {}
+        for record in records:
+            bases.setdefault(record['archive_id'], []).append(record['base_archive_id'])
+        return bases
+
+    def create_volume(self, archive_id, number, filename, subtrees, size_kb, uncompressed_size_kb, file_count, digest, checksum=None):
+        '''Records one volume of an archive split into independently decodable parts'''
+
+        return self.sqliteDb._insert('volumes', archive_id, number, os.path.basename(filename), subtrees, size_kb, uncompressed_size_kb, file_count, digest, checksum, False, None)
+
+    def get_volumes(self, archive_id=None):
+        '''An archive's volumes in order, or every volume of every archive'''
+
+        if archive_id is not None:
+            return self.sqliteDb.raw('select * from volumes where archive_id = ? order by number', (archive_id,))
+        return self.sqliteDb.raw('select * from volumes order by archive_id, number', ())
+
+    def set_volume_remote(self, volume):
+
+        self.sqliteDb._update('volumes', set={'is_remote': 1, 'remote_push_at': datetime.now()}, where={'id': volume['id']})
+        self.logger.debug(f'Volume {volume["filename"]} set as remote')
+
     def get_targets(self):
         fake_target = Target()
         return Target.all()
@@ -401,15 +627,15 @@ class BcktDb(object):
         #     return resp['data'][0]
         # return None 
 
-    def create_target(self, path, name, frequency, budget, excludes, is_active=True, push_strategy=PushStrategy.BUDGET_PRIORITY):
+    def create_target(self, path, name, frequency, budget, excludes, is_active=True, push_strategy=PushStrategy.BUDGET_PRIORITY, archive_format=None, full_every=None, delta_min_mb=None, volume_split=None, volume_mb=None):
         '''Creates a new target'''
         existing_target = self.get_target(name)
         if not existing_target:
             # -- if enum, use value 
             if type(push_strategy).__name__ == 'PushStrategy':
                 push_strategy = push_strategy.value 
-            #path, name, excludes, budget_max, frequency, push_strategy, push_period, is_active, pre_marker_at, post_marker_at, last_reason, created_at
-            params = (path, name, excludes, budget, frequency, push_strategy, "", is_active, None, None, None, datetime.now())
+            #path, name, excludes, budget_max, frequency, push_strategy, push_period, is_active, pre_marker_at, post_marker_at, last_reason, created_at, archive_format, full_every, delta_min_mb, volume_split, volume_mb
+            params = (path, name, excludes, budget, frequency, push_strategy, "", is_active, None, None, None, datetime.now(), archive_format, full_every, delta_min_mb, volume_split, volume_mb)
             self.sqliteDb._insert('targets', *params)
             self.logger.success(f'Target {name} added')                
         else:
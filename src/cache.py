@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from enum import Enum
+import cowpy
+
+logger = cowpy.getLogger()
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+# -- total stored value bytes per cache file, least recently used entries are evicted past this
+DEFAULT_MAX_BYTES = 64*1024*1024
+
+ALL_TARGETS = '*'
+
+class CacheType(Enum):
+    NewFiles = 'new_files'
+    ExcludedFiles = 'excluded_files'
+    ExcludedSize = 'excluded_size'
+    RemoteStats = 'remote_stats'
+    Archives = 'archives'
+
+# -- how long an entry is trusted, by what it caches
+CACHE_TTL_SECONDS = {
+    CacheType.NewFiles: 15*60,
+    CacheType.ExcludedFiles: 24*60*60,
+    CacheType.ExcludedSize: 24*60*60,
+    CacheType.RemoteStats: 60*60,
+    CacheType.Archives: 60*60
+}
+
+class Cache(object):
+    '''
+    Key-value cache in a SQLite file: one row per entry, so a store writes only that entry.
+    Entries expire by cache type and the least recently used are evicted once the file's
+    values pass max_bytes. Safe to share between threads and processes.
+    '''
+
+    context = None
+    cache_file = None
+    max_bytes = None
+
+    _connections = {}
+    _connections_lock = threading.Lock()
+
+    def __init__(self, context, cache_file, max_bytes=DEFAULT_MAX_BYTES):
+        self.context = context
+        self.cache_file = cache_file
+        self.max_bytes = max_bytes
+        self._lock, self._conn = self._connect(cache_file)
+
+    @classmethod
+    def _connect(cls, cache_file):
+        '''One connection per cache file for the process, opened (and the table created) on first use'''
+        with cls._connections_lock:
+            if cache_file not in cls._connections:
+                cls._discard_legacy_file(cache_file)
+                conn = sqlite3.connect(cache_file, timeout=30, check_same_thread=False, isolation_level=None)
+                conn.execute('pragma journal_mode=wal')
+                conn.execute('create table if not exists cache (context text, cache_id text, cache_type text, target_name text, value text, size int, stored_at real, expires_at real, accessed_at real, primary key (context, cache_id))')
+                conn.execute('create index if not exists cache_target on cache (context, target_name)')
+                conn.execute('create index if not exists cache_accessed on cache (accessed_at)')
+                cls._connections[cache_file] = (threading.RLock(), conn)
+            return cls._connections[cache_file]
+
+    @staticmethod
+    def _discard_legacy_file(cache_file):
+        '''The old whole-file caches are dropped rather than migrated, everything in them can be recomputed'''
+        if os.path.isfile(cache_file) and os.path.getsize(cache_file) > 0:
+            with open(cache_file, 'rb') as f:
+                header = f.read(len(SQLITE_HEADER))
+            if header != SQLITE_HEADER:
+                logger.debug(f'discarding legacy cache file {cache_file}')
+                os.unlink(cache_file)
+
+    def get_cache_id(self, cache_type, target_name=None):
+        return f'{cache_type.value}:{target_name or ALL_TARGETS}'
+
+    def _split_cache_id(self, cache_id):
+        cache_type_value, target_name = cache_id.split(':', 1)
+        return CacheType(cache_type_value), target_name
+
+    def cache_fetch(self, cache_id):
+        '''The cached value, or None if absent or expired'''
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('select value, expires_at from cache where context = ? and cache_id = ?', (self.context, cache_id)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute('delete from cache where context = ? and cache_id = ?', (self.context, cache_id))
+                return None
+            self._conn.execute('update cache set accessed_at = ? where context = ? and cache_id = ?', (now, self.context, cache_id))
+        return json.loads(row[0])
+
+    def cache_store(self, cache_id, value):
+        now = time.time()
+        cache_type, target_name = self._split_cache_id(cache_id)
+        encoded = json.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                'insert or replace into cache (context, cache_id, cache_type, target_name, value, size, stored_at, expires_at, accessed_at) values (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.context, cache_id, cache_type.value, target_name, encoded, len(encoded), now, now + CACHE_TTL_SECONDS[cache_type], now))
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute('select coalesce(sum(size), 0) from cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        self._conn.execute('delete from cache where expires_at <= ?', (time.time(),))
+        total = self._conn.execute('select coalesce(sum(size), 0) from cache').fetchone()[0]
+        evicted = 0
+        for context, cache_id, size in self._conn.execute('select context, cache_id, size from cache order by accessed_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('delete from cache where context = ? and cache_id = ?', (context, cache_id))
+            total -= size
+            evicted += 1
+        logger.debug(f'evicted {evicted} cache entries from {self.cache_file}')
+
+    def cache_invalidate(self, target_name=None):
+        '''Drops every entry for the target, and any entry covering all targets. Without a target, everything in this context'''
+        with self._lock:
+            if target_name:
+                self._conn.execute('delete from cache where context = ? and target_name in (?, ?)', (self.context, target_name, ALL_TARGETS))
+            else:
+                self._conn.execute('delete from cache where context = ?', (self.context,))
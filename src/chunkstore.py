@@ -0,0 +1,449 @@
+import os
+import re
+import json
+import math
+import time
+import uuid
+import zlib
+import random
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+import cowpy
+from manifest import Manifest
+from locks import FileLock
+
+logger = cowpy.getLogger()
+
+# -- dedup archives are recipes in the chunk store rather than files, named so as not to match the archive filename patterns
+DEDUP_SUFFIX = '.dedup'
+
+CHUNK_MIN = 256*1024
+CHUNK_AVG = 1024*1024
+CHUNK_MAX = 4*1024*1024
+
+PACK_SIZE = 64*1024*1024
+READ_SIZE = 8*1024*1024
+
+# -- dedup archives past this age are deleted by gc, as remote archives are aged out after six months
+DEDUP_RETENTION_DAYS = 180
+
+# -- packs whose live bytes fall under this share are rewritten by gc
+REPACK_RATIO = 0.5
+
+BLOOM_FILENAME = 'bloom.bin'
+BLOOM_CAPACITY = 10*1000*1000
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+MASK64 = (1 << 64) - 1
+
+# -- fixed, so chunk boundaries are the same on every machine and every run
+_gear_random = random.Random(0x6263_6b74)
+GEAR = [ _gear_random.getrandbits(64) for _ in range(256) ]
+
+def _high_bits_mask(bits):
+    '''Gear hash high bits depend on the last 64 bytes, low bits only on the last few'''
+    return ((1 << bits) - 1) << (64 - bits)
+
+def dedup_archive_filename(archive_filename):
+    return re.sub('\\.tar\\.gz$', DEDUP_SUFFIX, os.path.basename(archive_filename))
+
+def is_dedup_archive_filename(archive_filename):
+    return str(archive_filename).endswith(DEDUP_SUFFIX)
+
+class Chunker(object):
+    '''
+    Content-defined chunking (FastCDC-style gear hash): a cut falls where the rolling hash of the
+    preceding bytes matches a mask, so an insert early in a file only changes the chunks around it.
+    Harder mask before the average size, easier after, and hard min/max bounds.
+    '''
+
+    def __init__(self, min_size=CHUNK_MIN, avg_size=CHUNK_AVG, max_size=CHUNK_MAX):
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        bits = int(round(math.log2(avg_size)))
+        self.mask_hard = _high_bits_mask(bits + 1)
+        self.mask_easy = _high_bits_mask(bits - 1)
+
+    def _cut(self, buf, start, end):
+        '''Length of the chunk starting at start, given buf[start:end] holds at least max_size bytes or the rest of the file'''
+        if end - start <= self.min_size:
+            return end - start
+        gear = GEAR
+        mask_hard = self.mask_hard
+        mask_easy = self.mask_easy
+        h = 0
+        begin = start + self.min_size
+        normal = min(start + self.avg_size, end)
+        limit = min(start + self.max_size, end)
+        # -- iterating slices rather than indexing is most of the speed a pure-Python loop can get
+        for i, b in enumerate(buf[begin:normal], begin + 1):
+            h = ((h << 1) + gear[b]) & MASK64
+            if not h & mask_hard:
+                return i - start
+        for i, b in enumerate(buf[normal:limit], normal + 1):
+            h = ((h << 1) + gear[b]) & MASK64
+            if not h & mask_easy:
+                return i - start
+        return limit - start
+
+    def chunks(self, f):
+        '''Yields the chunks of a file object, holding at most READ_SIZE + max_size bytes'''
+        buf = bytearray()
+        pos = 0
+        eof = False
+        while True:
+            if not eof and len(buf) - pos < self.max_size:
+                del buf[:pos]
+                pos = 0
+                block = f.read(max(READ_SIZE, self.max_size))
+                if block:
+                    buf.extend(block)
+                else:
+                    eof = True
+                continue
+            if pos >= len(buf):
+                return
+            length = self._cut(buf, pos, len(buf))
+            yield bytes(buf[pos:pos + length])
+            pos += length
+
+class BloomFilter(object):
+    '''Bit array front end for "is this chunk stored?": no means no, yes means look in the index'''
+
+    def __init__(self, capacity=BLOOM_CAPACITY, false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.bit_count = int(math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.bit_count / capacity * math.log(2))))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        # -- the digest is already uniform, so its 4-byte slices serve as the hash functions
+        for i in range(self.hash_count):
+            offset = (4*i) % (len(digest) - 3)
+            yield (int.from_bytes(digest[offset:offset + 4], 'big') + i*0x9e3779b1) % self.bit_count
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    def save(self, filename):
+        temp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(json.dumps({ 'capacity': self.capacity, 'bit_count': self.bit_count, 'hash_count': self.hash_count, 'count': self.count }).encode('utf-8') + b'\n')
+            f.write(self.bits)
+        os.replace(temp_filename, filename)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            bloom = BloomFilter.__new__(BloomFilter)
+            bloom.capacity = header['capacity']
+            bloom.bit_count = header['bit_count']
+            bloom.hash_count = header['hash_count']
+            bloom.count = header['count']
+            bloom.bits = bytearray(f.read())
+        if len(bloom.bits) != (bloom.bit_count + 7) // 8:
+            raise ValueError(f'{filename} is truncated')
+        return bloom
+
+class ChunkStore(object):
+    '''
+    Chunks stored once across every dedup archive of every target, compressed and appended to pack
+    files that are pushed to S3 whole. A SQLite index maps each chunk's sha256 to its pack and offset,
+    and each archive is a recipe: its files and their chunk digests, in order.
+    '''
+
+    folder = None
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.packs_folder = os.path.join(folder, 'packs')
+        os.makedirs(self.packs_folder, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(folder, 'index.db'), timeout=60, check_same_thread=False)
+        self._conn.execute('pragma journal_mode=wal')
+        self._conn.execute('create table if not exists packs (id integer primary key autoincrement, filename text, size int, is_sealed bool, is_remote bool, created_at real)')
+        self._conn.execute('create table if not exists chunks (digest blob primary key, pack_id int, offset int, length int, raw_length int, is_compressed bool)')
+        self._conn.execute('create index if not exists chunks_pack on chunks (pack_id)')
+        self._conn.execute('create table if not exists recipes (archive_filename text primary key, recipe blob, file_count int, total_size int, created_at real)')
+        self._conn.commit()
+        self._bloom = None
+        self._pack = None
+
+    # -- index and Bloom filter
+
+    def _bloom_filename(self):
+        return os.path.join(self.folder, BLOOM_FILENAME)
+
+    def _chunk_count(self):
+        return self._conn.execute('select count(*) from chunks').fetchone()[0]
+
+    def _rebuild_bloom(self):
+        count = self._chunk_count()
+        bloom = BloomFilter(capacity=max(BLOOM_CAPACITY, count*2))
+        for (digest,) in self._conn.execute('select digest from chunks'):
+            bloom.add(digest)
+        logger.debug(f'rebuilt chunk Bloom filter over {count} chunks')
+        return bloom
+
+    @property
+    def bloom(self):
+        if self._bloom is None:
+            try:
+                self._bloom = BloomFilter.load(self._bloom_filename())
+                # -- another process added chunks since it was saved, or it has filled up
+                if self._bloom.count != self._chunk_count() or self._bloom.count > self._bloom.capacity:
+                    self._bloom = self._rebuild_bloom()
+            except (OSError, ValueError):
+                self._bloom = self._rebuild_bloom()
+        return self._bloom
+
+    def has(self, digest):
+        if digest not in self.bloom:
+            return False
+        return self._conn.execute('select 1 from chunks where digest = ?', (digest,)).fetchone() is not None
+
+    # -- packs
+
+    def _pack_path(self, filename):
+        return os.path.join(self.packs_folder, filename)
+
+    def _open_pack(self):
+        filename = f'{int(time.time())}-{uuid.uuid4().hex[:12]}.pack'
+        cursor = self._conn.execute('insert into packs (filename, size, is_sealed, is_remote, created_at) values (?, 0, 0, 0, ?)', (filename, time.time()))
+        self._pack = { 'id': cursor.lastrowid, 'filename': filename, 'file': open(self._pack_path(filename), 'ab') }
+
+    def _seal_pack(self):
+        if self._pack:
+            self._pack['file'].close()
+            size = os.path.getsize(self._pack_path(self._pack['filename']))
+            self._conn.execute('update packs set is_sealed = 1, size = ? where id = ?', (size, self._pack['id']))
+            self._pack = None
+
+    def _append(self, data):
+        '''(pack id, offset) of data appended to the open pack, rolling over to a new one when full'''
+        if self._pack is None or self._pack['file'].tell() + len(data) > PACK_SIZE:
+            self._seal_pack()
+            self._open_pack()
+        offset = self._pack['file'].tell()
+        self._pack['file'].write(data)
+        return self._pack['id'], offset
+
+    def put(self, data):
+        '''Stores a chunk unless it already is. Returns (digest, bytes newly stored)'''
+        digest = hashlib.sha256(data).digest()
+        if self.has(digest):
+            return digest, 0
+        compressed = zlib.compress(data, 6)
+        is_compressed = len(compressed) < len(data)
+        stored = compressed if is_compressed else data
+        pack_id, offset = self._append(stored)
+        self._conn.execute('insert into chunks (digest, pack_id, offset, length, raw_length, is_compressed) values (?, ?, ?, ?, ?, ?)', (digest, pack_id, offset, len(stored), len(data), is_compressed))
+        self.bloom.add(digest)
+        return digest, len(stored)
+
+    def get(self, digest, fetch_pack=None):
+        '''A chunk's bytes, checked against its digest. fetch_pack(filename, path) brings a pack that is only remote'''
+        row = self._conn.execute('select p.filename, c.offset, c.length, c.is_compressed from chunks c inner join packs p on p.id = c.pack_id where c.digest = ?', (digest,)).fetchone()
+        if row is None:
+            raise Exception(f'chunk {digest.hex()} is not in the store')
+        (filename, offset, length, is_compressed,) = row
+        path = self._pack_path(filename)
+        if not os.path.exists(path):
+            if not fetch_pack:
+                raise Exception(f'pack {filename} is not local')
+            fetch_pack(filename, path)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            stored = f.read(length)
+        data = zlib.decompress(stored) if is_compressed else stored
+        if hashlib.sha256(data).digest() != digest:
+            raise Exception(f'chunk {digest.hex()} in pack {filename} is corrupt')
+        return data
+
+    def unpushed_packs(self):
+        return [ filename for (filename,) in self._conn.execute('select filename from packs where is_sealed = 1 and is_remote = 0 order by id') ]
+
+    def pack_path(self, filename):
+        return self._pack_path(filename)
+
+    def set_pack_remote(self, filename):
+        with self._lock:
+            self._conn.execute('update packs set is_remote = 1 where filename = ?', (filename,))
+            self._conn.commit()
+
+    def export_index(self, filename):
+        '''Consistent copy of the index, chunks and packs and every recipe, for pushing'''
+        with self._lock:
+            self._conn.commit()
+            target = sqlite3.connect(filename)
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+
+    # -- archives
+
+    @contextmanager
+    def writing(self):
+        '''Holds the store for one writer across threads and processes, sealing the open pack and saving the Bloom filter after'''
+        with self._lock, FileLock(os.path.join(self.folder, 'store.lock'), blocking=True):
+            # -- another process may have added chunks since this one loaded the filter
+            self._bloom = None
+            try:
+                yield self
+                self._seal_pack()
+                self._conn.commit()
+                self.bloom.save(self._bloom_filename())
+            except:
+                self._seal_pack()
+                self._conn.rollback()
+                raise
+
+    def write_archive(self, archive_filename, entries, on_error=None):
+        '''
+        Chunks every regular file among the scanned entries into the store (call within writing())
+        and records the archive's recipe. Returns (manifest, stats)
+        '''
+
+        chunker = Chunker()
+        manifest = Manifest()
+        recipe = []
+        stats = { 'files': 0, 'bytes': 0, 'chunks': 0, 'new_chunks': 0, 'new_bytes': 0 }
+
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            try:
+                digests = []
+                size = 0
+                with open(entry.path, 'rb') as f:
+                    for chunk in chunker.chunks(f):
+                        size += len(chunk)
+                        digest, stored = self.put(chunk)
+                        digests.append(digest.hex())
+                        stats['chunks'] += 1
+                        if stored:
+                            stats['new_chunks'] += 1
+                            stats['new_bytes'] += stored
+            except OSError as ose:
+                if on_error:
+                    on_error(entry.path, ose)
+                else:
+                    logger.warning(f'skipping {entry.path}: {ose}')
+                continue
+            # -- size as read, the file may have changed since the scan; paths as tar lists them, so find and restore treat both formats alike
+            path = entry.path.lstrip('/')
+            recipe.append([ path, size, int(entry.mtime), entry.mode & 0o7777, digests ])
+            manifest.add(path, size, entry.mtime)
+            stats['files'] += 1
+            stats['bytes'] += size
+
+        self._conn.execute(
+            'insert or replace into recipes (archive_filename, recipe, file_count, total_size, created_at) values (?, ?, ?, ?, ?)',
+            (archive_filename, self.encode_recipe(recipe), len(recipe), stats['bytes'], time.time()))
+
+        return manifest, stats
+
+    def encode_recipe(self, recipe):
+        return zlib.compress(json.dumps(recipe, separators=(',', ':')).encode('utf-8'), 9)
+
+    def get_recipe(self, archive_filename):
+        '''Compressed recipe of a dedup archive, as stored and pushed'''
+        row = self._conn.execute('select recipe from recipes where archive_filename = ?', (archive_filename,)).fetchone()
+        return row[0] if row else None
+
+    def restore_archive(self, archive_filename, destination_folder, fetch_pack=None, encoded_recipe=None):
+        '''Rebuilds every file of a dedup archive under destination_folder, by the same relative path tar would use'''
+
+        encoded_recipe = encoded_recipe or self.get_recipe(archive_filename)
+        if not encoded_recipe:
+            raise Exception(f'No recipe for {archive_filename} in the chunk store')
+
+        restored = 0
+        for path, size, mtime, mode, digests in json.loads(zlib.decompress(encoded_recipe).decode('utf-8')):
+            restore_path = os.path.join(destination_folder, path)
+            os.makedirs(os.path.dirname(restore_path), exist_ok=True)
+            with open(restore_path, 'wb') as f:
+                for digest in digests:
+                    f.write(self.get(bytes.fromhex(digest), fetch_pack=fetch_pack))
+            if os.path.getsize(restore_path) != size:
+                raise Exception(f'{restore_path} restored as {os.path.getsize(restore_path)} bytes, {size} recorded')
+            os.chmod(restore_path, mode)
+            os.utime(restore_path, (mtime, mtime))
+            restored += 1
+        return restored
+
+    # -- garbage collection
+
+    def gc(self, retained_archive_filenames):
+        '''
+        Drops the recipes of archives no longer retained and every chunk only they referenced.
+        Packs left empty are deleted and packs left mostly empty are rewritten. Returns the
+        filenames of deleted packs that had been pushed, for the caller to delete remotely
+        once the rewritten packs are pushed.
+        '''
+
+        retained = set(retained_archive_filenames)
+        stats = { 'recipes': 0, 'chunks': 0, 'packs_deleted': 0, 'packs_rewritten': 0, 'bytes_freed': 0 }
+        remote_deleted = []
+        dropped = []
+
+        with self.writing():
+
+            for (archive_filename,) in self._conn.execute('select archive_filename from recipes').fetchall():
+                if archive_filename not in retained:
+                    self._conn.execute('delete from recipes where archive_filename = ?', (archive_filename,))
+                    stats['recipes'] += 1
+
+            # -- the live set goes to a temporary table, not memory
+            self._conn.execute('create temp table if not exists live (digest blob primary key)')
+            self._conn.execute('delete from live')
+            for (encoded_recipe,) in self._conn.execute('select recipe from recipes').fetchall():
+                for file_recipe in json.loads(zlib.decompress(encoded_recipe).decode('utf-8')):
+                    self._conn.executemany('insert or ignore into live (digest) values (?)', [ (bytes.fromhex(d),) for d in file_recipe[4] ])
+
+            packs = self._conn.execute(
+                'select p.id, p.filename, p.is_remote, sum(c.length), sum(case when l.digest is null then 0 else c.length end) '
+                'from packs p inner join chunks c on c.pack_id = p.id left join live l on l.digest = c.digest '
+                'where p.is_sealed = 1 group by p.id, p.filename, p.is_remote').fetchall()
+
+            for pack_id, filename, is_remote, total_length, live_length in packs:
+                if live_length >= total_length * REPACK_RATIO:
+                    continue
+                if live_length > 0:
+                    # -- live chunks move to the open pack, then the old pack goes
+                    with open(self._pack_path(filename), 'rb') as f:
+                        for digest, offset, length in self._conn.execute('select c.digest, c.offset, c.length from chunks c inner join live l on l.digest = c.digest where c.pack_id = ?', (pack_id,)).fetchall():
+                            f.seek(offset)
+                            new_pack_id, new_offset = self._append(f.read(length))
+                            self._conn.execute('update chunks set pack_id = ?, offset = ? where digest = ?', (new_pack_id, new_offset, digest))
+                    stats['packs_rewritten'] += 1
+                else:
+                    stats['packs_deleted'] += 1
+                stats['chunks'] += self._conn.execute('delete from chunks where pack_id = ?', (pack_id,)).rowcount
+                self._conn.execute('delete from packs where id = ?', (pack_id,))
+                stats['bytes_freed'] += total_length - live_length
+                dropped.append(filename)
+                if is_remote:
+                    remote_deleted.append(filename)
+
+            self._conn.execute('delete from live')
+            # -- dead chunks in packs kept as they are stay until their pack crosses the ratio
+            self._bloom = self._rebuild_bloom()
+
+        # -- only once the index no longer points into them (a failed commit rolls back to packs still on disk)
+        for filename in dropped:
+            if os.path.exists(self._pack_path(filename)):
+                os.unlink(self._pack_path(filename))
+
+        return stats, remote_deleted
@@ -0,0 +1,147 @@
+from enum import Enum
+from datetime import datetime
+import cowpy
+
+logger = cowpy.getLogger()
+
+MINIMUM_TO_KEEP = 3
+AGGRESSIVE_MINIMUM_TO_KEEP = 1
+
+class CleanupTier(Enum):
+    '''Deletion candidates, most redundant first'''
+    REMOTE_BEYOND_MINIMUM = 1       # -- remote copy exists, and newer local archives are kept anyway
+    REMOTE_WITHIN_MINIMUM = 2       # -- remote copy exists, but this is one of the newest local archives (aggressive)
+    LOCAL_BEYOND_MINIMUM = 3        # -- only copy, older than the newest local archives kept
+    LOCAL_BEYOND_AGGRESSIVE = 4     # -- only copy, older than the single newest local archive kept (aggressive)
+
+NON_AGGRESSIVE_TIERS = [ CleanupTier.REMOTE_BEYOND_MINIMUM, CleanupTier.LOCAL_BEYOND_MINIMUM ]
+
+TIER_DESCRIPTIONS = {
+    CleanupTier.REMOTE_BEYOND_MINIMUM: 'also remote',
+    CleanupTier.REMOTE_WITHIN_MINIMUM: 'also remote, newest',
+    CleanupTier.LOCAL_BEYOND_MINIMUM: f'local only, beyond newest {MINIMUM_TO_KEEP}',
+    CleanupTier.LOCAL_BEYOND_AGGRESSIVE: f'local only, beyond newest {AGGRESSIVE_MINIMUM_TO_KEEP}'
+}
+
+class CleanupPlan(object):
+
+    needed_kb = None
+    candidates = None
+    selected = None
+
+    def __init__(self, needed_kb=None):
+        self.needed_kb = needed_kb
+        self.candidates = []
+        self.selected = []
+
+    def __len__(self):
+        return len(self.selected)
+
+    def freed_kb(self):
+        return sum([ c['archive']['size_kb'] for c in self.selected ])
+
+    def is_satisfied(self):
+        return self.needed_kb is None or self.freed_kb() >= self.needed_kb
+
+    def freed_by_target(self):
+        freed = {}
+        for c in self.selected:
+            freed[c['archive']['target_name']] = freed.get(c['archive']['target_name'], 0) + c['archive']['size_kb']
+        return freed
+
+def _newest_first(archives):
+    return sorted(archives, key=lambda a: a['pre_marker_timestamp'] or datetime.min, reverse=True)
+
+def _oldest_first(candidates):
+    return sorted(candidates, key=lambda c: c['archive']['pre_marker_timestamp'] or datetime.min)
+
+def _current_chain_ids(archives, delta_bases=None):
+    '''Ids of each target's newest archive, of every archive it is incremental on, and of those holding the bases of their deltas'''
+    by_id = { a['id']: a for a in archives if a.get('id') }
+    newest_by_target = {}
+    for archive in _newest_first([ a for a in archives if a.get('id') ]):
+        newest_by_target.setdefault(archive['target_id'], archive)
+    chain_ids = set()
+    for archive in newest_by_target.values():
+        while archive:
+            chain_ids.add(archive['id'])
+            chain_ids.update((delta_bases or {}).get(archive['id'], []))
+            archive = by_id.get(archive.get('parent_id'))
+    return chain_ids
+
+def plan_local_cleanup(archives, is_local, is_remote, needed_kb=None, aggressive=True, delta_bases=None):
+    '''
+    Ranks every local archive that could be deleted, in one pass over the archives given.
+    With needed_kb, selects the fewest, most redundant archives whose removal frees at least that much
+    (if everything allowed is not enough, everything allowed is selected and the plan is unsatisfied).
+    Without, selects every allowed candidate.
+    '''
+
+    plan = CleanupPlan(needed_kb=needed_kb)
+
+    archives_by_target = {}
+    for archive in archives:
+        if is_local(archive['location']):
+            archives_by_target.setdefault(archive['target_id'], []).append(archive)
+
+    by_tier = { tier: [] for tier in CleanupTier }
+
+    # -- the only copy of an archive the newest one is incremental on (or takes delta bases from) is never a candidate
+    chain_ids = _current_chain_ids(archives, delta_bases)
+
+    for target_id, target_archives in archives_by_target.items():
+        local_only_seen = 0
+        for position, archive in enumerate(_newest_first(target_archives)):
+            if is_remote(archive['location']):
+                tier = CleanupTier.REMOTE_BEYOND_MINIMUM if position >= MINIMUM_TO_KEEP else CleanupTier.REMOTE_WITHIN_MINIMUM
+            else:
+                local_only_seen += 1
+                if archive.get('id') in chain_ids:
+                    continue
+                if position >= MINIMUM_TO_KEEP:
+                    tier = CleanupTier.LOCAL_BEYOND_MINIMUM
+                elif local_only_seen > AGGRESSIVE_MINIMUM_TO_KEEP:
+                    tier = CleanupTier.LOCAL_BEYOND_AGGRESSIVE
+                else:
+                    continue
+            by_tier[tier].append({ 'archive': archive, 'tier': tier })
+
+    allowed_tiers = [ t for t in CleanupTier if aggressive or t in NON_AGGRESSIVE_TIERS ]
+
+    for tier in allowed_tiers:
+        plan.candidates.extend(_oldest_first(by_tier[tier]))
+
+    _select(plan)
+
+    return plan
+
+def narrow_cleanup_plan(plan, needed_kb):
+    '''A plan over an earlier plan's candidates, selecting only enough to free needed_kb, without listing the archives again'''
+
+    narrowed = CleanupPlan(needed_kb=needed_kb)
+    narrowed.candidates = list(plan.candidates)
+    _select(narrowed)
+
+    return narrowed
+
+def _select(plan):
+    '''Selects from the ranked candidates: all of them without needed_kb, else the fewest that free it'''
+
+    if plan.needed_kb is None:
+        plan.selected = list(plan.candidates)
+        return 
+
+    freed = 0
+    for candidate in plan.candidates:
+        if freed >= plan.needed_kb:
+            break
+        plan.selected.append(candidate)
+        freed += candidate['archive']['size_kb']
+
+    # -- walk back from the least redundant pick, dropping any the others already cover
+    for candidate in list(reversed(plan.selected)):
+        if freed - candidate['archive']['size_kb'] >= plan.needed_kb:
+            plan.selected.remove(candidate)
+            freed -= candidate['archive']['size_kb']
+
+    logger.debug(f'cleanup plan: {len(plan.selected)} of {len(plan.candidates)} candidates, {freed} KB for {plan.needed_kb} KB needed')
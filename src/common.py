@@ -1,13 +1,19 @@
 import os
 import re
+import stat
+import hashlib
+import mmap
 import subprocess 
 import math
+import time
 from enum import Enum 
 from datetime import datetime 
 import traceback 
 import cowpy 
+import threading 
 from pathlib import Path 
 from cache import Cache, CacheType
+from scanner import split_excludes, is_excluded
 
 # FOREGROUND_COLOR_PREFIX = '\033[38;2;'
 # FOREGROUND_COLOR_SUFFIX = 'm'
@@ -15,6 +21,8 @@ from cache import Cache, CacheType
 
 home_folder = os.path.expanduser(f'~{os.getenv("USER")}')
 LOCAL_STATS_CACHE_FILE = os.path.join(home_folder, '.bckt-local-stats-cache')
+# -- target stats are computed on several threads, which open the one local stats cache between them
+LOCAL_STATS_CACHE_LOCK = threading.Lock()
 
 logger = cowpy.getLogger()
 
@@ -109,6 +117,36 @@ class Color(Enum):
 #             for line in stack_summary.format():
 #                 self.logger.error(line)
 
+class ThreadContextLogger(object):
+    '''
+    Wraps a cowpy logger so set_context/clear_context apply to the calling thread only,
+    letting concurrently running targets each keep their own [ context ] prefix
+    '''
+
+    def __init__(self, logger):
+        self._logger = logger 
+        self._local = threading.local()
+
+    def set_context(self, context):
+        self._local.context = context 
+
+    def clear_context(self):
+        self._local.context = None 
+
+    def get_context(self):
+        return getattr(self._local, 'context', None)
+
+    def __getattr__(self, name):
+        attr = getattr(self._logger, name)
+        if not callable(attr):
+            return attr 
+        def call(*args, **kwargs):
+            context = self.get_context()
+            if context and len(args) > 0 and isinstance(args[0], str):
+                args = (f'[ {context} ] {args[0]}',) + args[1:]
+            return attr(*args, **kwargs)
+        return call 
+
 UNITS = [
     {
         'unit': 'day',
@@ -151,24 +189,105 @@ def time_since(minutes):
     
     return " ".join(display)
 
+def as_datetime(value):
+    '''A database or status file timestamp as a datetime, None for the empty markers'''
+    if value in (None, '', '-'):
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
 def stob(val):
     return str(val).lower() in ['1', 'true', 'yes', 'y']
 
 def _slugify_target_name(target_name):
     return target_name.replace("/", "_")
 
-def calculate_archive_digest(filename):
-    md5_cmd = "md5sum %s | awk '{ print $1 }'" % filename
-    logger.debug(f'md5sum for {filename}: {md5_cmd}')
+# -- hashed a block at a time so a large archive never has to be in memory
+DIGEST_BLOCK_SIZE = 8*1024*1024
+
+class ArchiveDigest(object):
+    '''
+    md5 of an archive (the archives.md5 column) and optionally a stronger checksum, updated
+    with the archive bytes as they are written so the file never has to be read back
+    '''
+
+    checksum_algorithm = None
+
+    def __init__(self, checksum_algorithm=None):
+        self.checksum_algorithm = ChecksumAlgorithm(checksum_algorithm) if checksum_algorithm else None
+        self._md5 = hashlib.md5()
+        self._checksum = hashlib.new(self.checksum_algorithm.value) if self.checksum_algorithm else None
+
+    def update(self, data):
+        self._md5.update(data)
+        if self._checksum:
+            self._checksum.update(data)
+
+    @property
+    def md5(self):
+        return self._md5.hexdigest()
+
+    @property
+    def checksum(self):
+        '''"<algorithm>:<hex digest>", or None if no checksum algorithm was asked for'''
+        return f'{self.checksum_algorithm.value}:{self._checksum.hexdigest()}' if self._checksum else None
+
+def digest_file(filename, checksum_algorithm=None):
+    '''ArchiveDigest of an existing file, read through mmap'''
+    digest = ArchiveDigest(checksum_algorithm)
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for offset in range(0, size, DIGEST_BLOCK_SIZE):
+                    digest.update(view[offset:offset + DIGEST_BLOCK_SIZE])
+    return digest
 
-    cp = subprocess.run(md5_cmd, text=True, shell=True, capture_output=True)
-    digest = str([ line for line in cp.stdout.splitlines() if line ][0])
+def digest_files(filenames, workers=4, checksum_algorithm=None):
+    '''
+    ArchiveDigest of many files, hashed on a thread pool (hashlib releases the GIL on large updates).
+    Returns { filename: ArchiveDigest }, leaving out any file that could not be read.
+    '''
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    digests = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix='bckt-digest') as pool:
+        futures = { pool.submit(digest_file, filename, checksum_algorithm): filename for filename in filenames }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                digests[filename] = future.result()
+            except OSError as ose:
+                logger.warning(f'could not digest {filename}: {ose}')
+    return digests
 
-    return digest
+def calculate_archive_digest(filename):
+    return digest_file(filename).md5
 
 def generate_archive_target_filename(target, pre_timestamp):
     return f'{_slugify_target_name(target["name"])}_{datetime.strftime(pre_timestamp, "%Y%m%d_%H%M%S")}.tar.gz'
 
+def archive_index_filename(archive_filename):
+    '''Seek index sidecar for an archive, named so as not to match the archive filename patterns'''
+    return re.sub('\\.tar\\.gz$', '.seekidx', os.path.basename(archive_filename))
+
+VOLUME_FILENAME_MATCH = '\\.v([0-9]{4})\\.tar\\.gz$'
+
+def volume_filename(archive_filename, number):
+    '''One volume of a split archive, named so as not to match the archive filename patterns'''
+    return re.sub('\\.tar\\.gz$', f'.v{number:04d}.tar.gz', os.path.basename(archive_filename))
+
+def volume_archive_filename(filename):
+    '''The archive a volume file belongs to, or None if filename is not a volume'''
+    if re.search(VOLUME_FILENAME_MATCH, filename):
+        return re.sub(VOLUME_FILENAME_MATCH, '.tar.gz', os.path.basename(filename))
+    return None
+
 def archive_filename_match(target_name):
     return f'.*\/{_slugify_target_name(target_name)}\_[0-9]+_[0-9]+\.tar\.gz'    
 
@@ -185,9 +304,81 @@ def pre_marker_timestamp_from_archive_filename(archive_filename):
     return "-"
 
 def get_folder_free_space(folder):
-    '''Folder free space in kilobytes'''
-    cp = subprocess.run("df -k %s | grep -v Used | awk '{ print $4 }'" % folder, shell=True, text=True, capture_output=True)
-    return int(cp.stdout.replace('\n', ''))
+    '''Folder free space in kilobytes, as df reports it available to unprivileged users'''
+    st = os.statvfs(folder)
+    return int(st.f_bavail*st.f_frsize/1024)
+
+# -- free space the working filesystem is always left with while an archive is written
+DISK_RESERVE_MB = 512
+
+# -- the compression ratio is trusted for projections once this much input has been read
+SPACE_SAMPLE_BYTES = 64*1024*1024
+
+# -- free space is checked against the projection at most this often
+SPACE_CHECK_SECONDS = 5
+
+class SpaceMonitor(object):
+    '''
+    Watches an archive as it is written. The compression ratio so far, applied to the input still
+    expected, projects how much more will be written, which the working filesystem must have free
+    above the reserve. A shortfall is first offered to make_room (which frees space if it can).
+    Without an expected input size (an incremental reads an unknown share of its target) only the
+    reserve is kept.
+    '''
+
+    def __init__(self, folder, expected_input_bytes, progress, make_room=None, reserve_bytes=DISK_RESERVE_MB*1024*1024):
+        '''progress returns (input bytes read, bytes written for them) so far'''
+        self.folder = folder
+        self.expected_input_bytes = expected_input_bytes
+        self.progress = progress
+        self.make_room = make_room
+        self.reserve_bytes = reserve_bytes
+        self._last_check = None
+
+    def _projected(self):
+        '''(bytes still to be written, compression ratio) or (0, None) until there is enough to go on'''
+        (read, written,) = self.progress()
+        if self.expected_input_bytes is None or read < SPACE_SAMPLE_BYTES:
+            return 0, None
+        ratio = 1.0*written/read
+        return max(0, self.expected_input_bytes - read)*ratio, ratio
+
+    def check(self):
+        '''None while the archive will fit, else why it will not'''
+
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < SPACE_CHECK_SECONDS:
+            return None
+        self._last_check = now
+
+        (remaining, ratio,) = self._projected()
+        available = get_folder_free_space(self.folder)*1024 - self.reserve_bytes
+        if remaining <= available:
+            return None
+
+        if self.make_room:
+            logger.warning(f'{human(remaining - available, "b")} more space is needed to finish the archive, trying to make room')
+            if self.make_room(remaining - available):
+                available = get_folder_free_space(self.folder)*1024 - self.reserve_bytes
+                if remaining <= available:
+                    return None
+
+        projection = f'{human(remaining, "b")} more projected at a {ratio:.2f} compression ratio' if ratio is not None else 'the reserve reached'
+        return f'No space left on device for the rest of the archive: {projection}, {human(max(0, available), "b")} free above the {human(self.reserve_bytes, "b")} reserve'
+
+class ChecksumAlgorithm(Enum):
+    SHA256 = 'sha256'
+    BLAKE2B = 'blake2b'
+
+class ArchiveFormat(Enum):
+    TAR = 'tar'
+    SEEKABLE = 'seekable'
+    DEDUP = 'dedup'
+
+class VolumeSplit(Enum):
+    NONE = 'none'
+    SIZE = 'size'
+    SUBTREE = 'subtree'
 
 class Frequency(Enum):
     NEVER = 'never'
@@ -207,97 +398,291 @@ FREQUENCY_TO_MINUTES = {
 def frequency_to_minutes(frequency_value):
     return FREQUENCY_TO_MINUTES[frequency_value]
 
-def get_filesystem_coverage(mount_point, targets):
-
-    # relevant_target_paths = [ t['path'] for t in targets if re.match(f'${mount_point}', t['path']) ]
-
-    target_paths = [ t['path'] for t in targets ]
-
-    for root, dirs, files in os.walk(mount_point):
-
-        dirs_to_remove = []
-        for dir in dirs:
-            # exact matches we don't need to recurse into, they're covered
-            if dir in target_paths:
-                dirs_to_remove.append(dir)
-                continue 
-            
-            possible = False
-            for target_path in target_paths:
-                if re.fullmatch(f'${dir}', target_path):
-                    possible = True
-                    break 
-            if not possible:
-                dirs_to_remove.append(dir)
-
-        for dir in dirs_to_remove:
-            dirs.remove(dir)
-
-
-def get_new_files_since_timestamp(target_name, path, pre_marker_date, no_cache=False):
+# -- only this many of the largest uncovered directories are reported
+COVERAGE_TOP = 20
+
+class PathTrieNode(object):
+    '''One path component, with the targets rooted exactly here'''
+
+    __slots__ = ('children', 'targets')
+
+    def __init__(self):
+        self.children = {}
+        self.targets = []
+
+class PathTrie(object):
+    '''Target paths by component, so a walk can tell in one lookup per folder whether it is covered, leads to a target, or neither'''
+
+    def __init__(self, targets=None):
+        self.root = PathTrieNode()
+        for target in targets or []:
+            self.insert(target['path'], target)
+
+    @staticmethod
+    def components(path):
+        return [ c for c in os.path.abspath(path).split('/') if c ]
+
+    def insert(self, path, target):
+        node = self.root
+        for name in PathTrie.components(path):
+            node = node.children.setdefault(name, PathTrieNode())
+        node.targets.append(target)
+
+    def find(self, path):
+        '''(node at path or None, targets rooted at path or above it)'''
+        node = self.root
+        covering = list(node.targets)
+        for name in PathTrie.components(path):
+            node = node.children.get(name)
+            if node is None:
+                return None, covering
+            covering.extend(node.targets)
+        return node, covering
+
+    def overlaps(self):
+        '''(outer, inner) for every target at or below another target's path that the outer's excludes do not leave out'''
+        pairs = []
+        stack = [ (self.root, [], []) ]
+        while stack:
+            (node, parts, above,) = stack.pop()
+            for i, target in enumerate(node.targets):
+                for outer, outer_depth in above:
+                    if not is_excluded('/'.join(parts[outer_depth:]), split_excludes(outer['excludes'])):
+                        pairs.append((outer, target))
+                # -- two targets at the same path overlap entirely
+                for other in node.targets[:i]:
+                    pairs.append((other, target))
+            below = above + [ (target, len(parts)) for target in node.targets ]
+            for name, child in node.children.items():
+                stack.append((child, parts + [ name ], below))
+        return pairs
+
+def get_filesystem_coverage(mount_point, targets, excludes=None, one_file_system=True):
+    '''
+    One walk of mount_point that never enters a target's path (its own excludes are deliberate) or a
+    folder matching excludes, and only follows folders that lead to a target (by the path trie) or
+    that no target covers. Uncovered bytes are charged to the largest folder holding no target, or,
+    for files loose beside targets, to their own folder.
+    '''
+
+    mount_point = os.path.abspath(mount_point)
+    exclude_patterns = split_excludes(excludes) if isinstance(excludes, str) or excludes is None else excludes
+
+    trie = PathTrie(targets)
+    (mount_node, covering,) = trie.find(mount_point)
+
+    relevant = set(id(t) for t in covering)
+    if mount_node is not None:
+        stack = [ mount_node ]
+        while stack:
+            node = stack.pop()
+            relevant.update(id(t) for t in node.targets)
+            stack.extend(node.children.values())
+
+    coverage = {
+        'mount_point': mount_point,
+        'covered_by': covering,
+        'targets': [],
+        'uncovered': [],
+        'uncovered_files': 0,
+        'uncovered_bytes': 0,
+        'overlaps': [ (outer, inner) for outer, inner in trie.overlaps() if id(inner) in relevant ],
+        'errors': []
+    }
+
+    if covering:
+        return coverage
+
+    mount_stat = os.lstat(mount_point)
+    uncovered = {}
+
+    def charge(key, size):
+        if key not in uncovered:
+            uncovered[key] = [ 0, 0 ]
+        uncovered[key][0] += 1
+        uncovered[key][1] += size
+
+    # -- (folder, its path relative to the mount, its trie node or None once no target lies below, folder charged for what is under it)
+    stack = [ (mount_point, '', mount_node, None) ]
+
+    while stack:
+        (dirpath, dirrel, node, owner,) = stack.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                children = list(it)
+        except OSError as ose:
+            coverage['errors'].append((dirpath, str(ose)))
+            continue
+
+        for child in children:
+            relpath = f'{dirrel}/{child.name}' if dirrel else child.name
+            if is_excluded(relpath, exclude_patterns):
+                continue
+            child_node = node.children.get(child.name) if node is not None else None
+            if child_node is not None and child_node.targets:
+                coverage['targets'].extend(child_node.targets)
+                continue
+            try:
+                st = child.stat(follow_symlinks=False)
+            except OSError as ose:
+                coverage['errors'].append((child.path, str(ose)))
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                if one_file_system and st.st_dev != mount_stat.st_dev:
+                    continue
+                if child_node is not None:
+                    stack.append((child.path, relpath, child_node, None))
+                elif owner is None:
+                    uncovered.setdefault(relpath, [ 0, 0 ])
+                    stack.append((child.path, relpath, None, relpath))
+                else:
+                    stack.append((child.path, relpath, None, owner))
+            elif stat.S_ISREG(st.st_mode):
+                charge(owner if owner is not None else dirrel, st.st_size)
+
+    for key, (files, size,) in uncovered.items():
+        coverage['uncovered_files'] += files
+        coverage['uncovered_bytes'] += size
+        coverage['uncovered'].append((os.path.join(mount_point, key) if key else mount_point, files, size))
+    coverage['uncovered'].sort(key=lambda u: -u[2])
+
+    return coverage
+
+_local_stats_cache = None 
+
+def get_local_stats_cache():
+    '''One cache for the process, opened on first use'''
+    global _local_stats_cache
+    with LOCAL_STATS_CACHE_LOCK:
+        if _local_stats_cache is None:
+            _local_stats_cache = Cache(context='local', cache_file=LOCAL_STATS_CACHE_FILE)
+        return _local_stats_cache
+
+def invalidate_local_stats(target_name):
+    '''Cached new files, excluded files and excluded size depend on the target path and excludes'''
+    get_local_stats_cache().cache_invalidate(target_name)
+
+class PathSetSummary(object):
+    '''Count and order-independent digest of a set of paths, in constant memory however many are added'''
+
+    def __init__(self):
+        self.count = 0
+        self._sum = 0
+
+    def add(self, path):
+        self.count += 1
+        path_hash = hashlib.blake2b(path.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+        self._sum = (self._sum + int.from_bytes(path_hash, 'big')) % (1 << 64)
+
+    def merge(self, other):
+        '''Adds every path other has seen, as if added here'''
+        self.count += other.count
+        self._sum = (self._sum + other._sum) % (1 << 64)
+
+    @property
+    def digest(self):
+        return f'{self._sum:016x}'
+
+def is_path_excluded(path, root, exclude_patterns):
+    '''Whether path, or any folder it is in below root, is excluded (see scanner.is_excluded)'''
+    parts = os.path.relpath(path, root).split('/')
+    return any([ is_excluded('/'.join(parts[0:i+1]), exclude_patterns) for i in range(len(parts)) ])
+
+def iter_new_files_since_timestamp(path, pre_marker_date):
+    '''Streams, line by line, the files find reports modified under path since pre_marker_date'''
+
+    since_pre_minutes = (datetime.now() - pre_marker_date).total_seconds() / 60.0    
+    find_cmd = [ 'find', path, '-type', 'f', '-mmin', f'-{since_pre_minutes}' ]
+
+    with subprocess.Popen(find_cmd, stdout=subprocess.PIPE) as proc:
+        for line in proc.stdout:
+            yield line.rstrip(b'\n').decode('utf-8', 'surrogateescape')
+        returncode = proc.wait()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, find_cmd)
+
+def iter_path_excluded_files(path, excludes):
+    '''Streams every file under path that the excludes cover, walking the tree once'''
+
+    exclude_patterns = split_excludes(excludes)
+    if len(exclude_patterns) == 0:
+        return 
+
+    root = os.path.abspath(path)
+    stack = [ (root, False) ]
+
+    while stack:
+        dirpath, dir_excluded = stack.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    entry_excluded = dir_excluded or is_excluded(os.path.relpath(entry.path, root), exclude_patterns)
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, entry_excluded))
+                    elif entry_excluded:
+                        yield entry.path
+        except OSError as ose:
+            logger.warning(f'skipping {dirpath}: {ose}')
+
+def get_new_files_since_timestamp(target_name, path, pre_marker_date, excludes=None, no_cache=False):
+    '''
+    Files modified under path since pre_marker_date, as counts: total, included (not excluded)
+    and a digest of the included set. The paths themselves are streamed, never held.
+    '''
 
     logger.info(f'Checking new files for {target_name} at {path} since {pre_marker_date} (no_cache={no_cache})')
 
-    local_stats_cache = Cache(context='local', cache_file=LOCAL_STATS_CACHE_FILE)
+    local_stats_cache = get_local_stats_cache()
 
     cache_id = local_stats_cache.get_cache_id(CacheType.NewFiles, target_name)
 
-    new_file_output = local_stats_cache.cache_fetch(cache_id)
+    since = datetime.strftime(pre_marker_date, "%Y-%m-%d %H:%M:%S")
 
-    if new_file_output is None or no_cache:
-            
-        since_pre_minutes = (datetime.now() - pre_marker_date).total_seconds() / 60.0    
+    new_files = local_stats_cache.cache_fetch(cache_id)
+
+    # -- counted since a different marker (i.e. an archive was created since) doesn't count
+    if new_files is None or new_files.get('since') != since or no_cache:
         
-        logger.info(f'New file check for {target_name} at {path} since {pre_marker_date} is for {since_pre_minutes} minutes ago')
+        logger.info(f'New file check for {target_name} at {path} since {pre_marker_date}')
 
-        find_cmd = f'find {path} -type f -mmin -{since_pre_minutes}'
-        # self.logger.debug(find_cmd)
-        cp = subprocess.run(find_cmd.split(' '), check=True, capture_output=True)
+        exclude_patterns = split_excludes(excludes)
+        total = 0
+        included = PathSetSummary()
 
-        # cp = subprocess.run(f'find {path} -newer {pre_marker}'.split(' '), check=True, capture_output=True)
+        for new_file in iter_new_files_since_timestamp(path, pre_marker_date):
+            total += 1
+            if not is_path_excluded(new_file, path, exclude_patterns):
+                included.add(new_file)
 
-        new_file_output = cp.stdout.splitlines()
-        new_file_output = [ l.decode('utf-8') for l in new_file_output ]
-        local_stats_cache.cache_store(cache_id, new_file_output)
+        new_files = { 'since': since, 'total': total, 'included': included.count, 'digest': included.digest }
+        local_stats_cache.cache_store(cache_id, new_files)
 
-    return new_file_output 
+    return new_files 
 
 def get_path_excluded_files(target_name, path, excludes, no_cache=False):
+    '''Count and digest of the files under path that the excludes cover'''
 
-    local_stats_cache = Cache(context='local', cache_file=LOCAL_STATS_CACHE_FILE)
+    local_stats_cache = get_local_stats_cache()
     
     cache_id = local_stats_cache.get_cache_id(CacheType.ExcludedFiles, target_name)
 
-    flat_excludes = local_stats_cache.cache_fetch(cache_id)
+    excluded_files = local_stats_cache.cache_fetch(cache_id)
     
-    if flat_excludes is None or no_cache:
+    if excluded_files is None or no_cache:
 
-        flat_excludes = []
+        excluded = PathSetSummary()
+        for excluded_file in iter_path_excluded_files(path, excludes):
+            excluded.add(excluded_file)
 
-        if excludes is not None:
-                
-            excludes = [ e for e in excludes.split(':') if e and e.strip() != "" ]
-            this_path = Path(path)
-            
-            exclude_file_map = { e: [] for e in excludes }
-
-            for exclude in excludes:      
-                # logger.debug(f'looking at exclude {exclude}')  
-                for found in this_path.rglob(exclude):
-                    if found.is_dir():
-                        cp = subprocess.run("find \"%s\" -type f" % found, shell=True, text=True, capture_output=True)
-                        exclude_file_map[exclude].extend(cp.stdout.split('\n'))
-                    else:
-                        exclude_file_map[exclude].append(str(found))
-            
-            flat_excludes = [ f for e in exclude_file_map.keys() for f in exclude_file_map[e] if f.strip() != "" ]
-            local_stats_cache.cache_store(cache_id, flat_excludes)
+        excluded_files = { 'count': excluded.count, 'digest': excluded.digest }
+        local_stats_cache.cache_store(cache_id, excluded_files)
     
-    return flat_excludes
+    return excluded_files
 
 def get_path_uncompressed_size_kb(target_name, path, excludes, no_cache=False):
 
-    local_stats_cache = Cache(context='local', cache_file=LOCAL_STATS_CACHE_FILE)
+    local_stats_cache = get_local_stats_cache()
 
     # TODO: use target excludes to more accurately compute size
     # TODO: estimate compressed size to more accurately compute size 
@@ -22,7 +22,9 @@ FLAGS = {
     'exclude_vcs_ignores': False,
     'one_file_system': True,
     'no_cache': False,
-    'ignore_schedule': False
+    'ignore_schedule': False,
+    'json_output': False,
+    'create_targets': False
 }
 
 NAMED_PARAMETER_DEFAULTS = {
@@ -42,7 +44,9 @@ FLAGS_OPTIONS = {
     '-d': 'dry_run',
     '-f': 'force_push_latest',
     '--no-cache': 'no_cache',
-    '--ignore-schedule': 'ignore_schedule'
+    '--ignore-schedule': 'ignore_schedule',
+    '--json': 'json_output',
+    '--create': 'create_targets'
 }
 
 # -- input matching these will become keyword args passed to the command
@@ -54,7 +58,16 @@ NAMED_PARAMETER_OPTIONS = {
     '--path': 'path',
     '-l': 'log_level',
     '-o': 'order_by',
-    '--excludes': 'excludes'
+    '--excludes': 'excludes',
+    '--format': 'archive_format',
+    '--file': 'restore_path',
+    '--jobs': 'jobs',
+    '--full-every': 'full_every',
+    '--delta-min-mb': 'delta_min_mb',
+    '--parts': 'parts',
+    '--top': 'top',
+    '--volumes': 'volume_split',
+    '--volume-mb': 'volume_mb'
 }
 
 class Config(object):
@@ -75,9 +88,35 @@ class Config(object):
     
     working_folder = None 
     log_folder = None 
+    lock_folder = None 
+    status_file = None 
 
     cache_filename = None 
 
+    seekable_frame_mb = None 
+
+    checksum_algorithm = None 
+    digest_workers = None 
+    verify_workers = None 
+
+    scrub_days = None 
+    scrub_workers = None 
+    scrub_read_mb_per_second = None 
+
+    chunk_store_folder = None 
+    dedup_retention_days = None 
+
+    volume_workers = None 
+
+    disk_reserve_mb = None 
+
+    upload_slots = None 
+    list_workers = None 
+    push_queue_size = None 
+
+    daemon_socket = None 
+    daemon_refresh_minutes = None 
+
     def __init__(self, *args, **kwargs):        
 
         home_folder = os.path.expanduser(f'~{os.getenv("USER")}')
@@ -0,0 +1,221 @@
+import os
+import json
+import heapq
+import signal
+import socket
+import threading
+import socketserver
+from datetime import datetime, timedelta
+import cowpy
+from common import frequency_to_minutes
+from locks import FileLock, LockHeld
+
+logger = cowpy.getLogger()
+
+DEFAULT_REFRESH_MINUTES = 15
+
+def default_socket_filename(working_folder):
+    return os.path.join(working_folder, 'bckt.sock')
+
+def next_due_at(frequency, last_archive_at, now=None):
+    '''
+    When a target is next due: one frequency after its last archive, or now if it has none
+    or is one or more cycles behind
+    '''
+    now = now or datetime.now()
+    if last_archive_at is None:
+        return now
+    due_at = last_archive_at + timedelta(minutes=frequency_to_minutes(frequency))
+    return max(due_at, now)
+
+class _StatusHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        command = self.rfile.readline().decode('utf-8').strip() or 'status'
+        response = self.server.daemon.handle_command(command)
+        self.wfile.write((json.dumps(response, default=str) + '\n').encode('utf-8'))
+
+class _StatusServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class Daemon(object):
+    '''
+    Keeps one Backup warm (database connection, S3 session, remote inventory) and runs
+    each target when it comes due, sleeping in between. A local UNIX socket answers
+    "status" and "wake" requests.
+    '''
+
+    backup = None
+    socket_filename = None
+    refresh_minutes = None
+
+    def __init__(self, backup, socket_filename=None, refresh_minutes=None):
+        self.backup = backup
+        self.socket_filename = socket_filename or default_socket_filename(backup.config.working_folder)
+        self.refresh_minutes = int(refresh_minutes or DEFAULT_REFRESH_MINUTES)
+        # -- (due at, target name)
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._running = None
+        self._last_results = {}
+        self._started_at = None
+        self._refreshed_at = None
+
+    def _target_due_at(self, target, now=None):
+        last_archive = self.backup.db.get_last_archive(target['id'])
+        return next_due_at(target['frequency'], last_archive['pre_marker_timestamp'] if last_archive else None, now=now)
+
+    def refresh(self):
+        '''Rebuilds the queue from the targets table, picking up any adds and edits'''
+        now = datetime.now()
+        with self._lock:
+            # -- keeps the later due time of targets already pushed back a cycle by _reschedule
+            scheduled = { name: due_at for due_at, name in self._queue }
+        queue = []
+        for target in self.backup.db.get_targets():
+            # -- "never" targets are only ever run by hand
+            if not target['is_active'] or frequency_to_minutes(target['frequency']) == 0:
+                continue
+            due_at = self._target_due_at(target, now=now)
+            queue.append((max(due_at, scheduled.get(target['name'], due_at)), target['name']))
+        heapq.heapify(queue)
+        with self._lock:
+            self._queue = queue
+            self._refreshed_at = now
+        logger.debug(f'daemon queue refreshed: {len(queue)} active targets')
+
+    def _reschedule(self, target_name, ran_at):
+        target = self.backup.db.get_target(name=target_name)
+        if not target or not target['is_active'] or frequency_to_minutes(target['frequency']) == 0:
+            return
+        now = datetime.now()
+        due_at = self._target_due_at(target, now=now)
+        # -- still due means nothing was archived (no new files, no space..), so look again in a cycle rather than spin
+        if due_at <= now:
+            due_at = ran_at + timedelta(minutes=frequency_to_minutes(target['frequency']))
+        with self._lock:
+            heapq.heappush(self._queue, (due_at, target_name))
+
+    def _pop_due(self, now):
+        with self._lock:
+            if self._queue and self._queue[0][0] <= now:
+                return heapq.heappop(self._queue)[1]
+        return None
+
+    def _seconds_until_next(self, now):
+        with self._lock:
+            next_refresh = self._refreshed_at + timedelta(minutes=self.refresh_minutes)
+            wake_at = min(self._queue[0][0], next_refresh) if self._queue else next_refresh
+        return max((wake_at - now).total_seconds(), 0)
+
+    def handle_command(self, command):
+        if command == 'wake':
+            self._wake.set()
+            return { 'ok': True }
+        if command == 'status':
+            with self._lock:
+                queue = sorted(self._queue)
+                return {
+                    'pid': os.getpid(),
+                    'started_at': self._started_at,
+                    'refreshed_at': self._refreshed_at,
+                    'running': self._running,
+                    'queue': [ { 'target': name, 'due_at': due_at } for due_at, name in queue ],
+                    'last_results': self._last_results
+                }
+        return { 'ok': False, 'error': f'unknown command "{command}"' }
+
+    def _single_instance_lock(self):
+        '''Exclusive for the daemon's lifetime, beside its socket, so a second daemon never takes over the first one's socket'''
+        try:
+            return FileLock(f'{self.socket_filename}.lock').acquire()
+        except LockHeld as lh:
+            raise Exception(f'A daemon is already running on {self.socket_filename} ({lh})')
+
+    def _serve_status(self):
+        # -- only a socket left by a daemon that died, the lock is ours
+        if os.path.exists(self.socket_filename):
+            os.unlink(self.socket_filename)
+        server = _StatusServer(self.socket_filename, _StatusHandler)
+        server.daemon = self
+        thread = threading.Thread(target=server.serve_forever, name='bckt-status', daemon=True)
+        thread.start()
+        return server
+
+    def stop(self, *args):
+        self._stop.set()
+        self._wake.set()
+
+    def serve(self, run_target):
+        '''Calls run_target(target) for each target as it comes due, until stopped. run_target returns the run's Results'''
+
+        instance_lock = self._single_instance_lock()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        try:
+            self._started_at = datetime.now()
+            self.refresh()
+            server = self._serve_status()
+        except:
+            instance_lock.release()
+            raise 
+        logger.info(f'daemon listening on {self.socket_filename}')
+
+        try:
+            while not self._stop.is_set():
+                now = datetime.now()
+                if now >= self._refreshed_at + timedelta(minutes=self.refresh_minutes):
+                    self.refresh()
+
+                target_name = self._pop_due(now)
+                if target_name is None:
+                    self._wake.wait(timeout=self._seconds_until_next(now))
+                    if self._wake.is_set() and not self._stop.is_set():
+                        self._wake.clear()
+                        self.refresh()
+                    continue
+
+                target = self.backup.db.get_target(name=target_name)
+                if not target:
+                    continue
+
+                with self._lock:
+                    self._running = target_name
+                outcome = None
+                try:
+                    results = run_target(target)
+                    outcome = results.reasons_for(target_name)
+                except:
+                    logger.exception()
+                    outcome = [ 'failure' ]
+                finally:
+                    with self._lock:
+                        self._running = None
+                        self._last_results[target_name] = { 'at': now, 'results': outcome }
+
+                self._reschedule(target_name, now)
+        finally:
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(self.socket_filename):
+                os.unlink(self.socket_filename)
+            instance_lock.release()
+            logger.info('daemon stopped')
+
+def query_daemon(socket_filename, command='status', timeout=5):
+    '''Sends one command to a running daemon and returns its decoded response'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(socket_filename)
+        s.sendall(f'{command}\n'.encode('utf-8'))
+        response = b''
+        while not response.endswith(b'\n'):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    return json.loads(response.decode('utf-8'))
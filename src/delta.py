@@ -0,0 +1,262 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import hashlib
+import cowpy
+
+logger = cowpy.getLogger()
+
+# -- deltas ride inside the archive under this folder, next to the target path
+DELTA_FOLDER = '.bckt-delta'
+DELTA_VERSION = 1
+
+# -- blocks double from the minimum until a file has at most DELTA_MAX_BLOCKS of them, bounding signature size and lookup memory
+DELTA_MIN_BLOCK_SIZE = 128*1024
+DELTA_MAX_BLOCKS = 65536
+
+# -- a delta carrying more new bytes than this share of its file is dropped and the file stored whole, as the new base
+DELTA_REBASE_RATIO = 0.5
+
+# -- most bytes per file the (pure Python) rolling search may cover, after which only aligned blocks are matched
+ROLL_BUDGET = 64*1024*1024
+
+# -- literal runs are flushed at this size
+LITERAL_RUN = 4*1024*1024
+
+ADLER_MOD = 65521
+
+SIGNATURE_RECORD = struct.Struct('>I16s')
+COPY_OP = struct.Struct('>QI')
+LITERAL_OP = struct.Struct('>I')
+
+def delta_block_size(size):
+    block_size = DELTA_MIN_BLOCK_SIZE
+    while size / block_size > DELTA_MAX_BLOCKS:
+        block_size *= 2
+    return block_size
+
+def _strong(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+def _read_header(f):
+    return json.loads(f.readline().decode('utf-8'))
+
+def _mapped(f, size):
+    '''Whole-file read-only view, or empty bytes for an empty file (mmap refuses those)'''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+def write_signature(path, signature_filename, base):
+    '''
+    Records the rsync signature of path as stored whole in an archive: a weak (adler32) and strong
+    (blake2b) checksum per block. base is the header: which archive holds this version, its member name.
+    '''
+    st = os.stat(path)
+    block_size = delta_block_size(st.st_size)
+    header = dict(base, version=DELTA_VERSION, path=path, size=st.st_size, mtime=int(st.st_mtime), block_size=block_size)
+    temp_filename = f'{signature_filename}.{os.getpid()}.tmp'
+    os.makedirs(os.path.dirname(signature_filename), exist_ok=True)
+    with open(path, 'rb') as f, open(temp_filename, 'wb') as out:
+        out.write(json.dumps(header).encode('utf-8') + b'\n')
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            out.write(SIGNATURE_RECORD.pack(zlib.adler32(block), _strong(block)))
+    os.replace(temp_filename, signature_filename)
+    return header
+
+def read_signature(signature_filename):
+    '''(header, { weak: block index }, { strong: block index })'''
+    weak = {}
+    strong = {}
+    with open(signature_filename, 'rb') as f:
+        header = _read_header(f)
+        index = 0
+        while True:
+            record = f.read(SIGNATURE_RECORD.size)
+            if len(record) < SIGNATURE_RECORD.size:
+                break
+            (weak_sum, strong_sum,) = SIGNATURE_RECORD.unpack(record)
+            weak.setdefault(weak_sum, index)
+            strong.setdefault(strong_sum, index)
+            index += 1
+    return header, weak, strong
+
+def read_signature_header(signature_filename):
+    with open(signature_filename, 'rb') as f:
+        return _read_header(f)
+
+class _DeltaWriter(object):
+
+    def __init__(self, out):
+        self.out = out
+        self.literal = bytearray()
+        self.copy_start = None
+        self.copy_count = 0
+        self.literal_bytes = 0
+        self.copied_bytes = 0
+
+    def copy(self, block_index, length):
+        self._flush_literal()
+        if self.copy_start is not None and self.copy_start + self.copy_count == block_index:
+            self.copy_count += 1
+        else:
+            self._flush_copy()
+            self.copy_start = block_index
+            self.copy_count = 1
+        self.copied_bytes += length
+
+    def add_literal(self, data):
+        self._flush_copy()
+        self.literal.extend(data)
+        self.literal_bytes += len(data)
+        if len(self.literal) >= LITERAL_RUN:
+            self._flush_literal()
+
+    def _flush_copy(self):
+        if self.copy_start is not None:
+            self.out.write(b'C' + COPY_OP.pack(self.copy_start, self.copy_count))
+            self.copy_start = None
+            self.copy_count = 0
+
+    def _flush_literal(self):
+        if self.literal:
+            self.out.write(b'L' + LITERAL_OP.pack(len(self.literal)))
+            self.out.write(self.literal)
+            self.literal = bytearray()
+
+    def close(self):
+        self._flush_copy()
+        self._flush_literal()
+        self.out.write(b'E')
+
+def write_delta(path, signature_filename, delta_filename, member, max_literal_bytes=None):
+    '''
+    Encodes path against the signature of its base version. Blocks are matched where they lie first
+    (one strong hash each, so in-place changes cost nothing extra); past a block that does not match,
+    an adler32 rolling over one block's window looks for where matching resumes after an insert or
+    delete, up to ROLL_BUDGET bytes a file. Returns the delta header, including literal_bytes (new data
+    carried), or None as soon as literal_bytes passes max_literal_bytes.
+    '''
+
+    (base, weak, strong,) = read_signature(signature_filename)
+    block_size = base['block_size']
+    st = os.stat(path)
+    size = st.st_size
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f, open(delta_filename, 'wb') as out:
+        header = {
+            'version': DELTA_VERSION, 'path': path, 'member': member, 'size': size, 'mtime': int(st.st_mtime), 'mode': st.st_mode & 0o7777,
+            'base_archive_id': base['archive_id'], 'base_archive_filename': base['archive_filename'], 'base_member': base['member'], 'base_size': base['size'],
+            'block_size': block_size
+        }
+        # -- the header line is rewritten once the sha256 is known, so it is padded to a fixed width
+        out.write(b' ' * 4096 + b'\n')
+        writer = _DeltaWriter(out)
+        data = _mapped(f, size)
+        roll_budget = ROLL_BUDGET
+        try:
+            pos = 0
+            while pos < size:
+                if max_literal_bytes is not None and writer.literal_bytes > max_literal_bytes:
+                    return None
+                block = data[pos:pos + block_size]
+                index = strong.get(_strong(block))
+                if index is not None:
+                    writer.copy(index, len(block))
+                    digest.update(block)
+                    pos += len(block)
+                    continue
+                match = None
+                if roll_budget > 0:
+                    roll_budget -= block_size
+                    match = _roll_to_match(data, pos, block_size, size, weak, strong)
+                if match is None:
+                    writer.add_literal(block)
+                    digest.update(block)
+                    pos += len(block)
+                else:
+                    (match_pos, index,) = match
+                    writer.add_literal(data[pos:match_pos])
+                    writer.copy(index, block_size)
+                    digest.update(data[pos:match_pos + block_size])
+                    pos = match_pos + block_size
+        finally:
+            if size > 0:
+                data.close()
+        writer.close()
+
+        header['sha256'] = digest.hexdigest()
+        header['literal_bytes'] = writer.literal_bytes
+        encoded = json.dumps(header).encode('utf-8')
+        if len(encoded) > 4096:
+            raise ValueError(f'delta header for {path} is too long')
+        out.seek(0)
+        out.write(encoded)
+
+    return header
+
+def _roll_to_match(data, pos, block_size, size, weak, strong):
+    '''First (position, base block index) in (pos, pos + block_size] where a whole base block matches, or None'''
+
+    if pos + block_size >= size:
+        return None
+    window = data[pos:pos + block_size]
+    checksum = zlib.adler32(window)
+    a = checksum & 0xffff
+    b = checksum >> 16
+    end = min(pos + block_size, size - block_size)
+    for start in range(pos, end):
+        x_out = data[start]
+        x_in = data[start + block_size]
+        # -- adler32 rolled one byte: a over the bytes (plus one), b over the running values of a
+        a = (a - x_out + x_in) % ADLER_MOD
+        b = (b - block_size*x_out + a - 1) % ADLER_MOD
+        if ((b << 16) | a) in weak:
+            index = strong.get(_strong(data[start + 1:start + 1 + block_size]))
+            if index is not None:
+                return start + 1, index
+    return None
+
+def read_delta_header(delta_filename):
+    with open(delta_filename, 'rb') as f:
+        return json.loads(f.readline().decode('utf-8').strip())
+
+def apply_delta(delta_filename, base_filename, output_filename):
+    '''Rebuilds a file from its base version and a delta, checking the result's sha256. Returns the header'''
+
+    with open(delta_filename, 'rb') as f, open(base_filename, 'rb') as base, open(output_filename, 'wb') as out:
+        header = json.loads(f.readline().decode('utf-8').strip())
+        block_size = header['block_size']
+        digest = hashlib.sha256()
+        while True:
+            op = f.read(1)
+            if op == b'C':
+                (start, count,) = COPY_OP.unpack(f.read(COPY_OP.size))
+                base.seek(start*block_size)
+                remaining = count*block_size
+                while remaining > 0:
+                    block = base.read(min(remaining, LITERAL_RUN))
+                    if not block:
+                        break
+                    out.write(block)
+                    digest.update(block)
+                    remaining -= len(block)
+            elif op == b'L':
+                (length,) = LITERAL_OP.unpack(f.read(LITERAL_OP.size))
+                block = f.read(length)
+                out.write(block)
+                digest.update(block)
+            elif op == b'E':
+                break
+            else:
+                raise ValueError(f'{delta_filename} is truncated or corrupt')
+
+    if digest.hexdigest() != header['sha256']:
+        raise ValueError(f'{output_filename} rebuilt from {delta_filename} does not match its recorded sha256')
+    os.chmod(output_filename, header['mode'])
+    os.utime(output_filename, (header['mtime'], header['mtime']))
+    return header
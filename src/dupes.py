@@ -0,0 +1,163 @@
+import os
+import hashlib
+import sqlite3
+import cowpy
+from common import digest_files
+
+logger = cowpy.getLogger()
+
+# -- a partial hash covers this much of each end of a file, and smaller files are hashed whole by it
+PARTIAL_HASH_BYTES = 64*1024
+
+# -- rows fetched, hashed and written back at a time, which is all the memory a pass holds
+BATCH_SIZE = 2000
+
+def partial_hash(path, size):
+    '''blake2b of a file's first and last PARTIAL_HASH_BYTES, or of all of it if that is no more'''
+    h = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        h.update(f.read(PARTIAL_HASH_BYTES))
+        if size > 2*PARTIAL_HASH_BYTES:
+            f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+        h.update(f.read(PARTIAL_HASH_BYTES))
+    return h.hexdigest()
+
+def _is_nested(path, other_path):
+    path = os.path.abspath(path)
+    other_path = os.path.abspath(other_path)
+    return path == other_path or path.startswith(other_path.rstrip('/') + '/')
+
+class DupeIndex(object):
+    '''
+    Every regular file of every target in a SQLite file, then narrowed to duplicates in passes:
+    same size, then same partial hash, then same full hash. Only files still sharing a group with
+    another inode are read at each step, and each pass pages through the table by id.
+    '''
+
+    filename = None
+
+    def __init__(self, filename):
+        self.filename = filename
+        if os.path.exists(filename):
+            os.unlink(filename)
+        self._conn = sqlite3.connect(filename)
+        self._conn.execute('pragma journal_mode=off')
+        self._conn.execute('pragma synchronous=off')
+        self._conn.execute('create table files (id integer primary key, target text, path text, size int, dev int, ino int, partial text, full text)')
+        self._conn.execute('create table targets (name text primary key, path text, files int, bytes int)')
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def add_target(self, target_name, target_path, entries, min_size=1):
+        '''Records the regular files among a target's scanned entries'''
+        files = 0
+        total = 0
+        batch = []
+        for entry in entries:
+            if not entry.is_file() or entry.size < min_size:
+                continue
+            batch.append((target_name, entry.path, entry.size, entry.dev, entry.ino))
+            files += 1
+            total += entry.size
+            if len(batch) >= BATCH_SIZE:
+                self._conn.executemany('insert into files (target, path, size, dev, ino) values (?, ?, ?, ?, ?)', batch)
+                batch = []
+        self._conn.executemany('insert into files (target, path, size, dev, ino) values (?, ?, ?, ?, ?)', batch)
+        self._conn.execute('insert or replace into targets (name, path, files, bytes) values (?, ?, ?, ?)', (target_name, target_path, files, total))
+        self._conn.commit()
+        return files, total
+
+    def _candidates(self, where):
+        '''(id, path, size) of rows matching where, a page at a time'''
+        last_id = 0
+        while True:
+            rows = self._conn.execute(f'select id, path, size from files where id > ? and {where} order by id limit ?', (last_id, BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+
+    def group(self, workers=4):
+        '''Runs the size, partial and full hash passes. Returns (files partially hashed, files fully hashed)'''
+
+        self._conn.execute('create index files_size on files (size)')
+        self._conn.execute('create index files_inode on files (dev, ino)')
+
+        # -- the same inode twice (hard links, or nested targets) is overlap, not a duplicate copy
+        self._conn.execute('create temp table dupe_sizes (size int primary key)')
+        self._conn.execute("insert into dupe_sizes select size from files group by size having count(distinct dev || ':' || ino) > 1")
+
+        partial_count = 0
+        for rows in self._candidates('size in (select size from dupe_sizes)'):
+            updates = []
+            for file_id, path, size in rows:
+                try:
+                    digest = partial_hash(path, size)
+                except OSError as ose:
+                    logger.warning(f'could not read {path}: {ose}')
+                    continue
+                # -- a small file's partial hash already covers all of it
+                updates.append((digest, digest if size <= 2*PARTIAL_HASH_BYTES else None, file_id))
+            self._conn.executemany('update files set partial = ?, full = ? where id = ?', updates)
+            partial_count += len(updates)
+        self._conn.commit()
+
+        self._conn.execute('create index files_partial on files (size, partial)')
+        self._conn.execute('create temp table dupe_partials (size int, partial text, primary key (size, partial))')
+        self._conn.execute(f"insert into dupe_partials select size, partial from files where partial is not null and size > {2*PARTIAL_HASH_BYTES} group by size, partial having count(distinct dev || ':' || ino) > 1")
+
+        full_count = 0
+        for rows in self._candidates('full is null and partial is not null and (size, partial) in (select size, partial from dupe_partials)'):
+            paths = { path: file_id for file_id, path, size in rows }
+            digests = digest_files(list(paths.keys()), workers=workers)
+            self._conn.executemany('update files set full = ? where id = ?', [ (digest.md5, paths[path]) for path, digest in digests.items() ])
+            full_count += len(digests)
+        self._conn.commit()
+
+        # -- one row per target per distinct content held more than once anywhere
+        self._conn.execute("create table holdings as select target, size, full, count(distinct dev || ':' || ino) as copies from files where full is not null group by target, size, full")
+        self._conn.execute('create index holdings_content on holdings (size, full)')
+        self._conn.execute("create table dupe_groups as select size, full, count(distinct dev || ':' || ino) as copies from files where full is not null group by size, full having copies > 1")
+        self._conn.commit()
+
+        return partial_count, full_count
+
+    def totals(self):
+        '''(duplicate groups, files in them, bytes that one copy per group would save)'''
+        return self._conn.execute('select count(*), coalesce(sum(copies), 0), coalesce(sum(size*(copies - 1)), 0) from dupe_groups').fetchone()
+
+    def targets(self):
+        return { name: { 'path': path, 'files': files, 'bytes': total } for name, path, files, total in self._conn.execute('select name, path, files, bytes from targets') }
+
+    def pair_report(self):
+        '''
+        Duplicate bytes by target pair, largest first: across two targets, the bytes of content both
+        hold; within one (target paired with itself), the bytes of its extra copies
+        '''
+        within = self._conn.execute('select target, target, sum(size*(copies - 1)) as dupe_bytes, sum(copies - 1) from holdings where copies > 1 group by target').fetchall()
+        across = self._conn.execute(
+            'select a.target, b.target, sum(a.size), count(*) from holdings a inner join holdings b on b.size = a.size and b.full = a.full and a.target < b.target '
+            'inner join dupe_groups g on g.size = a.size and g.full = a.full group by a.target, b.target').fetchall()
+        return sorted(within + across, key=lambda r: -r[2])
+
+    def overlap_report(self):
+        '''Bytes of the very same files (by inode) archived by two targets, with whether one target's path is inside the other's'''
+        targets = self.targets()
+        report = []
+        for target_a, target_b, file_count, overlap_bytes in self._conn.execute(
+                'select a.target, b.target, count(*), sum(a.size) from files a inner join files b on b.dev = a.dev and b.ino = a.ino and a.target < b.target group by a.target, b.target'):
+            nested = None
+            if _is_nested(targets[target_b]['path'], targets[target_a]['path']):
+                nested = f'{target_b} is inside {target_a}'
+            elif _is_nested(targets[target_a]['path'], targets[target_b]['path']):
+                nested = f'{target_a} is inside {target_b}'
+            report.append((target_a, target_b, file_count, overlap_bytes, nested))
+        return sorted(report, key=lambda r: -r[3])
+
+    def top_groups(self, limit=10):
+        '''The biggest duplicate groups by wasted bytes, each with one of its paths'''
+        return self._conn.execute(
+            'select g.size, g.copies, g.size*(g.copies - 1), (select path from files f where f.size = g.size and f.full = g.full limit 1) '
+            'from dupe_groups g order by g.size*(g.copies - 1) desc limit ?', (limit,)).fetchall()
@@ -0,0 +1,122 @@
+import os
+import re
+import math
+import threading
+from datetime import datetime
+import cowpy
+from common import target_name_from_archive_filename, pre_marker_timestamp_from_archive_filename, archive_filename_match, volume_archive_filename
+
+logger = cowpy.getLogger()
+
+class LocalArchiveIndex(object):
+    '''
+    Archive files in the working folder, from a single scandir that is cached for the
+    life of the command and kept current by our own writes and deletes. The volumes of a
+    split archive are one entry, under the archive's filename, sized as all of them.
+    Shared by the command's worker threads, so every read and write holds the lock and
+    readers get copies.
+    '''
+
+    working_folder = None
+    _entries = None
+
+    def __init__(self, working_folder):
+        self.working_folder = working_folder
+        self._lock = threading.RLock()
+
+    def _entry(self, name, st):
+        return {
+            'filename': name,
+            'target_name': target_name_from_archive_filename(name),
+            'pre_marker_timestamp': pre_marker_timestamp_from_archive_filename(name),
+            'size': int(st.st_size),
+            'last_modified': datetime.strftime(datetime.fromtimestamp(math.floor(st.st_mtime)), "%Y-%m-%d %H:%M:%S.%f")
+        }
+
+    def _is_archive_filename(self, name):
+        return name.endswith('.tar.gz') and target_name_from_archive_filename(name) != "-"
+
+    def _is_volume_filename(self, name):
+        archive_name = volume_archive_filename(name)
+        return archive_name is not None and self._is_archive_filename(archive_name)
+
+    def _add_volume(self, entries, name, st):
+        archive_name = volume_archive_filename(name)
+        volume_entry = self._entry(archive_name, st)
+        entry = entries.get(archive_name)
+        if entry is None:
+            entry = entries[archive_name] = dict(volume_entry, size=0, volumes=[])
+        if name in entry['volumes']:
+            return
+        entry['size'] += volume_entry['size']
+        entry['last_modified'] = max(entry['last_modified'], volume_entry['last_modified'])
+        entry['volumes'] = sorted(entry['volumes'] + [ name ])
+
+    def _load(self):
+        entries = {}
+        if os.path.isdir(self.working_folder):
+            with os.scandir(self.working_folder) as it:
+                for dir_entry in it:
+                    if not dir_entry.is_file(follow_symlinks=False):
+                        continue
+                    if self._is_archive_filename(dir_entry.name):
+                        entries[dir_entry.name] = self._entry(dir_entry.name, dir_entry.stat(follow_symlinks=False))
+                    elif self._is_volume_filename(dir_entry.name):
+                        self._add_volume(entries, dir_entry.name, dir_entry.stat(follow_symlinks=False))
+        logger.debug(f'indexed {len(entries)} local archives in {self.working_folder}')
+        return entries
+
+    @property
+    def entries(self):
+        '''The live entries, loaded on first use; callers outside the lock take a copy'''
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return self._entries
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+
+    def by_filename(self):
+        with self._lock:
+            return { name: dict(entry) for name, entry in self.entries.items() }
+
+    def exists(self, archive_filename):
+        with self._lock:
+            return os.path.basename(archive_filename) in self.entries
+
+    def get(self, archive_filename):
+        with self._lock:
+            entry = self.entries.get(os.path.basename(archive_filename))
+            return dict(entry) if entry else None
+
+    def archives(self, target_name=None):
+        with self._lock:
+            entries = [ dict(e) for e in self.entries.values() ]
+        if target_name is None:
+            return entries
+        match = archive_filename_match(target_name)
+        return [ e for e in entries if re.match(match, os.path.join(self.working_folder, e['filename'])) ]
+
+    def added(self, archive_path):
+        '''Record an archive we just wrote'''
+        name = os.path.basename(archive_path)
+        with self._lock:
+            if self._entries is not None and self._is_archive_filename(name):
+                self._entries[name] = self._entry(name, os.stat(os.path.join(self.working_folder, name)))
+            elif self._entries is not None and self._is_volume_filename(name):
+                self._add_volume(self._entries, name, os.stat(os.path.join(self.working_folder, name)))
+
+    def removed(self, archive_path):
+        '''Record an archive we just deleted'''
+        with self._lock:
+            if self._entries is not None:
+                self._entries.pop(os.path.basename(archive_path), None)
+
+    def unlink(self, archive_filename):
+        with self._lock:
+            entry = self.get(archive_filename)
+            for name in (entry or {}).get('volumes') or [ os.path.basename(archive_filename) ]:
+                os.unlink(os.path.join(self.working_folder, name))
+            self.removed(archive_filename)
@@ -0,0 +1,87 @@
+import os
+import re
+import fcntl
+import cowpy
+
+logger = cowpy.getLogger()
+
+GLOBAL_LOCK_NAME = 'bckt'
+
+class LockHeld(Exception):
+    pass
+
+class FileLock(object):
+    '''
+    flock(2) on a file in the lock folder. Held until released or the process exits, so a
+    crashed run never leaves a stale lock behind. Exclusive holders write their pid for the message.
+    '''
+
+    filename = None
+    shared = False
+    blocking = False
+
+    def __init__(self, filename, shared=False, blocking=False):
+        self.filename = filename
+        self.shared = shared
+        self.blocking = blocking
+        self._fd = None
+
+    def _holder(self):
+        try:
+            with open(self.filename, 'r') as f:
+                pid = f.read().strip()
+            return f'pid {pid}' if pid else 'another bckt process'
+        except OSError:
+            return 'another bckt process'
+
+    def acquire(self):
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        operation = (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX) | (0 if self.blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(fd, operation)
+        except BlockingIOError:
+            os.close(fd)
+            raise LockHeld(f'{os.path.basename(self.filename)} is held by {self._holder()}')
+        if not self.shared:
+            os.ftruncate(fd, 0)
+            os.write(fd, f'{os.getpid()}\n'.encode('utf-8'))
+        self._fd = fd
+        logger.debug(f'acquired {"shared" if self.shared else "exclusive"} lock {self.filename}')
+        return self
+
+    def release(self):
+        if self._fd is not None:
+            if not self.shared:
+                os.ftruncate(self._fd, 0)
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+class LockManager(object):
+    '''
+    One global lock, shared by runs and exclusive for maintenance (pruning, repair), and one
+    exclusive lock per target so the same target is never archived by two processes at once
+    '''
+
+    lock_folder = None
+
+    def __init__(self, lock_folder):
+        self.lock_folder = lock_folder
+
+    def _filename(self, name):
+        if not os.path.isdir(self.lock_folder):
+            os.makedirs(self.lock_folder)
+        return os.path.join(self.lock_folder, f'{name}.lock')
+
+    def global_lock(self, exclusive=False, blocking=False):
+        return FileLock(self._filename(GLOBAL_LOCK_NAME), shared=not exclusive, blocking=blocking)
+
+    def target_lock(self, target_name, blocking=False):
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', target_name)
+        return FileLock(self._filename(f'{GLOBAL_LOCK_NAME}-target-{safe_name}'), blocking=blocking)
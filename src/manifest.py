@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import zlib
+import base64
+import fnmatch
+from datetime import datetime
+import cowpy
+
+logger = cowpy.getLogger()
+
+MANIFEST_VERSION = 1
+
+# -- GNU tar verbose (-vv --full-time) index line, e.g.
+# -- -rw-r--r-- user/group      1234 2024-01-08 12:00:00.123456789 /path/to/file
+TAR_INDEX_LINE_MATCH = r"^(\S+)\s+(\S+)\s+([0-9]+)\s+([0-9]{4}-[0-9]{2}-[0-9]{2})\s+([0-9:]+)(\.[0-9]+)?\s(.*)$"
+
+# -- --quoting-style=escape writes unusual bytes in names as C escapes, octal for anything unprintable
+TAR_NAME_ESCAPE_MATCH = rb"\\([0-7]{3}|.)"
+TAR_NAME_ESCAPES = { b'a': b'\a', b'b': b'\b', b'f': b'\f', b'n': b'\n', b'r': b'\r', b't': b'\t', b'v': b'\v' }
+
+def unescape_tar_name(name):
+    '''A member name as tar stored it, from its escaped form in a verbose listing'''
+    def unescape(match):
+        escape = match.group(1)
+        if len(escape) == 3:
+            return bytes([ int(escape, 8) & 0xff ])
+        return TAR_NAME_ESCAPES.get(escape, escape)
+    return re.sub(TAR_NAME_ESCAPE_MATCH, unescape, name.encode('utf-8', 'surrogateescape')).decode('utf-8', 'surrogateescape')
+
+class Manifest(object):
+    '''Columnar file listing for one archive, directory names interned'''
+
+    dirs = None
+    dir_index = None
+    names = None
+    sizes = None
+    mtimes = None
+
+    def __init__(self, *args, **kwargs):
+        self.dirs = []
+        self.dir_index = []
+        self.names = []
+        self.sizes = []
+        self.mtimes = []
+        self._dir_lookup = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, path, size, mtime):
+        dirname, name = os.path.split(path)
+        if dirname not in self._dir_lookup:
+            self._dir_lookup[dirname] = len(self.dirs)
+            self.dirs.append(dirname)
+        self.dir_index.append(self._dir_lookup[dirname])
+        self.names.append(name)
+        self.sizes.append(int(size))
+        self.mtimes.append(int(mtime))
+
+    def total_size(self):
+        return sum(self.sizes)
+
+    def entries(self):
+        for i, name in enumerate(self.names):
+            yield os.path.join(self.dirs[self.dir_index[i]], name), self.sizes[i], self.mtimes[i]
+
+    def find(self, glob):
+        '''Globs with a slash match the whole path, otherwise only the file name'''
+        match = re.compile(fnmatch.translate(glob)).match
+        by_name = glob.find('/') < 0
+        for path, size, mtime in self.entries():
+            if match(os.path.basename(path) if by_name else path):
+                yield path, size, mtime
+
+    def encode(self):
+        columns = {
+            'v': MANIFEST_VERSION,
+            'dirs': self.dirs,
+            'dir_index': self.dir_index,
+            'names': self.names,
+            'sizes': self.sizes,
+            'mtimes': self.mtimes
+        }
+        packed = zlib.compress(json.dumps(columns, separators=(',', ':')).encode('utf-8'), 9)
+        return base64.b64encode(packed).decode('ascii')
+
+    @staticmethod
+    def decode(blob):
+        columns = json.loads(zlib.decompress(base64.b64decode(blob)).decode('utf-8'))
+        m = Manifest()
+        m.dirs = columns['dirs']
+        m.dir_index = columns['dir_index']
+        m.names = columns['names']
+        m.sizes = columns['sizes']
+        m.mtimes = columns['mtimes']
+        m._dir_lookup = { d: i for i, d in enumerate(m.dirs) }
+        return m
+
+def manifest_from_tar_index(index_filename):
+    '''Builds a manifest of the regular files listed in a tar -vv --full-time --quoting-style=escape --index-file output'''
+
+    m = Manifest()
+
+    with open(index_filename, 'r', errors='surrogateescape') as f:
+        for line in f:
+            matches = re.findall(TAR_INDEX_LINE_MATCH, line.rstrip('\n'))
+            if len(matches) == 0:
+                logger.debug(f'skipping unparsed index line: {line}')
+                continue
+            (mode, owner, size, date, time, fraction, path,) = matches[0]
+            # -- only regular files, directories and links don't answer "which archive has this file"
+            if mode[0] != '-':
+                continue
+            mtime = datetime.strptime(f'{date} {time}', "%Y-%m-%d %H:%M:%S").timestamp()
+            m.add(unescape_tar_name(path.lstrip(' ')), size, mtime)
+
+    return m
@@ -0,0 +1,101 @@
+import os
+import stat
+import fnmatch
+import cowpy
+
+logger = cowpy.getLogger()
+
+class ScanEntry(object):
+    '''One filesystem node found under a target path'''
+
+    __slots__ = ('path', 'relpath', 'size', 'mtime', 'mode', 'dev', 'ino')
+
+    def __init__(self, path, relpath, st):
+        self.path = path
+        self.relpath = relpath
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.mode = st.st_mode
+        self.dev = st.st_dev
+        self.ino = st.st_ino
+
+    def is_file(self):
+        return stat.S_ISREG(self.mode)
+
+    def is_dir(self):
+        return stat.S_ISDIR(self.mode)
+
+    def is_link(self):
+        return stat.S_ISLNK(self.mode)
+
+def split_excludes(excludes):
+    '''Target excludes are stored colon-separated'''
+    if not excludes:
+        return []
+    return [ e for e in excludes.split(':') if e and e.strip() != "" ]
+
+def is_excluded(relpath, exclude_patterns):
+    '''
+    Mirrors tar's default (unanchored, wildcard) --exclude matching: a pattern
+    excludes a path if it matches the path or any trailing run of its components
+    '''
+    parts = relpath.split('/')
+    for pattern in exclude_patterns:
+        if pattern.find('/') < 0:
+            if fnmatch.fnmatchcase(parts[-1], pattern):
+                return True
+        else:
+            for i in range(len(parts)):
+                if fnmatch.fnmatchcase('/'.join(parts[i:]), pattern.strip('/')):
+                    return True
+    return False
+
+def scan_path(path, excludes=None, one_file_system=True, on_error=None):
+    '''
+    Single pass, depth-first walk of path yielding a ScanEntry for every directory,
+    file and link, pruning excluded subtrees (and other filesystems) without descending into them
+    '''
+
+    exclude_patterns = split_excludes(excludes) if isinstance(excludes, str) or excludes is None else excludes
+
+    root = os.path.abspath(path)
+    root_stat = os.lstat(root)
+    yield ScanEntry(root, '', root_stat)
+
+    if not stat.S_ISDIR(root_stat.st_mode):
+        return
+
+    stack = [ (root, '') ]
+
+    while stack:
+        dirpath, dirrel = stack.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                children = sorted(it, key=lambda e: e.name)
+        except OSError as ose:
+            if on_error:
+                on_error(dirpath, ose)
+            else:
+                logger.warning(f'scan skipping {dirpath}: {ose}')
+            continue
+
+        subdirs = []
+        for child in children:
+            relpath = f'{dirrel}/{child.name}' if dirrel else child.name
+            if is_excluded(relpath, exclude_patterns):
+                continue
+            try:
+                st = child.stat(follow_symlinks=False)
+            except OSError as ose:
+                if on_error:
+                    on_error(child.path, ose)
+                continue
+            entry = ScanEntry(child.path, relpath, st)
+            yield entry
+            if entry.is_dir():
+                if one_file_system and st.st_dev != root_stat.st_dev:
+                    continue
+                subdirs.append((child.path, relpath))
+
+        # -- reversed so the stack pops subdirectories in name order
+        stack.extend(reversed(subdirs))
@@ -0,0 +1,173 @@
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+import cowpy
+
+logger = cowpy.getLogger()
+
+class Claim(object):
+    '''The resources one step of a target's run needs while it runs'''
+
+    cpu = 0
+    read_device = None
+    space_kb = 0
+    upload = False
+
+    def __init__(self, cpu=0, read_device=None, space_kb=0, upload=False):
+        self.cpu = cpu
+        self.read_device = read_device
+        self.space_kb = space_kb
+        self.upload = upload
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+def path_device(path):
+    '''The device a path lives on, so that two reads from the same disk are not scheduled together'''
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+class ResourceScheduler(object):
+    '''
+    Admits claims only when they don't contend: CPU slots for compression, one reader per
+    source device, working folder space reserved against what is free, and upload slots
+    '''
+
+    cpu_slots = None
+    upload_slots = None
+    free_space_kb = None
+
+    def __init__(self, cpu_slots=1, upload_slots=1, free_space_kb=None):
+        self.cpu_slots = cpu_slots
+        self.upload_slots = upload_slots
+        self.free_space_kb = free_space_kb
+        self._cond = threading.Condition()
+        self._cpu_used = 0
+        self._uploads_used = 0
+        self._devices_reading = set()
+        self._reserved_kb = 0
+
+    def _admissible(self, claim):
+        if claim.cpu and self._cpu_used + claim.cpu > self.cpu_slots:
+            return False
+        if claim.read_device is not None and claim.read_device in self._devices_reading:
+            return False
+        if claim.upload and self._uploads_used >= self.upload_slots:
+            return False
+        # -- a claim bigger than the disk on its own is still admitted once nothing else is reserved,
+        # -- making room for it is the claimant's business
+        if claim.space_kb and self._reserved_kb > 0 and self.free_space_kb:
+            if self._reserved_kb + claim.space_kb > self.free_space_kb():
+                return False
+        return True
+
+    def acquire(self, claim):
+        with self._cond:
+            while not self._admissible(claim):
+                self._cond.wait()
+            self._cpu_used += claim.cpu
+            self._uploads_used += 1 if claim.upload else 0
+            self._reserved_kb += claim.space_kb
+            if claim.read_device is not None:
+                self._devices_reading.add(claim.read_device)
+
+    def release(self, claim):
+        with self._cond:
+            self._cpu_used -= claim.cpu
+            self._uploads_used -= 1 if claim.upload else 0
+            self._reserved_kb -= claim.space_kb
+            if claim.read_device is not None:
+                self._devices_reading.discard(claim.read_device)
+            self._cond.notify_all()
+
+    @contextmanager
+    def claimed(self, claim):
+        logger.debug(f'waiting on {claim}')
+        self.acquire(claim)
+        try:
+            yield claim
+        finally:
+            self.release(claim)
+
+class Throttle(object):
+    '''
+    Caps the combined rate of every thread consuming from it: each consume(n) is given the
+    next n/rate seconds of the budget and sleeps until they start. No rate means no limit.
+    '''
+
+    bytes_per_second = None
+
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._available_at = 0
+
+    def consume(self, n):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._available_at, now)
+            self._available_at = start + n / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+class Serialized(object):
+    '''Proxy serializing every method call on an object that is not safe to share between threads'''
+
+    def __init__(self, obj):
+        self._obj = obj
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+class BackgroundQueue(object):
+    '''
+    Bounded queue drained in order by one background thread. Producers overlap with the
+    worker but block on put() once they are maxsize items ahead of it.
+    '''
+
+    _STOP = object()
+
+    def __init__(self, worker, maxsize=2, name='bckt-background'):
+        self.worker = worker
+        self.name = name
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._STOP:
+                    return
+                self.worker(item)
+            except:
+                logger.error(f'{self.name} failed on {item}')
+                logger.exception()
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._drain, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def close(self):
+        '''Waits for everything already queued to be worked'''
+        self._queue.put(self._STOP)
+        self._thread.join()
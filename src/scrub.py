@@ -0,0 +1,108 @@
+import math
+from enum import Enum
+from datetime import datetime, timedelta
+import cowpy
+from common import ArchiveDigest, DIGEST_BLOCK_SIZE, as_datetime
+
+logger = cowpy.getLogger()
+
+DEFAULT_SCRUB_DAYS = 30
+
+class ScrubLocation(Enum):
+    LOCAL = 'local'
+    REMOTE = 'remote'
+
+def plan_scrub(archives, locations, last_scrubbed, scrub_days=DEFAULT_SCRUB_DAYS, now=None, all_due=False):
+    '''
+    Picks this run's (archive, location) checks. A copy is due once its last scrub is scrub_days old
+    (or it never had one), oldest first, and a run takes a 1/scrub_days share of all copies so a
+    daily scrub covers everything every scrub_days days. all_due takes every due copy instead.
+
+    locations(archive) gives the ScrubLocations an archive has a copy in, last_scrubbed maps
+    (archive id, location value) to the last scrub time.
+    '''
+
+    now = now or datetime.now()
+    due_before = now - timedelta(days=scrub_days)
+
+    copies = []
+    for archive in archives:
+        for location in locations(archive):
+            copies.append((archive, location, as_datetime(last_scrubbed.get((archive['id'], location.value)))))
+
+    due = [ c for c in copies if c[2] is None or c[2] <= due_before ]
+    due.sort(key=lambda c: c[2] or datetime.min)
+
+    if all_due:
+        return [ (archive, location) for archive, location, _ in due ]
+
+    share = math.ceil(len(copies) / max(1, scrub_days))
+    return [ (archive, location) for archive, location, _ in due[:share] ]
+
+def scrub_local(filename, archive, throttle=None, etag_chunksize=None):
+    '''
+    Re-hashes a local archive against its recorded md5 (and checksum, if one was recorded).
+    Returns (ok, detail, etag), where etag is the S3 ETag the file would have, for the remote check.
+    '''
+
+    from awsclient import MultipartEtag
+
+    checksum_algorithm = archive['checksum'].split(':', 1)[0] if archive['checksum'] else None
+    digest = ArchiveDigest(checksum_algorithm)
+    etag = MultipartEtag(etag_chunksize) if etag_chunksize else None
+
+    with open(filename, 'rb') as f:
+        while True:
+            if throttle:
+                throttle.consume(DIGEST_BLOCK_SIZE)
+            block = f.read(DIGEST_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            if etag:
+                etag.update(block)
+
+    local_etag = etag.hexdigest() if etag else digest.md5
+
+    if not archive['md5']:
+        return True, f'no recorded md5, now {digest.md5}', local_etag
+    if digest.md5 != archive['md5']:
+        return False, f'md5 {digest.md5} does not match the recorded {archive["md5"]}', local_etag
+    if archive['checksum'] and digest.checksum != archive['checksum']:
+        return False, f'{checksum_algorithm} does not match the recorded checksum', local_etag
+    return True, 'md5 matches' + (f' and {checksum_algorithm}' if archive['checksum'] else ''), local_etag
+
+def scrub_remote(archive, obj, etag_chunksize=None, local_etag=None, last_etag=None):
+    '''
+    Checks a remote object from the bucket listing alone: present, the recorded size, and an ETag
+    matching the archive's md5 (one part uploads), its local copy, or the last scrub. Returns (ok, detail, etag)
+    '''
+
+    if obj is None:
+        return False, 'missing from the bucket', None
+
+    etag = obj.get('etag')
+    expected_kb = float(archive['size_kb']) if archive['size_kb'] not in (None, '') else None
+
+    if expected_kb is not None and abs(obj['size']/1024.0 - expected_kb) >= 1:
+        return False, f'{obj["size"]} bytes remote, {int(expected_kb*1024)} recorded', etag
+
+    if not etag:
+        return True, 'size matches, no ETag listed', etag
+
+    if etag_chunksize is None and archive['md5']:
+        if etag != archive['md5']:
+            return False, f'ETag {etag} does not match the recorded md5 {archive["md5"]}', etag
+        return True, 'size and ETag (md5) match', etag
+
+    if local_etag:
+        if etag != local_etag:
+            return False, f'ETag {etag} does not match the local copy ({local_etag})', etag
+        return True, 'size and ETag (local copy) match', etag
+
+    if last_etag:
+        if etag != last_etag:
+            return False, f'ETag {etag} changed since the last scrub ({last_etag})', etag
+        return True, 'size and ETag (last scrub) match', etag
+
+    return True, 'size matches, ETag recorded for next time', etag
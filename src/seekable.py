@@ -0,0 +1,221 @@
+import os
+import io
+import json
+import zlib
+import gzip
+import base64
+import bisect
+import tarfile
+import cowpy
+from manifest import Manifest
+
+logger = cowpy.getLogger()
+
+SEEK_INDEX_VERSION = 1
+DEFAULT_FRAME_SIZE = 8*1024*1024
+COPY_BUFFER_SIZE = 1024*1024
+
+class FrameWriter(object):
+    '''
+    Write-only file object gzip-compressing into a series of independent gzip members ("frames").
+    A new frame is cut whenever the current one has taken frame_size uncompressed bytes. The
+    concatenation is a valid .tar.gz for any gzip reader, and each frame can be decompressed alone.
+    '''
+
+    def __init__(self, fileobj, frame_size=DEFAULT_FRAME_SIZE, level=6, on_compressed=None):
+        self.fileobj = fileobj
+        self.frame_size = frame_size
+        self.level = level
+        self.on_compressed = on_compressed
+        # -- (uncompressed offset, compressed offset) of each frame start
+        self.frames = []
+        self.uncompressed_offset = 0
+        self.compressed_offset = 0
+        self._frame_uncompressed = 0
+        self._compressor = None
+
+    def _emit(self, data):
+        if data:
+            self.fileobj.write(data)
+            self.compressed_offset += len(data)
+            if self.on_compressed:
+                self.on_compressed(data)
+
+    def _start_frame(self):
+        self.frames.append((self.uncompressed_offset, self.compressed_offset))
+        self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        self._frame_uncompressed = 0
+
+    def _end_frame(self):
+        if self._compressor:
+            self._emit(self._compressor.flush(zlib.Z_FINISH))
+            self._compressor = None
+
+    def tell(self):
+        return self.uncompressed_offset
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            if not self._compressor or self._frame_uncompressed >= self.frame_size:
+                self._end_frame()
+                self._start_frame()
+            take = min(len(view), self.frame_size - self._frame_uncompressed)
+            self._emit(self._compressor.compress(view[:take]))
+            self._frame_uncompressed += take
+            self.uncompressed_offset += take
+            view = view[take:]
+        return len(data)
+
+    def close(self):
+        self._end_frame()
+
+class SeekIndex(object):
+    '''Frame table plus the uncompressed tar offset/extent of every regular file member'''
+
+    def __init__(self, frames=None, members=None, offsets=None, lengths=None, compressed_size=None):
+        self.frames = frames or []
+        self.members = members or []
+        self.offsets = offsets or []
+        self.lengths = lengths or []
+        self.compressed_size = compressed_size
+        self._member_lookup = None
+
+    def add_member(self, name, offset, length):
+        self.members.append(name)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def lookup(self, name):
+        if self._member_lookup is None:
+            self._member_lookup = { m: i for i, m in enumerate(self.members) }
+        return self._member_lookup.get(name.lstrip('/'))
+
+    def byte_range(self, name):
+        '''
+        (compressed start, compressed end or None for EOF, uncompressed bytes to skip in the range)
+        covering the tar header and data of member name
+        '''
+        i = self.lookup(name)
+        if i is None:
+            return None
+        frame_starts = [ f[0] for f in self.frames ]
+        start = self.offsets[i]
+        end = start + self.lengths[i]
+        first = bisect.bisect_right(frame_starts, start) - 1
+        last = bisect.bisect_left(frame_starts, end) - 1
+        compressed_start = self.frames[first][1]
+        compressed_end = self.frames[last + 1][1] if last + 1 < len(self.frames) else self.compressed_size
+        return compressed_start, compressed_end, start - self.frames[first][0]
+
+    def encode(self):
+        columns = {
+            'v': SEEK_INDEX_VERSION,
+            'frames': self.frames,
+            'members': self.members,
+            'offsets': self.offsets,
+            'lengths': self.lengths,
+            'compressed_size': self.compressed_size
+        }
+        packed = zlib.compress(json.dumps(columns, separators=(',', ':')).encode('utf-8'), 9)
+        return base64.b64encode(packed).decode('ascii')
+
+    @staticmethod
+    def decode(blob):
+        columns = json.loads(zlib.decompress(base64.b64decode(blob)).decode('utf-8'))
+        return SeekIndex(
+            frames=[ tuple(f) for f in columns['frames'] ],
+            members=columns['members'],
+            offsets=columns['offsets'],
+            lengths=columns['lengths'],
+            compressed_size=columns['compressed_size'])
+
+def _tar_block_length(size):
+    return tarfile.BLOCKSIZE * ((size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE)
+
+def write_seekable_archive(target_file, entries, frame_size=DEFAULT_FRAME_SIZE, on_compressed=None, on_error=None):
+    '''
+    Writes scanned entries as a framed .tar.gz and returns (SeekIndex, Manifest).
+    Member names follow tar: absolute paths with the leading slash removed.
+    '''
+
+    seek_index = SeekIndex()
+    manifest = Manifest()
+
+    with open(target_file, 'wb') as f:
+        writer = FrameWriter(f, frame_size=frame_size, on_compressed=on_compressed)
+        tar = tarfile.open(fileobj=writer, mode='w', format=tarfile.GNU_FORMAT)
+        tar.copybufsize = COPY_BUFFER_SIZE
+        try:
+            for entry in entries:
+                arcname = entry.path.lstrip('/')
+                try:
+                    tarinfo = tar.gettarinfo(entry.path, arcname)
+                    if tarinfo is None:
+                        continue
+                    member_offset = tar.offset
+                    if tarinfo.isreg():
+                        with open(entry.path, 'rb') as member_file:
+                            tar.addfile(tarinfo, member_file)
+                        # -- header blocks (including any long name headers) plus padded data
+                        seek_index.add_member(arcname, member_offset, tar.offset - member_offset)
+                        manifest.add(entry.path, tarinfo.size, tarinfo.mtime)
+                    else:
+                        tar.addfile(tarinfo)
+                except OSError as ose:
+                    if on_error:
+                        on_error(entry.path, ose)
+                    else:
+                        logger.warning(f'skipping {entry.path}: {ose}')
+        finally:
+            tar.close()
+            writer.close()
+        seek_index.frames = writer.frames
+        seek_index.compressed_size = writer.compressed_offset
+
+    return seek_index, manifest
+
+def extract_member(stream, skip, destination_folder):
+    '''
+    Extracts the first tar member found skip uncompressed bytes into stream, a file object
+    positioned at a frame boundary (a local file seeked there, or the body of a ranged GET)
+    '''
+
+    gz = gzip.GzipFile(fileobj=stream, mode='rb')
+    while skip > 0:
+        chunk = gz.read(min(skip, COPY_BUFFER_SIZE))
+        if not chunk:
+            raise Exception(f'Archive stream ended {skip} bytes before the member offset')
+        skip -= len(chunk)
+
+    tar = tarfile.open(fileobj=gz, mode='r|')
+    member = tar.next()
+    if member is None:
+        raise Exception('No tar member found at the indexed offset')
+    tar.extract(member, path=destination_folder, set_attrs=True)
+    return os.path.join(destination_folder, member.name)
+
+class RangeReader(io.RawIOBase):
+    '''Bounded read-only view of [start, end) of a local file'''
+
+    def __init__(self, filename, start, end):
+        self.f = open(filename, 'rb')
+        self.f.seek(start)
+        self.remaining = (end - start) if end is not None else None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        want = len(b) if self.remaining is None else min(len(b), self.remaining)
+        if want <= 0:
+            return 0
+        data = self.f.read(want)
+        b[:len(data)] = data
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.f.close()
+        super().close()
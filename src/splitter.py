@@ -0,0 +1,153 @@
+import os
+import time
+import cowpy
+from scanner import scan_path
+
+logger = cowpy.getLogger()
+
+# -- subtrees deeper than this are counted in their ancestor at this depth, bounding memory to the top of the tree
+MAX_DEPTH = 6
+
+# -- files modified within this many days count as recently changed
+CHANGE_WINDOW_DAYS = 7
+
+# -- share of a part's weight from recent change rather than size
+CHANGE_WEIGHT = 0.5
+
+class Subtree(object):
+    '''Files directly in a folder (or, at MAX_DEPTH, anywhere below it) and, once totalled, under it'''
+
+    __slots__ = ('relpath', 'children', 'files', 'bytes', 'changed_files', 'changed_bytes', 'total')
+
+    def __init__(self, relpath):
+        self.relpath = relpath
+        self.children = {}
+        self.files = 0
+        self.bytes = 0
+        self.changed_files = 0
+        self.changed_bytes = 0
+        self.total = None
+
+    def child(self, name):
+        if name not in self.children:
+            self.children[name] = Subtree(f'{self.relpath}/{name}' if self.relpath else name)
+        return self.children[name]
+
+def _stats(files=0, size=0, changed_files=0, changed_bytes=0):
+    return { 'files': files, 'bytes': size, 'changed_files': changed_files, 'changed_bytes': changed_bytes }
+
+def _add(a, b):
+    return { k: a[k] + b[k] for k in a }
+
+def collect_subtrees(path, excludes=None, one_file_system=True, max_depth=MAX_DEPTH, change_window_days=CHANGE_WINDOW_DAYS):
+    '''One scan of path into a Subtree per folder down to max_depth, with totals filled in'''
+
+    since = time.time() - change_window_days*24*60*60
+    root = Subtree('')
+
+    for entry in scan_path(path, excludes, one_file_system=one_file_system):
+        if not entry.relpath:
+            continue
+        parts = entry.relpath.split('/')
+        node = root
+        for name in (parts if entry.is_dir() else parts[:-1])[:max_depth]:
+            node = node.child(name)
+        if entry.is_file():
+            node.files += 1
+            node.bytes += entry.size
+            if entry.mtime >= since:
+                node.changed_files += 1
+                node.changed_bytes += entry.size
+
+    _total(root)
+    return root
+
+def _total(node):
+    node.total = _stats(node.files, node.bytes, node.changed_files, node.changed_bytes)
+    for child in node.children.values():
+        node.total = _add(node.total, _total(child))
+    return node.total
+
+def _weigher(root, change_weight):
+    '''A part's weight: its share of all bytes, blended with its share of recently changed bytes'''
+    total_bytes = max(1, root.total['bytes'])
+    total_changed = root.total['changed_bytes']
+    if total_changed == 0:
+        change_weight = 0
+    def weight(stats):
+        return (1 - change_weight)*stats['bytes']/total_bytes + (change_weight*stats['changed_bytes']/total_changed if change_weight else 0)
+    return weight
+
+def _carve(root, threshold, weight):
+    '''
+    Post-order pass: a subtree becomes its own part once what is left of it (after parts carved
+    below it) weighs at least threshold. Returns [ (subtree, its part's stats, carved subtrees directly below) ], root's part first
+    '''
+    parts = []
+
+    def visit(node):
+        residual = _stats(node.files, node.bytes, node.changed_files, node.changed_bytes)
+        carved_below = []
+        for name in sorted(node.children):
+            (child_residual, child_carved,) = visit(node.children[name])
+            residual = _add(residual, child_residual)
+            carved_below.extend(child_carved)
+        if node is not root and weight(residual) >= threshold:
+            parts.append((node, residual, carved_below))
+            return _stats(), [ node ]
+        return residual, carved_below
+
+    (root_residual, root_carved,) = visit(root)
+    return [ (root, root_residual, root_carved) ] + parts
+
+def propose_split(root, parts, change_weight=CHANGE_WEIGHT):
+    '''
+    The carving whose part count comes closest to parts without going over, found by bisecting the
+    weight threshold. Each part is a path and the subtrees carved out below it, which become its excludes.
+    '''
+
+    weight = _weigher(root, change_weight)
+
+    low = 0.0
+    high = 1.0
+    best = _carve(root, high, weight)
+    for _ in range(40):
+        middle = (low + high) / 2
+        candidate = _carve(root, middle, weight)
+        if len(candidate) > parts:
+            low = middle
+        else:
+            high = middle
+            best = candidate
+
+    proposal = []
+    for node, stats, carved in best:
+        excludes = [ os.path.relpath(c.relpath, node.relpath) if node.relpath else c.relpath for c in carved ]
+        proposal.append({
+            'relpath': node.relpath,
+            'excludes': excludes,
+            'ambiguous': _ambiguous_excludes(node, excludes),
+            'stats': stats,
+            'weight': weight(stats)
+        })
+    return proposal
+
+def _ambiguous_excludes(node, excludes):
+    '''
+    Excludes are matched unanchored (by tar and the scanner alike), so "docs" also excludes a/docs.
+    These are the excludes that match some other folder under node as well as the one carved out.
+    '''
+    ambiguous = []
+    for exclude in excludes:
+        matches = 0
+        stack = [ (node, '') ]
+        while stack and matches < 2:
+            (subtree, relpath,) = stack.pop()
+            for name, child in subtree.children.items():
+                child_relpath = f'{relpath}/{name}' if relpath else name
+                if child_relpath == exclude or child_relpath.endswith(f'/{exclude}'):
+                    matches += 1
+                stack.append((child, child_relpath))
+        if matches > 1:
+            ambiguous.append(exclude)
+    return ambiguous
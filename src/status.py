@@ -0,0 +1,134 @@
+import os
+import json
+import threading
+from datetime import datetime
+import cowpy
+from common import frequency_to_minutes, time_since, as_datetime
+from locks import FileLock
+
+logger = cowpy.getLogger()
+
+STATUS_FILENAME = 'bckt-status.json'
+
+# -- last_reason values that are a target doing what it should
+QUIET_REASONS = [ 'ok', 'not_scheduled', 'not_active', 'nothing_new', 'locked' ]
+
+class StatusFile(object):
+    '''
+    Per-target outcome of the latest runs, kept as a small JSON file next to the archives
+    so status can be read without touching S3 or the target paths
+    '''
+
+    filename = None
+
+    _lock = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def read(self):
+        try:
+            with open(self.filename, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return { 'targets': {} }
+
+    def record(self, target_name, reasons, at=None):
+        '''Merges one target's run outcome in, replacing the file atomically'''
+        at = datetime.strftime(at or datetime.now(), "%Y-%m-%d %H:%M:%S")
+        # -- other processes (a cron run beside the daemon) merge into the same file, so the read and replace are one step for them too
+        with self._lock, FileLock(f'{self.filename}.lock', blocking=True):
+            status = self.read()
+            entry = status['targets'].setdefault(target_name, {})
+            entry['last_run_at'] = at
+            entry['last_results'] = reasons
+            failures = [ r for r in reasons if r not in QUIET_REASONS + [ 'archive_created', 'no_new_files' ] ]
+            if failures:
+                entry['last_failure_at'] = at
+                entry['last_failure'] = failures[0]
+            elif reasons:
+                # -- a clean run clears the target's failure
+                entry.pop('last_failure_at', None)
+                entry.pop('last_failure', None)
+            status['updated_at'] = at
+            temp_filename = f'{self.filename}.{os.getpid()}.tmp'
+            with open(temp_filename, 'w') as f:
+                json.dump(status, f)
+            os.replace(temp_filename, self.filename)
+
+def summarize(aggregates, run_status, cost_per_month, now=None):
+    '''
+    One status from the per-target aggregates (database) and run outcomes (status file):
+    the stalest active target, the most recent failure and the highest monthly cost
+    '''
+
+    now = now or datetime.now()
+    targets = []
+
+    for row in aggregates:
+        last_archive_at = as_datetime(row['last_archive_at'])
+        frequency_minutes = frequency_to_minutes(row['frequency']) if row['frequency'] else 0
+        minutes_since = (now - last_archive_at).total_seconds() / 60.0 if last_archive_at else None
+        run = run_status['targets'].get(row['name'], {})
+        targets.append({
+            'name': row['name'],
+            'is_active': bool(row['is_active']),
+            'last_reason': row['last_reason'],
+            'last_archive_at': datetime.strftime(last_archive_at, "%Y-%m-%d %H:%M:%S") if last_archive_at else None,
+            'minutes_since_last_archive': round(minutes_since) if minutes_since is not None else None,
+            # -- never archived is as stale as it gets
+            'cycles_behind': (minutes_since / frequency_minutes if minutes_since is not None else float('inf')) if frequency_minutes else 0,
+            'archive_count': row['archive_count'],
+            'remote_kb': row['remote_kb'] or 0,
+            'monthly_cost': cost_per_month((row['remote_kb'] or 0)*1024),
+            'last_run_at': run.get('last_run_at'),
+            'last_failure': run.get('last_failure'),
+            'last_failure_at': run.get('last_failure_at')
+        })
+
+    active = [ t for t in targets if t['is_active'] ]
+
+    stalest = max(active, key=lambda t: t['cycles_behind'], default=None)
+    if stalest and stalest['cycles_behind'] < 1:
+        stalest = None
+
+    failed = [ t for t in targets if t['last_failure_at'] ]
+    last_failure = max(failed, key=lambda t: t['last_failure_at'], default=None)
+    if not last_failure:
+        # -- no run has been recorded yet, fall back to what the database remembers
+        last_failure = next(( t for t in active if t['last_reason'] and t['last_reason'] not in QUIET_REASONS ), None)
+
+    costliest = max(targets, key=lambda t: t['monthly_cost'], default=None)
+
+    for t in targets:
+        if t['cycles_behind'] == float('inf'):
+            t['cycles_behind'] = None
+        else:
+            t['cycles_behind'] = round(t['cycles_behind'], 1)
+
+    return {
+        'generated_at': datetime.strftime(now, "%Y-%m-%d %H:%M:%S"),
+        'run_status_updated_at': run_status.get('updated_at'),
+        'stalest': stalest['name'] if stalest else None,
+        'stalest_since': time_since(stalest['minutes_since_last_archive']) if stalest and stalest['minutes_since_last_archive'] is not None else None,
+        'stalest_reason': stalest['last_reason'] if stalest else None,
+        'last_failure': last_failure['name'] if last_failure else None,
+        'last_failure_reason': (last_failure['last_failure'] or last_failure['last_reason']) if last_failure else None,
+        'costliest': costliest['name'] if costliest and costliest['monthly_cost'] > 0 else None,
+        'costliest_monthly': costliest['monthly_cost'] if costliest else 0,
+        'targets': targets
+    }
+
+def status_line(summary):
+    '''The one line for a status bar'''
+    parts = []
+    if summary['stalest']:
+        since = f'{summary["stalest_since"]} ago' if summary['stalest_since'] else 'never archived'
+        parts.append(f'stale: {summary["stalest"]} {since} ({summary["stalest_reason"] or "-"})')
+    else:
+        parts.append('all current')
+    if summary['last_failure']:
+        parts.append(f'failed: {summary["last_failure"]} ({summary["last_failure_reason"]})')
+    if summary['costliest']:
+        parts.append(f'top cost: {summary["costliest"]} ${summary["costliest_monthly"]:.2f}/mo')
+    return ' | '.join(parts)
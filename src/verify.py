@@ -0,0 +1,222 @@
+import zlib
+import tarfile
+import cowpy
+from common import PathSetSummary, human, DIGEST_BLOCK_SIZE
+
+logger = cowpy.getLogger()
+
+# -- most uncompressed bytes held at once, however well a block compresses
+DECOMPRESS_CHUNK = 4*1024*1024
+
+NUL_BLOCK = b'\0' * tarfile.BLOCKSIZE
+
+# -- members whose size field counts data blocks that follow the header
+DATA_TYPES = tarfile.REGULAR_TYPES + (tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK, tarfile.XHDTYPE, tarfile.XGLTYPE, tarfile.SOLARIS_XHDTYPE)
+
+def _block_length(size):
+    return tarfile.BLOCKSIZE * ((size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE)
+
+def _member_key(name, size):
+    return f'{name.lstrip("/")}\0{size}'
+
+class StreamVerifier(object):
+    '''
+    Checks a .tar.gz from its compressed bytes, fed in order as they are written or read.
+    Each gzip member is decompressed once (its CRC and length checked by zlib) and every tar
+    header is parsed and checksummed, while file data is only counted. finish() then compares
+    the regular files found with the archive's manifest.
+    '''
+
+    members = 0
+    files = 0
+    file_bytes = 0
+    compressed_bytes = 0
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        self._file_set = PathSetSummary()
+        self._decompressor = zlib.decompressobj(31)
+        self._in_gzip_member = False
+        self._header = bytearray()
+        self._skip = 0
+        self._collect = None
+        self._collect_type = None
+        self._collect_length = 0
+        self._next_name = None
+        self._next_size = None
+        self._end = False
+        self._finished = False
+
+    @property
+    def ok(self):
+        return self._finished and len(self.errors) == 0
+
+    def update(self, data):
+        '''Never raises, the first problem found is kept and everything after it ignored'''
+        if self.errors:
+            return
+        try:
+            self.compressed_bytes += len(data)
+            self._decompress(data)
+        except (zlib.error, tarfile.TarError, ValueError) as e:
+            self.errors.append(f'at compressed byte {self.compressed_bytes}: {e}')
+
+    def _decompress(self, data):
+        while True:
+            if data:
+                self._in_gzip_member = True
+            out = self._decompressor.decompress(data, DECOMPRESS_CHUNK)
+            if out:
+                self._walk(out)
+            if self._decompressor.eof:
+                # -- concatenated gzip members, as in seekable archives
+                data = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(31)
+                self._in_gzip_member = False
+                if not data:
+                    return
+                continue
+            data = self._decompressor.unconsumed_tail
+            if not data and not out:
+                return
+
+    def _walk(self, out):
+        view = memoryview(out)
+        pos = 0
+        while pos < len(view):
+            if self._skip:
+                take = min(self._skip, len(view) - pos)
+                if self._collect is not None:
+                    self._collect.extend(view[pos:pos + take])
+                self._skip -= take
+                pos += take
+                if self._skip == 0 and self._collect is not None:
+                    self._collected()
+                continue
+            if self._end:
+                # -- only zero padding may follow the end-of-archive block
+                if view[pos:].tobytes().strip(b'\0'):
+                    raise ValueError('data after the end-of-archive marker')
+                return
+            take = min(tarfile.BLOCKSIZE - len(self._header), len(view) - pos)
+            self._header.extend(view[pos:pos + take])
+            pos += take
+            if len(self._header) == tarfile.BLOCKSIZE:
+                self._read_header(bytes(self._header))
+                self._header.clear()
+
+    def _read_header(self, block):
+        if block == NUL_BLOCK:
+            self._end = True
+            return
+
+        # -- raises on a bad header checksum
+        tarinfo = tarfile.TarInfo.frombuf(block, 'utf-8', 'surrogateescape')
+        self.members += 1
+
+        # -- like tarfile, types it doesn't know (GNU dumpdirs in incrementals, for one) are taken to carry data
+        data_length = _block_length(tarinfo.size) if tarinfo.type in DATA_TYPES or tarinfo.type not in tarfile.SUPPORTED_TYPES else 0
+
+        if tarinfo.type in (tarfile.GNUTYPE_LONGNAME, tarfile.XHDTYPE, tarfile.SOLARIS_XHDTYPE):
+            # -- the next member's long name (or pax path/size) is in this one's data
+            self._collect = bytearray()
+            self._collect_type = tarinfo.type
+            self._collect_length = tarinfo.size
+        elif tarinfo.type not in (tarfile.GNUTYPE_LONGLINK, tarfile.XGLTYPE):
+            # -- GNU headers have no name prefix, incrementals keep atime/ctime where frombuf looks for one
+            header_name = tarfile.nts(block[0:100], 'utf-8', 'surrogateescape') if block[257:265] == tarfile.GNU_MAGIC else tarinfo.name
+            name = self._next_name or header_name
+            size = self._next_size if self._next_size is not None else tarinfo.size
+            self._next_name = None
+            self._next_size = None
+            if tarinfo.isreg():
+                self.files += 1
+                self.file_bytes += size
+                self._file_set.add(_member_key(name, size))
+                data_length = _block_length(size)
+
+        self._skip = data_length
+        if self._skip == 0 and self._collect is not None:
+            self._collected()
+
+    def _collected(self):
+        data = bytes(self._collect[:self._collect_length])
+        if self._collect_type == tarfile.GNUTYPE_LONGNAME:
+            self._next_name = data.rstrip(b'\0').decode('utf-8', 'surrogateescape')
+        else:
+            for keyword, value in self._pax_records(data):
+                if keyword == 'path':
+                    self._next_name = value
+                elif keyword == 'size':
+                    self._next_size = int(value)
+        self._collect = None
+        self._collect_type = None
+
+    def _pax_records(self, data):
+        pos = 0
+        while pos < len(data):
+            length = int(data[pos:data.index(b' ', pos)])
+            record = data[pos:pos + length].decode('utf-8', 'surrogateescape')
+            keyword, value = record.split(' ', 1)[1].rstrip('\n').split('=', 1)
+            yield keyword, value
+            pos += length
+
+    def finish(self, manifest=None):
+        '''Checks the stream ended cleanly and, given the manifest, that it holds exactly the manifest's files. Returns ok'''
+        self._finished = True
+        if not self.errors:
+            if self._in_gzip_member:
+                self.errors.append('compressed stream ends inside a gzip member (truncated)')
+            elif not self._end:
+                self.errors.append('no end-of-archive marker (truncated)')
+            elif self._skip or self._header:
+                self.errors.append('archive ends inside a member (truncated)')
+        if manifest is not None and not self.errors:
+            if len(manifest) != self.files:
+                self.errors.append(f'{self.files} files in the archive, {len(manifest)} in the manifest')
+            elif manifest.total_size() != self.file_bytes:
+                self.errors.append(f'{self.file_bytes} file bytes in the archive, {manifest.total_size()} in the manifest')
+            else:
+                expected = PathSetSummary()
+                for path, size, mtime in manifest.entries():
+                    expected.add(_member_key(path, size))
+                if expected.digest != self._file_set.digest:
+                    self.errors.append('member names differ from the manifest')
+        return self.ok
+
+    def summary(self):
+        status = 'ok' if self.ok else f'FAILED ({"; ".join(self.errors)})'
+        return f'{status}: {self.members} members, {self.files} files, {human(self.file_bytes, "b")} from {human(self.compressed_bytes, "b")} compressed'
+
+def verify_archive_file(filename, manifest=None, on_block=None):
+    '''Reads an existing archive once and returns its finished StreamVerifier. on_block also sees every block, for hashing in the same read'''
+    verifier = StreamVerifier()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(DIGEST_BLOCK_SIZE)
+            if not block:
+                break
+            if on_block:
+                on_block(block)
+            verifier.update(block)
+    verifier.finish(manifest)
+    return verifier
+
+def combine_verifiers(verifiers, manifest=None):
+    '''
+    One finished StreamVerifier for an archive written as volumes. Each volume was checked as a stream of
+    its own, so here only their counts and file sets are summed and compared with the whole archive's manifest.
+    '''
+    combined = StreamVerifier()
+    for number, verifier in enumerate(verifiers, 1):
+        combined.members += verifier.members
+        combined.files += verifier.files
+        combined.file_bytes += verifier.file_bytes
+        combined.compressed_bytes += verifier.compressed_bytes
+        combined.errors.extend([ f'volume {number}: {error}' for error in verifier.errors ])
+        combined.warnings.extend([ f'volume {number}: {warning}' for warning in verifier.warnings ])
+        combined._file_set.merge(verifier._file_set)
+    combined._end = True
+    combined.finish(manifest)
+    return combined
@@ -0,0 +1,105 @@
+import os
+import shutil
+import cowpy
+
+logger = cowpy.getLogger()
+
+# -- default volume size, of files read rather than compressed bytes written
+VOLUME_MB = 4096
+
+# -- volumes pushed, checked or extracted at once
+VOLUME_WORKERS = 4
+
+class _VolumeLists(object):
+    '''NUL separated member lists for tar -T, one per volume, only the last of them open'''
+
+    def __init__(self, folder, volume_bytes):
+        self.folder = folder
+        self.volume_bytes = volume_bytes
+        self.volumes = []
+        self._f = None
+
+    def _open(self):
+        number = len(self.volumes) + 1
+        if self._f:
+            self._f.close()
+        volume = { 'number': number, 'list_filename': os.path.join(self.folder, f'{number:04d}.list'), 'files': 0, 'bytes': 0, 'subtrees': [] }
+        self._f = open(volume['list_filename'], 'wb')
+        self.volumes.append(volume)
+        return volume
+
+    def volume_for(self, size):
+        '''The open volume, or a new one if size would take a non-empty volume past volume_bytes'''
+        if not self.volumes or (self.volumes[-1]['bytes'] > 0 and self.volumes[-1]['bytes'] + size > self.volume_bytes):
+            return self._open()
+        return self.volumes[-1]
+
+    def write(self, data):
+        self._f.write(data)
+
+    def close(self):
+        if self._f:
+            self._f.close()
+            self._f = None
+
+def _member(entry):
+    return entry.path.encode('utf-8', 'surrogateescape') + b'\0'
+
+def plan_volumes(entries, list_folder, volume_bytes, by_subtree=False):
+    '''
+    Streams scanned entries into per-volume member lists in list_folder, closing a volume once the
+    next unit would take it past volume_bytes. A unit is a file or, by_subtree, a whole top level
+    folder, which is never split (an oversized one is a volume to itself). Folders and links go in
+    whichever volume is open: tar recreates missing parents on extract, so every volume decodes alone.
+    Returns [ { number, list_filename, files, bytes, subtrees } ].
+    '''
+
+    lists = _VolumeLists(list_folder, volume_bytes)
+
+    # -- scan_path lists a folder's children before entering it, so a top level folder's contents arrive contiguously
+    unit_name = None
+    unit_files = 0
+    unit_bytes = 0
+    unit = open(os.path.join(list_folder, 'unit'), 'w+b')
+
+    def flush_unit():
+        volume = lists.volume_for(unit_bytes)
+        unit.seek(0)
+        shutil.copyfileobj(unit, lists)
+        unit.seek(0)
+        unit.truncate()
+        volume['files'] += unit_files
+        volume['bytes'] += unit_bytes
+        volume['subtrees'].append(unit_name)
+
+    try:
+        for entry in entries:
+            size = entry.size if entry.is_file() else 0
+            name = entry.relpath.split('/')[0] if by_subtree and entry.relpath.find('/') > 0 else None
+
+            if name != unit_name and unit_name is not None:
+                flush_unit()
+                unit_files = 0
+                unit_bytes = 0
+            unit_name = name
+
+            if name is None:
+                volume = lists.volume_for(size)
+                lists.write(_member(entry))
+                if entry.is_file():
+                    volume['files'] += 1
+                    volume['bytes'] += size
+            else:
+                unit.write(_member(entry))
+                if entry.is_file():
+                    unit_files += 1
+                    unit_bytes += size
+
+        if unit_name is not None:
+            flush_unit()
+    finally:
+        unit.close()
+        lists.close()
+        os.unlink(os.path.join(list_folder, 'unit'))
+
+    return lists.volumes
@@ -0,0 +1,91 @@
+import os
+import random
+import sqlite3
+import pytest
+from chunkstore import ChunkStore, CHUNK_MIN
+from scanner import scan_path
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _packs(store):
+    return sorted(os.listdir(store.packs_folder))
+
+@pytest.fixture
+def source(tmp_path):
+    rand = random.Random(44)
+    folder = str(tmp_path / 'source')
+    files = {
+        'shared.bin': rand.randbytes(3*CHUNK_MIN),
+        'one/only.bin': rand.randbytes(2*CHUNK_MIN),
+        'small.txt': b'small file\n',
+    }
+    for name, data in files.items():
+        _write(os.path.join(folder, name), data)
+    return folder, files
+
+def test_put_get_round_trip_stores_a_chunk_once(tmp_path):
+    store = ChunkStore(str(tmp_path / 'store'))
+    data = random.Random(1).randbytes(CHUNK_MIN)
+    with store.writing():
+        (digest, stored,) = store.put(data)
+        (again, stored_again,) = store.put(data)
+    assert stored > 0 and stored_again == 0 and again == digest
+    assert store.get(digest) == data
+
+def test_archive_restores_and_gc_keeps_only_what_is_retained(tmp_path, source):
+    (folder, files,) = source
+    store = ChunkStore(str(tmp_path / 'store'))
+
+    with store.writing():
+        (manifest, stats,) = store.write_archive('first.dedup', scan_path(folder))
+    assert stats['files'] == len(files)
+
+    # -- the second archive shares one file with the first and replaces the other
+    os.unlink(os.path.join(folder, 'one/only.bin'))
+    _write(os.path.join(folder, 'two/other.bin'), random.Random(45).randbytes(2*CHUNK_MIN))
+    with store.writing():
+        (manifest, stats,) = store.write_archive('second.dedup', scan_path(folder))
+    assert stats['new_chunks'] < stats['chunks']
+
+    # -- the first archive's pack is still mostly live, so its dead chunks stay until it crosses the repack ratio
+    (stats, remote_deleted,) = store.gc([ 'second.dedup' ])
+    assert stats['recipes'] == 1 and remote_deleted == []
+    assert store.get_recipe('first.dedup') is None
+
+    restored = str(tmp_path / 'restored')
+    store.restore_archive('second.dedup', restored)
+    for name in [ 'shared.bin', 'small.txt', 'two/other.bin' ]:
+        assert _read(os.path.join(restored, folder.lstrip('/'), name)) == _read(os.path.join(folder, name))
+
+    store.gc([])
+    assert _packs(store) == []
+
+def test_gc_keeps_packs_when_the_index_does_not_commit(tmp_path, source):
+    (folder, files,) = source
+    store = ChunkStore(str(tmp_path / 'store'))
+    with store.writing():
+        store.write_archive('first.dedup', scan_path(folder))
+    packs = _packs(store)
+
+    # -- the index still points into every pack after the rollback, so every pack has to still be there
+    real_conn = store._conn
+    class FailingCommit(object):
+        def __getattr__(self, name):
+            return getattr(real_conn, name)
+        def commit(self):
+            raise sqlite3.OperationalError('disk I/O error')
+    store._conn = FailingCommit()
+    with pytest.raises(sqlite3.OperationalError):
+        store.gc([])
+    store._conn = real_conn
+
+    assert _packs(store) == packs
+    restored = str(tmp_path / 'restored')
+    assert store.restore_archive('first.dedup', restored) == len(files)
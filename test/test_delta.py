@@ -0,0 +1,55 @@
+import os
+import random
+import pytest
+from delta import write_signature, write_delta, apply_delta, DELTA_MIN_BLOCK_SIZE
+
+BASE = { 'archive_id': 1, 'archive_filename': 'target_20240101_000000.tar.gz', 'member': 'data/large.bin' }
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+@pytest.fixture
+def base(tmp_path):
+    data = random.Random(46).randbytes(8*DELTA_MIN_BLOCK_SIZE + 1234)
+    path = str(tmp_path / 'large.bin')
+    _write(path, data)
+    signature = str(tmp_path / 'signatures' / 'large.sig')
+    write_signature(path, signature, BASE)
+    base_copy = str(tmp_path / 'large.base')
+    _write(base_copy, data)
+    return path, signature, base_copy, data
+
+def test_delta_round_trip_after_insert_and_overwrite(tmp_path, base):
+    (path, signature, base_copy, data,) = base
+    # -- an insert shifts everything after it off block boundaries, an overwrite changes one block in place
+    changed = bytearray(data[:3*DELTA_MIN_BLOCK_SIZE + 100] + b'inserted bytes' * 50 + data[3*DELTA_MIN_BLOCK_SIZE + 100:])
+    changed[6*DELTA_MIN_BLOCK_SIZE:6*DELTA_MIN_BLOCK_SIZE + 10] = b'0123456789'
+    _write(path, bytes(changed))
+
+    delta = str(tmp_path / 'large.delta')
+    header = write_delta(path, signature, delta, 'data/large.bin')
+    assert header['literal_bytes'] < len(changed) / 2
+
+    rebuilt = str(tmp_path / 'large.rebuilt')
+    apply_delta(delta, base_copy, rebuilt)
+    assert _read(rebuilt) == bytes(changed)
+
+def test_delta_gives_up_past_max_literal_bytes(tmp_path, base):
+    (path, signature, base_copy, data,) = base
+    _write(path, random.Random(47).randbytes(len(data)))
+    assert write_delta(path, signature, str(tmp_path / 'large.delta'), 'data/large.bin', max_literal_bytes=len(data) // 2) is None
+
+def test_truncated_delta_is_rejected(tmp_path, base):
+    (path, signature, base_copy, data,) = base
+    _write(path, data[:DELTA_MIN_BLOCK_SIZE] + b'changed' + data[DELTA_MIN_BLOCK_SIZE:])
+    delta = str(tmp_path / 'large.delta')
+    write_delta(path, signature, delta, 'data/large.bin')
+    with open(delta, 'r+b') as f:
+        f.truncate(os.path.getsize(delta) - 1)
+    with pytest.raises(ValueError):
+        apply_delta(delta, base_copy, str(tmp_path / 'large.rebuilt'))
@@ -0,0 +1,45 @@
+import os
+import random
+import pytest
+from seekable import write_seekable_archive, extract_member, SeekIndex, RangeReader
+from scanner import scan_path
+
+FRAME_SIZE = 64*1024
+
+@pytest.fixture
+def archive(tmp_path):
+    rand = random.Random(27)
+    folder = str(tmp_path / 'source')
+    files = { f'dir{i % 3}/file{i}.bin': rand.randbytes(rand.randrange(1, 3*FRAME_SIZE)) for i in range(12) }
+    files['empty.txt'] = b''
+    for name, data in files.items():
+        path = os.path.join(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    target_file = str(tmp_path / 'source.tar.gz')
+    (seek_index, manifest,) = write_seekable_archive(target_file, scan_path(folder), frame_size=FRAME_SIZE)
+    return target_file, folder, files, seek_index, manifest
+
+def test_every_member_extracts_from_its_byte_range_alone(tmp_path, archive):
+    (target_file, folder, files, seek_index, manifest,) = archive
+    assert len(seek_index.frames) > 1
+    assert len(manifest) == len(files)
+
+    # -- the index goes through the database encoded, so extract with the decoded copy
+    seek_index = SeekIndex.decode(seek_index.encode())
+
+    for name, data in files.items():
+        path = os.path.join(folder, name)
+        (start, end, skip,) = seek_index.byte_range(path)
+        destination = str(tmp_path / 'restored' / name.replace('/', '_'))
+        os.makedirs(destination)
+        with RangeReader(target_file, start, end) as stream:
+            extracted = extract_member(stream, skip, destination)
+        assert extracted == os.path.join(destination, path.lstrip('/'))
+        with open(extracted, 'rb') as f:
+            assert f.read() == data
+
+def test_unknown_member_has_no_byte_range(archive):
+    (target_file, folder, files, seek_index, manifest,) = archive
+    assert seek_index.byte_range(os.path.join(folder, 'missing.bin')) is None
@@ -0,0 +1,60 @@
+import os
+import random
+import subprocess
+import pytest
+from manifest import manifest_from_tar_index, Manifest
+from verify import verify_archive_file
+
+@pytest.fixture
+def archive(tmp_path):
+    rand = random.Random(41)
+    folder = str(tmp_path / 'source')
+    os.makedirs(os.path.join(folder, 'sub'))
+    for name in [ 'a.bin', 'sub/b.bin', 'name with spaces.bin', 'tab\tand\nnewline.bin' ]:
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(rand.randbytes(rand.randrange(1000, 200*1024)))
+    target_file = str(tmp_path / 'source.tar.gz')
+    index_file = str(tmp_path / 'source.index')
+    # -- written the way bckt writes a tar archive, the index becoming its manifest
+    with open(target_file, 'wb') as f:
+        subprocess.run([ 'tar', '-vv', '--full-time', '--quoting-style=escape', f'--index-file={index_file}', '-cz', '-f', '-', folder ], stdout=f, stderr=subprocess.DEVNULL, check=True)
+    return target_file, manifest_from_tar_index(index_file)
+
+def _copy(target_file, filename, length):
+    with open(target_file, 'rb') as f, open(filename, 'wb') as out:
+        out.write(f.read(length))
+    return filename
+
+def test_complete_archive_verifies_against_its_manifest(archive):
+    (target_file, manifest,) = archive
+    verifier = verify_archive_file(target_file, manifest)
+    assert verifier.ok, verifier.errors
+    assert verifier.files == len(manifest) == 4
+
+@pytest.mark.parametrize('keep', [ 0.25, 0.5, 0.9, 0.999 ])
+def test_truncated_archive_is_rejected(tmp_path, archive, keep):
+    (target_file, manifest,) = archive
+    size = os.path.getsize(target_file)
+    truncated = _copy(target_file, str(tmp_path / 'truncated.tar.gz'), int(size*keep))
+    verifier = verify_archive_file(truncated)
+    assert not verifier.ok
+    assert 'truncated' in '; '.join(verifier.errors)
+
+def test_corrupted_archive_is_rejected(tmp_path, archive):
+    (target_file, manifest,) = archive
+    corrupted = _copy(target_file, str(tmp_path / 'corrupted.tar.gz'), os.path.getsize(target_file))
+    with open(corrupted, 'r+b') as f:
+        f.seek(os.path.getsize(corrupted) // 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([ byte[0] ^ 0xff ]))
+    assert not verify_archive_file(corrupted, manifest).ok
+
+def test_member_names_differing_from_the_manifest_are_rejected(archive):
+    (target_file, manifest,) = archive
+    renamed = Manifest()
+    for path, size, mtime in manifest.entries():
+        renamed.add(path + '.renamed', size, mtime)
+    verifier = verify_archive_file(target_file, renamed)
+    assert not verifier.ok
+    assert 'member names differ from the manifest' in verifier.errors